@@ -1,11 +1,19 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
+import re
 from dataclasses import dataclass
-from typing import Any
+from typing import TYPE_CHECKING, Any, AsyncIterator
+from urllib.parse import parse_qs, urlparse
 
 from yt_dlp import YoutubeDL
 
+from extraction_pool import ExtractionPool
+
+if TYPE_CHECKING:
+    from resolve_cache import ResolveCache
+
 
 @dataclass
 class AudioSource:
@@ -13,34 +21,171 @@ class AudioSource:
     title: str
     duration: int | None
     metadata: dict[str, Any]
+    expires_at: float | None = None
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def youtube_video_id(url: str) -> str | None:
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.").removeprefix("music.")
+    if host == "youtu.be":
+        return parsed.path.strip("/") or None
+    if host != "youtube.com":
+        return None
+    if parsed.path == "/watch":
+        return parse_qs(parsed.query).get("v", [None])[0]
+    for prefix in ("/shorts/", "/live/", "/embed/"):
+        if parsed.path.startswith(prefix):
+            return parsed.path[len(prefix) :].strip("/") or None
+    return None
+
+
+def cache_keys(query: str) -> list[str]:
+    keys = [f"q:{normalize_query(query)}"]
+    video_id = youtube_video_id(query)
+    if video_id:
+        # Every URL form of a YouTube video shares the id key yt-dlp reports after extraction.
+        keys.insert(0, f"id:youtube:{video_id}")
+    return keys
+
+
+def stream_expiry(stream_url: str) -> float | None:
+    # Signed googlevideo URLs carry their own expiry as a unix timestamp.
+    expire = parse_qs(urlparse(stream_url).query).get("expire", [None])[0]
+    return float(expire) if expire and expire.isdigit() else None
+
+
+YTDL_OPTIONS: dict[str, Any] = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "noplaylist": True,
+    "default_search": "auto",
+}
+
+
+async def _run_ffmpeg(*args: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr[-500:].decode(errors='replace')}")
+    return stderr
+
+
+async def measure_loudness(path: str) -> float:
+    # EBU R128 integrated loudness; ebur128 prints its summary to stderr.
+    stderr = await _run_ffmpeg("-i", path, "-vn", "-af", "ebur128=framelog=quiet", "-f", "null", "-")
+    found = re.findall(rb"I:\s+(-?\d+(?:\.\d+)?) LUFS", stderr)
+    if not found:
+        raise RuntimeError(f"No loudness measurement for {path}")
+    return float(found[-1])
 
 
 class AudioStreamer:
-    def __init__(self) -> None:
-        self._ytdl = YoutubeDL(
+    def __init__(self, cache: ResolveCache | None = None, extractor: ExtractionPool | None = None) -> None:
+        self._cache = cache
+        self._inflight: dict[str, asyncio.Future[AudioSource]] = {}
+        self._extractor = extractor or ExtractionPool(YTDL_OPTIONS)
+        # Flat extraction lists playlist entries without resolving any of them.
+        self._flat_ytdl = YoutubeDL(
             {
-                "format": "bestaudio/best",
                 "quiet": True,
-                "noplaylist": True,
-                "default_search": "auto",
+                "extract_flat": "in_playlist",
+                "lazy_playlist": True,
             }
         )
 
-    async def resolve(self, query: str) -> AudioSource:
-        loop = asyncio.get_running_loop()
-        info = await loop.run_in_executor(None, lambda: self._ytdl.extract_info(query, download=False))
+    async def close(self) -> None:
+        await self._extractor.close()
+
+    @staticmethod
+    def is_playlist(query: str) -> bool:
+        parsed = urlparse(query)
+        if not parsed.scheme or not parsed.netloc:
+            return False
+        if parsed.path.rstrip("/").endswith("/playlist"):
+            return True
+        # watch?v=X&list=RD… is a single video shared from inside a mix; play just the video.
+        params = parse_qs(parsed.query)
+        return "list" in params and "v" not in params and parsed.netloc != "youtu.be"
+
+    async def resolve(self, query: str, refresh: bool = False) -> AudioSource:
+        keys = cache_keys(query)
+        if self._cache is not None and not refresh:
+            cached = await self._cache.get(keys)
+            if cached is not None:
+                return cached
+        # Concurrent resolves of the same track share one extraction. The shield keeps a
+        # cancelled waiter from cancelling the job the others are still waiting on.
+        job = self._inflight.get(keys[0])
+        if job is None:
+            job = asyncio.ensure_future(self._extract(query, keys))
+            self._inflight[keys[0]] = job
+            job.add_done_callback(lambda _: self._inflight.pop(keys[0], None))
+        return await asyncio.shield(job)
+
+    async def _extract(self, query: str, keys: list[str]) -> AudioSource:
+        info = await self._extractor.extract(query)
         if "entries" in info:
             info = info["entries"][0]
-        return AudioSource(
+        source = AudioSource(
             url=info["url"],
             title=info.get("title") or "Unknown",
             duration=info.get("duration"),
             metadata={
+                "id": info.get("id"),
                 "webpage_url": info.get("webpage_url"),
                 "uploader": info.get("uploader"),
                 "thumbnail": info.get("thumbnail"),
             },
+            expires_at=stream_expiry(info["url"]),
+        )
+        if self._cache is not None:
+            if info.get("id") and info.get("extractor_key"):
+                keys.append(f"id:{info['extractor_key'].lower()}:{info['id']}")
+            if info.get("webpage_url"):
+                keys.extend(cache_keys(info["webpage_url"]))
+            await self._cache.put(keys, source)
+        return source
+
+    async def iter_playlist(self, url: str, chunk_size: int = 100) -> AsyncIterator[tuple[str, list[AudioSource]]]:
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(
+            None, lambda: self._flat_ytdl.extract_info(url, download=False, process=False)
+        )
+        title = info.get("title") or "Playlist"
+        entries = iter(info.get("entries") or [info])
+        while True:
+            chunk = await loop.run_in_executor(None, lambda: list(itertools.islice(entries, chunk_size)))
+            if not chunk:
+                return
+            yield title, [self._flat_source(entry) for entry in chunk if entry and entry.get("url")]
+
+    @staticmethod
+    def _flat_source(entry: dict[str, Any]) -> AudioSource:
+        webpage_url = entry.get("webpage_url") or entry["url"]
+        return AudioSource(
+            url=webpage_url,
+            title=entry.get("title") or "Unknown",
+            duration=entry.get("duration"),
+            metadata={
+                "webpage_url": webpage_url,
+                "uploader": entry.get("uploader"),
+                "thumbnail": None,
+            },
         )
 
-    async def normalize_volume(self, input_path: str, output_path: str) -> None:
-        raise NotImplementedError("Volume normalization should be implemented with ffmpeg")
+    async def normalize_volume(self, input_path: str, output_path: str, target_lufs: float = -14.0) -> float:
+        # One analysis pass, then a static gain: far cheaper than running loudnorm on every play.
+        gain = round(target_lufs - await measure_loudness(input_path), 2)
+        await _run_ffmpeg("-y", "-i", input_path, "-vn", "-af", f"volume={gain}dB", output_path)
+        return gain
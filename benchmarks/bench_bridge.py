@@ -0,0 +1,121 @@
+"""Bridge transports: pub/sub versus Redis Streams with a consumer group.
+
+Measures messages/sec for back-to-back publishes, end-to-end latency for paced ones,
+and how many actions sent while the player was down reach it once it is back.
+
+Needs a Redis server. Run with ``REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_bridge.py``;
+the benchmark deletes its own stream key but otherwise leaves the database alone.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import redis.asyncio as redis
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from bridge_transport import BridgeTransport, PubSubTransport, StreamTransport  # noqa: E402
+
+CHANNEL = "bench_bridge"
+
+
+def _transport(kind: str, redis_url: str) -> BridgeTransport:
+    if kind == "streams":
+        return StreamTransport(redis_url, stream=CHANNEL, group="bench", consumer="bench", block_ms=100)
+    return PubSubTransport(redis_url, channel=CHANNEL)
+
+
+async def _consume(transport: BridgeTransport, count: int, latencies: list[float], ready: asyncio.Event) -> None:
+    stream = transport.subscribe()
+    first = asyncio.ensure_future(stream.__anext__())
+    # Pub/sub only delivers to subscriptions that exist; give it a moment to register.
+    await asyncio.sleep(0.2)
+    ready.set()
+    payload = await first
+    latencies.append(time.perf_counter() - payload["sent"])
+    while len(latencies) < count:
+        payload = await stream.__anext__()
+        latencies.append(time.perf_counter() - payload["sent"])
+    await stream.aclose()
+
+
+async def _run(kind: str, redis_url: str, count: int, interval: float) -> list[float]:
+    publisher = _transport(kind, redis_url)
+    subscriber = _transport(kind, redis_url)
+    latencies: list[float] = []
+    ready = asyncio.Event()
+    consumer = asyncio.create_task(_consume(subscriber, count, latencies, ready))
+    await ready.wait()
+    for n in range(count):
+        await publisher.publish({"action": "vol_up", "chat_id": n, "sent": time.perf_counter()})
+        if interval:
+            await asyncio.sleep(interval)
+    await asyncio.wait_for(consumer, 30)
+    await publisher.close()
+    await subscriber.close()
+    return latencies
+
+
+async def _while_down(kind: str, redis_url: str, count: int) -> int:
+    # The player subscribed once, went away, and comes back after actions were sent.
+    subscriber = _transport(kind, redis_url)
+    stream = subscriber.subscribe()
+    poll = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0.2)
+    poll.cancel()
+    await asyncio.gather(poll, return_exceptions=True)
+    await stream.aclose()
+    await subscriber.close()
+
+    publisher = _transport(kind, redis_url)
+    for n in range(count):
+        await publisher.publish({"action": "skip", "chat_id": n, "sent": time.perf_counter()})
+    await publisher.close()
+
+    subscriber = _transport(kind, redis_url)
+    received = 0
+    stream = subscriber.subscribe()
+    try:
+        while received < count:
+            await asyncio.wait_for(stream.__anext__(), 1.0)
+            received += 1
+    except asyncio.TimeoutError:
+        pass
+    await stream.aclose()
+    await subscriber.close()
+    return received
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--paced", type=int, default=2000, help="messages for the latency run")
+    parser.add_argument("--interval-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/15")
+
+    print(f"{'transport':<10} {'msgs/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'kept while down':>16}")
+    for kind in ("pubsub", "streams"):
+        client = redis.from_url(redis_url)
+        await client.delete(CHANNEL)
+        await client.aclose()
+
+        started = time.perf_counter()
+        await _run(kind, redis_url, args.messages, 0)
+        throughput = args.messages / (time.perf_counter() - started)
+        latencies = sorted(await _run(kind, redis_url, args.paced, args.interval_ms / 1000))
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        kept = await _while_down(kind, redis_url, 100)
+        print(f"{kind:<10} {throughput:9.0f} {p50:8.3f} {p99:8.3f} {kept:>12}/100")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Time to first audio: full download before playback versus progressive playback.
+
+A local HTTP server stands in for the media host and serves one large file at a
+throttled rate. Run with ``python benchmarks/bench_progressive.py``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from telegram_music_bot.audio_cache import AudioCache  # noqa: E402
+from telegram_music_bot.audio_streamer import AudioStreamer  # noqa: E402
+
+
+def _throttled_server(payload: bytes, rate: int) -> web.Application:
+    chunk = 16 * 1024
+
+    async def track(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg", "Content-Length": str(len(payload))})
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+        try:
+            for offset in range(0, len(payload), chunk):
+                await response.write(payload[offset : offset + chunk])
+                await asyncio.sleep(chunk / rate)
+        except ConnectionResetError:
+            # The extractor only reads the headers and hangs up.
+            pass
+        return response
+
+    app = web.Application()
+    app.router.add_route("*", "/track.mp3", track)
+    return app
+
+
+async def _play(path: Path, started: float) -> float:
+    # Plays the part of ffmpeg: open the source, note when audio starts, read it to the end.
+    def read() -> float:
+        with path.open("rb") as source:
+            source.read(4096)
+            first_audio = time.perf_counter() - started
+            while source.read(1 << 16):
+                pass
+        return first_audio
+
+    return await asyncio.get_running_loop().run_in_executor(None, read)
+
+
+async def _measure(label: str, cache_dir: str, url: str, buffer_bytes: int | None) -> None:
+    cache = AudioCache(cache_dir, max_bytes=1 << 30)
+    await cache.open()
+    streamer = AudioStreamer(cache)
+    started = time.perf_counter()
+    if buffer_bytes is None:
+        source = await streamer.prepare(url)
+        complete = time.perf_counter() - started
+        first_audio = await _play(source.local_path, started)
+    else:
+        source, completed = await streamer.stream(url, buffer_bytes)
+        playback = asyncio.ensure_future(_play(source.local_path, started))
+        await completed
+        complete = time.perf_counter() - started
+        first_audio = await playback
+    print(f"{label:<24} first audio {first_audio:7.2f}s   cached copy complete {complete:7.2f}s")
+    streamer.close()
+    await cache.close()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=8.0)
+    parser.add_argument("--rate-kbps", type=int, default=1024, help="server speed in KiB/s")
+    parser.add_argument("--buffer-kb", type=int, default=512)
+    args = parser.parse_args()
+
+    payload = bytes(int(args.size_mb * 1024 * 1024))
+    runner = web.AppRunner(_throttled_server(payload, args.rate_kbps * 1024))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/track.mp3"
+    print(f"{args.size_mb:.0f} MiB at {args.rate_kbps} KiB/s, {args.buffer_kb} KiB start buffer")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            await _measure("full download", f"{tmp}/full", url, None)
+            await _measure("progressive", f"{tmp}/progressive", url, args.buffer_kb * 1024)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
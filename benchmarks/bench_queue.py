@@ -0,0 +1,150 @@
+"""Queue throughput: per-call connections versus the pooled QueueManager,
+and commits (fsync barriers) per write with and without group commit.
+
+Run with ``python benchmarks/bench_queue.py``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+import aiosqlite
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from queue_manager import QueueItem, QueueManager  # noqa: E402
+
+
+class ConnectPerCallQueue:
+    """The pre-pool implementation: one aiosqlite.connect() per operation."""
+
+    def __init__(self, database_url: str) -> None:
+        self._database_url = database_url
+
+    async def setup(self) -> None:
+        async with aiosqlite.connect(self._database_url) as db:
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS queues ("
+                "chat_id INTEGER NOT NULL, position INTEGER NOT NULL, item_json TEXT NOT NULL, "
+                "PRIMARY KEY (chat_id, position))"
+            )
+            await db.commit()
+
+    async def close(self) -> None:
+        return None
+
+    async def enqueue(self, chat_id: int, item: QueueItem) -> None:
+        async with aiosqlite.connect(self._database_url) as db:
+            cursor = await db.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM queues WHERE chat_id = ?", (chat_id,)
+            )
+            (position,) = await cursor.fetchone()
+            await db.execute(
+                "INSERT INTO queues (chat_id, position, item_json) VALUES (?, ?, ?)",
+                (chat_id, position, json.dumps(asdict(item))),
+            )
+            await db.commit()
+
+    async def pop_next(self, chat_id: int) -> QueueItem | None:
+        async with aiosqlite.connect(self._database_url) as db:
+            cursor = await db.execute(
+                "SELECT position, item_json FROM queues WHERE chat_id = ? ORDER BY position LIMIT 1",
+                (chat_id,),
+            )
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            await db.execute("DELETE FROM queues WHERE chat_id = ? AND position = ?", (chat_id, row[0]))
+            await db.commit()
+            return QueueItem(**json.loads(row[1]))
+
+    async def list_queue(self, chat_id: int) -> list[QueueItem]:
+        async with aiosqlite.connect(self._database_url) as db:
+            cursor = await db.execute(
+                "SELECT item_json FROM queues WHERE chat_id = ? ORDER BY position", (chat_id,)
+            )
+            rows = await cursor.fetchall()
+        return [QueueItem(**json.loads(item_json)) for (item_json,) in rows]
+
+
+async def _chat_workload(queue, chat_id: int, rounds: int) -> tuple[int, int]:
+    ops = failed = 0
+    for index in range(rounds):
+        calls = [
+            lambda: queue.enqueue(chat_id, QueueItem(title=f"Song {index}", url="http://example.com", requested_by=1)),
+            lambda: queue.list_queue(chat_id),
+        ]
+        if index % 2:
+            calls.append(lambda: queue.pop_next(chat_id))
+        for call in calls:
+            try:
+                await call()
+                ops += 1
+            except sqlite3.OperationalError:
+                # Per-call connections race each other for the write lock ("database is locked").
+                failed += 1
+    return ops, failed
+
+
+async def _run(name: str, queue, chats: int, rounds: int) -> None:
+    await queue.setup()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(_chat_workload(queue, chat, rounds) for chat in range(chats)))
+    elapsed = time.perf_counter() - started
+    await queue.close()
+    ops = sum(done for done, _ in results)
+    failed = sum(failed for _, failed in results)
+    print(f"{name:<16} {ops:>7} ops in {elapsed:6.2f}s  {ops / elapsed:10.1f} ops/sec  {failed} failed")
+
+
+async def _run_burst(name: str, queue: QueueManager, chats: int, rounds: int, durable: bool) -> None:
+    await queue.setup()
+    if durable:
+        async with queue._pool.write() as db:
+            await db.execute("PRAGMA synchronous = FULL")
+    commits_before = queue._pool.commits
+
+    async def play_spam(chat_id: int) -> None:
+        for index in range(rounds):
+            await queue.enqueue(chat_id, QueueItem(title=f"Song {index}", url="http://example.com", requested_by=1))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play_spam(chat) for chat in range(chats)))
+    elapsed = time.perf_counter() - started
+    commits = queue._pool.commits - commits_before
+    await queue.close()
+    writes = chats * rounds
+    print(f"{name:<16} {writes:>7} writes in {elapsed:6.2f}s  {writes / elapsed:10.1f} writes/sec  {commits / writes:.3f} fsyncs/write")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=40)
+    parser.add_argument("--group-commit-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await _run("connect-per-call", ConnectPerCallQueue(f"{tmp}/before.db"), args.chats, args.rounds)
+        await _run("pooled", QueueManager(f"{tmp}/after.db"), args.chats, args.rounds)
+        print()
+        await _run_burst("commit-per-write", QueueManager(f"{tmp}/single.db"), args.chats, args.rounds, durable=True)
+        await _run_burst(
+            "group-commit",
+            QueueManager(f"{tmp}/group.db", group_commit_window=args.group_commit_ms / 1000),
+            args.chats,
+            args.rounds,
+            durable=True,
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""Queue read path: JSON-blob rows (schema v1) versus typed, clustered columns (v2).
+
+Run with ``python benchmarks/bench_queue_schema.py``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from queue_manager import QueueItem, QueueManager  # noqa: E402
+
+
+def _build_legacy_database(path: str, chats: int, rows: int) -> None:
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE queues (chat_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+        "item_json TEXT NOT NULL, PRIMARY KEY (chat_id, position))"
+    )
+    db.executemany(
+        "INSERT INTO queues VALUES (?, ?, ?)",
+        (
+            (
+                chat_id,
+                position,
+                json.dumps(
+                    {
+                        "title": f"Track {position}",
+                        "url": f"https://www.youtube.com/watch?v={position:011d}",
+                        "requested_by": 1000 + position % 7,
+                        "metadata": {},
+                    }
+                ),
+            )
+            for chat_id in range(chats)
+            for position in range(rows)
+        ),
+    )
+    db.commit()
+    db.close()
+
+
+async def _legacy_list(path: str, chat_id: int) -> list[QueueItem]:
+    async with aiosqlite.connect(path) as db:
+        cursor = await db.execute(
+            "SELECT item_json FROM queues WHERE chat_id = ? ORDER BY position ASC", (chat_id,)
+        )
+        rows = await cursor.fetchall()
+    return [QueueItem(**json.loads(item_json)) for (item_json,) in rows]
+
+
+async def _time(label: str, reads: int, call) -> float:
+    started = time.perf_counter()
+    for _ in range(reads):
+        await call()
+    elapsed = (time.perf_counter() - started) / reads
+    print(f"{label:<28} {elapsed * 1000:8.2f} ms/read")
+    return elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=10_000, help="queued items per chat")
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/queues.db"
+        _build_legacy_database(path, args.chats, args.rows)
+        print(f"{args.chats} chats x {args.rows} rows")
+        before = await _time("v1 full list (json)", args.reads, lambda: _legacy_list(path, 1))
+
+        manager = QueueManager(path, cache_chats=0)
+        started = time.perf_counter()
+        await manager.setup()
+        print(f"{'migration v1 -> v2':<28} {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+        after = await _time("v2 full list (columns)", args.reads, lambda: manager.list_queue(1))
+        page = await _time("v2 page of 10", args.reads, lambda: manager.list_queue(1, after_position=5000, limit=10))
+        await _time("v2 count", args.reads, lambda: manager.count(1))
+        await manager.close()
+        print(f"full-list speedup: {before / after:.2f}x, page vs v1 full list: {before / page:.0f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""ffmpeg CPU seconds when the same track starts in several chats at once: one decode per
+chat versus one shared decode fanned out to every chat's feed.
+
+Needs ffmpeg on PATH. Run with ``python benchmarks/bench_shared_decode.py``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import resource
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from telegram_music_bot.cache_workers import run_ffmpeg  # noqa: E402
+from telegram_music_bot.shared_decoder import DecoderHub, ffmpeg_command  # noqa: E402
+
+
+def _child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _drain(path: Path) -> int:
+    # Stands in for the voice stack reading its input file.
+    with path.open("rb") as feed:
+        return sum(iter(lambda: len(feed.read(1 << 16)), 0))
+
+
+async def _own_decoders(source: Path, chats: int) -> None:
+    async def decode() -> None:
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_command(source, 0.0), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        while await process.stdout.read(1 << 16):
+            pass
+        await process.wait()
+
+    await asyncio.gather(*(decode() for _ in range(chats)))
+
+
+async def _shared_decoder(source: Path, chats: int, workdir: Path) -> int:
+    hub = DecoderHub(str(workdir))
+    feeds = [hub.subscribe(source) for _ in range(chats)]
+    with ThreadPoolExecutor(chats) as readers:
+        loop = asyncio.get_running_loop()
+        sizes = await asyncio.gather(*(loop.run_in_executor(readers, _drain, feed.path) for feed in feeds))
+    assert len(set(sizes)) == 1
+    for feed in feeds:
+        await feed.close()
+    await hub.close()
+    return hub.decoders_started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=int, default=180, help="track length")
+    parser.add_argument("--chats", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "track.webm"
+        await run_ffmpeg(
+            "-y", "-f", "lavfi", "-i", f"anoisesrc=d={args.seconds}:a=0.1", "-ac", "2", "-c:a", "libopus", str(source)
+        )
+        print(f"{args.seconds}s opus track started in {args.chats} chats")
+
+        before = _child_cpu()
+        await _own_decoders(source, args.chats)
+        own = _child_cpu() - before
+
+        before = _child_cpu()
+        started = await _shared_decoder(source, args.chats, Path(tmp) / "feeds")
+        shared = _child_cpu() - before
+
+        print(f"{'one decode per chat':<24} {own:8.3f} cpu-s  ({args.chats} ffmpeg processes)")
+        print(f"{'shared decode':<24} {shared:8.3f} cpu-s  ({started} ffmpeg process)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""CPU seconds per play: decoding the cached file on every play (AudioPiped) versus
+feeding a PCM copy transcoded once into the cache (InputAudioStream).
+
+Needs ffmpeg on PATH. Run with ``python benchmarks/bench_transcode.py``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from telegram_music_bot.cache_workers import run_ffmpeg  # noqa: E402
+from telegram_music_bot.transcoder import PCM_CHANNELS, PCM_SAMPLE_RATE, transcode_to_pcm  # noqa: E402
+
+
+def _child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def _piped_play(source: Path) -> None:
+    # The decode and resample AudioPiped runs for every play, with the output thrown away.
+    await run_ffmpeg(
+        "-i", str(source), "-vn", "-f", "s16le", "-ac", str(PCM_CHANNELS), "-ar", str(PCM_SAMPLE_RATE), "-"
+    )
+
+
+def _raw_play(pcm: Path) -> None:
+    # InputAudioStream reads the PCM file as is.
+    with pcm.open("rb") as stream:
+        while stream.read(1 << 16):
+            pass
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=int, default=180, help="track length")
+    parser.add_argument("--plays", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "track.webm"
+        await run_ffmpeg(
+            "-y", "-f", "lavfi", "-i", f"anoisesrc=d={args.seconds}:a=0.1", "-ac", "2", "-c:a", "libopus", str(source)
+        )
+        print(f"{args.seconds}s opus track, {args.plays} plays")
+
+        before = _child_cpu()
+        for _ in range(args.plays):
+            await _piped_play(source)
+        piped = (_child_cpu() - before) / args.plays
+
+        pcm = Path(tmp) / "track.pcm"
+        before = _child_cpu()
+        await transcode_to_pcm(source, pcm)
+        transcode = _child_cpu() - before
+        started = time.process_time()
+        for _ in range(args.plays):
+            _raw_play(pcm)
+        raw = (time.process_time() - started) / args.plays
+
+        print(f"{'decode every play':<28} {piped:8.3f} cpu-s/play")
+        print(f"{'pre-transcoded pcm':<28} {raw:8.3f} cpu-s/play  (+{transcode:.3f} cpu-s once per track)")
+        print(f"{'amortised over plays':<28} {raw + transcode / args.plays:8.3f} cpu-s/play")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
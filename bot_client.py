@@ -1,14 +1,12 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import socket
 from typing import Any
 
 import httpx
-import redis.asyncio as redis
-from telegram import Update
+from telegram import InlineKeyboardMarkup, Message, Update
 from telegram.error import NetworkError, TimedOut
 from telegram.request import HTTPXRequest
 from telegram.ext import (
@@ -18,18 +16,38 @@ from telegram.ext import (
     ContextTypes,
 )
 
-from audio_streamer import AudioStreamer
+from audio_streamer import YTDL_OPTIONS, AudioSource, AudioStreamer
+from bridge_transport import BridgeTransport, create_bridge_transport
 from config import load_bot_config
-from queue_manager import QueueItem, QueueManager
-from ui_components import PlaybackStatus, playback_controls, queue_list, render_progress_bar
+from extraction_pool import ExtractionPool, ExtractorBusy
+from prefetcher import Prefetcher, resolve_item
+from queue_manager import QueueBackend, QueueItem, create_queue_manager
+from resolve_cache import create_resolve_cache
+from sharding import create_sharded_transport
+from ui_components import (
+    PlaybackStatus,
+    playback_controls,
+    queue_list,
+    queue_page_controls,
+    render_progress_bar,
+)
+
+
+QUEUE_PAGE_SIZE = 10
+BUSY_REPLY = "Busy resolving other requests, try again in a moment."
+BUSY_RETRY_SECONDS = 2.0
+BUSY_RETRIES = 3
 
 
 class BridgeClient:
-    def __init__(self, redis_url: str) -> None:
-        self._redis = redis.from_url(redis_url, decode_responses=True)
+    def __init__(self, transport: BridgeTransport) -> None:
+        self._transport = transport
 
     async def send_action(self, payload: dict[str, Any]) -> None:
-        await self._redis.publish("music_actions", json.dumps(payload))
+        await self._transport.publish(payload)
+
+    async def close(self) -> None:
+        await self._transport.close()
 
 
 async def telegram_connectivity_check(bot_token: str) -> None:
@@ -68,38 +86,238 @@ async def play(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Usage: /play <song name or URL>")
         return
     streamer: AudioStreamer = context.application.bot_data["streamer"]
-    queue: QueueManager = context.application.bot_data["queue"]
-    bridge: BridgeClient = context.application.bot_data["bridge"]
+    queue: QueueBackend = context.application.bot_data["queue"]
 
-    source = await streamer.resolve(query)
-    item = QueueItem(title=source.title, url=source.url, requested_by=update.effective_user.id)
+    if AudioStreamer.is_playlist(query):
+        message = await update.message.reply_text("Importing playlist…")
+        context.application.create_task(
+            import_playlist(context, update.effective_chat.id, update.effective_user.id, query, message)
+        )
+        return
+
+    try:
+        source = await streamer.resolve(query)
+    except (ExtractorBusy, asyncio.TimeoutError):
+        await update.message.reply_text(BUSY_REPLY)
+        return
+    item = queue_item(source, update.effective_user.id)
     await queue.enqueue(update.effective_chat.id, item)
 
-    now_playing: dict[int, QueueItem] = context.application.bot_data.setdefault("now_playing", {})
-    if update.effective_chat.id not in now_playing:
-        next_item = await queue.pop_next(update.effective_chat.id)
-        if next_item:
-            now_playing[update.effective_chat.id] = next_item
-            await bridge.send_action(
-                {
-                    "action": "play",
-                    "chat_id": update.effective_chat.id,
-                    "user_id": update.effective_user.id,
-                    "metadata": {"title": next_item.title, "url": next_item.url},
-                }
-            )
+    await start_if_idle(context, update.effective_chat.id, update.effective_user.id)
     await update.message.reply_text(
         f"Queued: {source.title}\n{render_progress_bar(PlaybackStatus(source.title, 0, source.duration or 1, False))}",
         reply_markup=playback_controls(),
     )
 
 
+def queue_item(source: AudioSource, user_id: int) -> QueueItem:
+    # The stream URL is signed and expires; the webpage URL lets the player re-resolve it later.
+    return QueueItem(
+        title=source.title,
+        url=source.url,
+        requested_by=user_id,
+        metadata={**source.metadata, "expires_at": source.expires_at},
+    )
+
+
+def play_metadata(item: QueueItem) -> dict[str, Any]:
+    return {
+        "title": item.title,
+        "url": item.url,
+        "webpage_url": item.metadata.get("webpage_url"),
+        "expires_at": item.metadata.get("expires_at"),
+    }
+
+
+async def import_playlist(
+    context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, url: str, message: Message
+) -> None:
+    streamer: AudioStreamer = context.application.bot_data["streamer"]
+    queue: QueueBackend = context.application.bot_data["queue"]
+    # Entries are queued as flat webpage URLs; pop_playable resolves each one just before it plays.
+    total = 0
+    title = "playlist"
+    try:
+        async for title, sources in streamer.iter_playlist(url):
+            await queue.enqueue_many(
+                chat_id,
+                [
+                    QueueItem(
+                        title=source.title,
+                        url=source.url,
+                        requested_by=user_id,
+                        metadata={**source.metadata, "needs_resolve": True},
+                    )
+                    for source in sources
+                ],
+            )
+            total += len(sources)
+            context.application.bot_data["prefetcher"].notify(chat_id)
+            await start_if_idle(context, chat_id, user_id)
+    except Exception:
+        logging.exception("Playlist import failed for %s", url)
+        await message.edit_text(f"Playlist import stopped after {total} tracks.")
+        return
+    await message.edit_text(f"Queued {total} tracks from {title}.")
+
+
+async def pop_playable(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> QueueItem | None:
+    queue: QueueBackend = context.application.bot_data["queue"]
+    streamer: AudioStreamer = context.application.bot_data["streamer"]
+    prefetcher: Prefetcher = context.application.bot_data["prefetcher"]
+    attempts = 0
+    while True:
+        item = await queue.pop_next(chat_id)
+        # Whatever moved up behind this item is now within prefetch range.
+        prefetcher.notify(chat_id)
+        if item is None or not item.metadata.get("needs_resolve"):
+            return item
+        try:
+            ready = await resolve_item(streamer, item)
+        except (ExtractorBusy, asyncio.TimeoutError):
+            # Playback must not drop the track over a transient overload: it goes back to the
+            # front. A sustained one is handed to the caller rather than blocking it.
+            await queue.play_next(chat_id, item)
+            attempts += 1
+            if attempts >= BUSY_RETRIES:
+                raise ExtractorBusy(f"Could not resolve {item.url} after {attempts} attempts")
+            await asyncio.sleep(BUSY_RETRY_SECONDS)
+            continue
+        except Exception:
+            logging.warning("Skipping unplayable queue entry %s", item.url, exc_info=True)
+            continue
+        return ready
+
+
+async def preload_next(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+    # Lets the player refresh the upcoming stream while the current one plays. Entries still
+    # waiting on the prefetcher have no stream URL yet and are left to pop_playable.
+    queue: QueueBackend = context.application.bot_data["queue"]
+    bridge: BridgeClient = context.application.bot_data["bridge"]
+    upcoming = await queue.list_queue(chat_id, limit=1)
+    if upcoming and not upcoming[0].metadata.get("needs_resolve"):
+        await bridge.send_action({"action": "preload", "chat_id": chat_id, "metadata": play_metadata(upcoming[0])})
+
+
+async def start_if_idle(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> None:
+    bridge: BridgeClient = context.application.bot_data["bridge"]
+    now_playing: dict[int, QueueItem] = context.application.bot_data.setdefault("now_playing", {})
+    if chat_id in now_playing:
+        return
+    try:
+        next_item = await pop_playable(context, chat_id)
+    except ExtractorBusy:
+        # The entry is back at the front; the next /play or /skip starts it.
+        logging.warning("Extractor overloaded; chat %s stays idle for now", chat_id)
+        return
+    if next_item:
+        now_playing[chat_id] = next_item
+        await bridge.send_action(
+            {
+                "action": "play",
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "metadata": play_metadata(next_item),
+            }
+        )
+        await preload_next(context, chat_id)
+
+
+async def play_next(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.effective_chat or not update.effective_user:
+        return
+    query = " ".join(context.args)
+    if not query:
+        await update.message.reply_text("Usage: /playnext <song name or URL>")
+        return
+    streamer: AudioStreamer = context.application.bot_data["streamer"]
+    queue: QueueBackend = context.application.bot_data["queue"]
+
+    try:
+        source = await streamer.resolve(query)
+    except (ExtractorBusy, asyncio.TimeoutError):
+        await update.message.reply_text(BUSY_REPLY)
+        return
+    item = queue_item(source, update.effective_user.id)
+    await queue.play_next(update.effective_chat.id, item)
+
+    await start_if_idle(context, update.effective_chat.id, update.effective_user.id)
+    await update.message.reply_text(f"Playing next: {source.title}")
+
+
+def _queue_indexes(args: list[str], count: int) -> list[int] | None:
+    # Commands use the 1-based numbering shown by /queue.
+    if len(args) != count or not all(arg.isdigit() and int(arg) > 0 for arg in args):
+        return None
+    return [int(arg) - 1 for arg in args]
+
+
+async def move(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.effective_chat:
+        return
+    indexes = _queue_indexes(context.args, 2)
+    if indexes is None:
+        await update.message.reply_text("Usage: /move <from> <to>")
+        return
+    queue: QueueBackend = context.application.bot_data["queue"]
+    item = await queue.move(update.effective_chat.id, *indexes)
+    if item is None:
+        await update.message.reply_text("No such track in the queue.")
+        return
+    context.application.bot_data["prefetcher"].notify(update.effective_chat.id)
+    await update.message.reply_text(f"Moved: {item.title}")
+
+
+async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.effective_chat:
+        return
+    indexes = _queue_indexes(context.args, 1)
+    if indexes is None:
+        await update.message.reply_text("Usage: /remove <number>")
+        return
+    queue: QueueBackend = context.application.bot_data["queue"]
+    item = await queue.remove_at(update.effective_chat.id, indexes[0])
+    if item is None:
+        await update.message.reply_text("No such track in the queue.")
+        return
+    context.application.bot_data["prefetcher"].notify(update.effective_chat.id)
+    await update.message.reply_text(f"Removed: {item.title}")
+
+
+async def shuffle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.effective_chat:
+        return
+    queue: QueueBackend = context.application.bot_data["queue"]
+    await queue.shuffle(update.effective_chat.id)
+    context.application.bot_data["prefetcher"].notify(update.effective_chat.id)
+    await update.message.reply_text("Queue shuffled.")
+
+
+async def render_queue_page(
+    queue: QueueBackend, chat_id: int, direction: str | None = None, cursor: int = 0, start: int = 1
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    if direction == "next":
+        items = await queue.list_queue(chat_id, after_position=cursor, limit=QUEUE_PAGE_SIZE)
+    elif direction == "prev":
+        items = await queue.list_queue(chat_id, before_position=cursor, limit=QUEUE_PAGE_SIZE)
+        if len(items) < QUEUE_PAGE_SIZE:
+            start = 1
+    else:
+        items = await queue.list_queue(chat_id, limit=QUEUE_PAGE_SIZE)
+    if not items:
+        return queue_list([]), None
+    total = await queue.count(chat_id)
+    text = queue_list([item.title for item in items], start=start, total=total)
+    markup = queue_page_controls(items[0].position, items[-1].position, start, QUEUE_PAGE_SIZE, total)
+    return text, markup
+
+
 async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat:
         return
-    queue: QueueManager = context.application.bot_data["queue"]
-    items = await queue.list_queue(update.effective_chat.id)
-    await update.message.reply_text(queue_list([item.title for item in items]))
+    queue: QueueBackend = context.application.bot_data["queue"]
+    text, markup = await render_queue_page(queue, update.effective_chat.id)
+    await update.effective_message.reply_text(text, reply_markup=markup)
 
 
 async def pause(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -126,14 +344,19 @@ async def skip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat or not update.effective_user:
         return
     bridge: BridgeClient = context.application.bot_data["bridge"]
-    queue: QueueManager = context.application.bot_data["queue"]
     now_playing: dict[int, QueueItem] = context.application.bot_data.setdefault("now_playing", {})
 
     await bridge.send_action(
         {"action": "skip", "chat_id": update.effective_chat.id, "user_id": update.effective_user.id}
     )
 
-    next_item = await queue.pop_next(update.effective_chat.id)
+    try:
+        next_item = await pop_playable(context, update.effective_chat.id)
+    except ExtractorBusy:
+        # Nothing is playing now, so a later /play or /skip starts the entry left at the front.
+        now_playing.pop(update.effective_chat.id, None)
+        await update.message.reply_text(BUSY_REPLY)
+        return
     if next_item:
         now_playing[update.effective_chat.id] = next_item
         await bridge.send_action(
@@ -141,9 +364,10 @@ async def skip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 "action": "play",
                 "chat_id": update.effective_chat.id,
                 "user_id": update.effective_user.id,
-                "metadata": {"title": next_item.title, "url": next_item.url},
+                "metadata": play_metadata(next_item),
             }
         )
+        await preload_next(context, update.effective_chat.id)
         await update.message.reply_text(f"Now playing: {next_item.title}")
         return
 
@@ -155,7 +379,7 @@ async def stop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.effective_chat or not update.effective_user:
         return
     bridge: BridgeClient = context.application.bot_data["bridge"]
-    queue: QueueManager = context.application.bot_data["queue"]
+    queue: QueueBackend = context.application.bot_data["queue"]
     now_playing: dict[int, QueueItem] = context.application.bot_data.setdefault("now_playing", {})
 
     await queue.clear(update.effective_chat.id)
@@ -170,6 +394,17 @@ async def handle_controls(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not update.callback_query or not update.effective_chat or not update.effective_user:
         return
     action = update.callback_query.data
+    if action == "queue":
+        await update.callback_query.answer()
+        await queue_command(update, context)
+        return
+    if action.startswith("queue:"):
+        _, direction, cursor, start = action.split(":")
+        queue: QueueBackend = context.application.bot_data["queue"]
+        text, markup = await render_queue_page(queue, update.effective_chat.id, direction, int(cursor), int(start))
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(text, reply_markup=markup)
+        return
     bridge: BridgeClient = context.application.bot_data["bridge"]
     await bridge.send_action(
         {"action": action, "chat_id": update.effective_chat.id, "user_id": update.effective_user.id}
@@ -207,12 +442,38 @@ async def main() -> None:
 
     application = Application.builder().token(config.bot_token).request(request).build()
 
-    queue = QueueManager(config.database_url)
+    queue = create_queue_manager(config)
     await queue.setup()
+    resolve_cache = create_resolve_cache(
+        config.resolve_cache_store,
+        max_entries=config.resolve_cache_size,
+        default_ttl=config.resolve_cache_ttl,
+        database_url=config.database_url,
+        redis_url=config.redis_url,
+    )
+    await resolve_cache.open()
 
     application.bot_data["queue"] = queue
-    application.bot_data["streamer"] = AudioStreamer()
-    application.bot_data["bridge"] = BridgeClient(config.redis_url)
+    extractor = ExtractionPool(
+        YTDL_OPTIONS,
+        workers=config.extract_workers,
+        max_pending=config.extract_queue_size,
+        timeout=config.extract_timeout,
+        kind=config.extract_pool,
+    )
+    application.bot_data["streamer"] = AudioStreamer(resolve_cache, extractor)
+    application.bot_data["prefetcher"] = Prefetcher(queue, application.bot_data["streamer"], config.prefetch_depth)
+    if config.sharding:
+        # Each action goes only to the premium worker that owns its chat.
+        transport: BridgeTransport = create_sharded_transport(
+            config.bridge_transport,
+            config.redis_url,
+            heartbeat_ttl=config.shard_heartbeat_ttl,
+            maxlen=config.bridge_stream_maxlen,
+        )
+    else:
+        transport = create_bridge_transport(config.bridge_transport, config.redis_url, maxlen=config.bridge_stream_maxlen)
+    application.bot_data["bridge"] = BridgeClient(transport)
 
     application.add_handler(CommandHandler("play", play))
     application.add_handler(CommandHandler("pause", pause))
@@ -220,6 +481,10 @@ async def main() -> None:
     application.add_handler(CommandHandler("skip", skip))
     application.add_handler(CommandHandler("stop", stop))
     application.add_handler(CommandHandler("queue", queue_command))
+    application.add_handler(CommandHandler("playnext", play_next))
+    application.add_handler(CommandHandler("move", move))
+    application.add_handler(CommandHandler("remove", remove))
+    application.add_handler(CommandHandler("shuffle", shuffle))
     application.add_handler(CallbackQueryHandler(handle_controls))
 
     # 3) Retry initialize() because it calls getMe()
@@ -240,7 +505,14 @@ async def main() -> None:
     await application.start()
     await application.updater.start_polling(drop_pending_updates=True)
 
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await application.bot_data["prefetcher"].close()
+        await application.bot_data["bridge"].close()
+        await extractor.close()
+        await resolve_cache.close()
+        await queue.close()
 
 
 if __name__ == "__main__":
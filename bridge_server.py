@@ -7,18 +7,19 @@ from typing import Any
 
 import aiohttp
 import aiohttp.web
-import redis.asyncio as redis
 import websockets
 
+from bridge_transport import BridgeTransport, create_bridge_transport
 from config import load_bridge_config
+from sharding import create_sharded_transport
 
 
 class BridgeServer:
-    def __init__(self, redis_url: str) -> None:
-        self._redis = redis.from_url(redis_url, decode_responses=True)
+    def __init__(self, transport: BridgeTransport) -> None:
+        self._transport = transport
 
-    async def publish(self, channel: str, payload: dict[str, Any]) -> None:
-        await self._redis.publish(channel, json.dumps(payload))
+    async def publish(self, payload: dict[str, Any]) -> None:
+        await self._transport.publish(payload)
 
     async def handle_ws(self, websocket: websockets.WebSocketServerProtocol) -> None:
         async for message in websocket:
@@ -27,7 +28,7 @@ class BridgeServer:
             if not action:
                 await websocket.send(json.dumps({"error": "missing action"}))
                 continue
-            await self.publish("music_actions", payload)
+            await self.publish(payload)
             await websocket.send(json.dumps({"status": "queued", "action": action}))
 
 
@@ -48,7 +49,17 @@ async def start_health_server(port: int) -> aiohttp.web.AppRunner:
 async def main() -> None:
     config = load_bridge_config()
     logging.basicConfig(level=config.log_level)
-    bridge = BridgeServer(config.redis_url)
+    if config.sharding:
+        # Each action goes only to the premium worker that owns its chat.
+        transport: BridgeTransport = create_sharded_transport(
+            config.bridge_transport,
+            config.redis_url,
+            heartbeat_ttl=config.shard_heartbeat_ttl,
+            maxlen=config.bridge_stream_maxlen,
+        )
+    else:
+        transport = create_bridge_transport(config.bridge_transport, config.redis_url, maxlen=config.bridge_stream_maxlen)
+    bridge = BridgeServer(transport)
 
     health_runner = await start_health_server(config.health_port)
 
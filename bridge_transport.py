@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import json
+import logging
+import socket
+import time
+from typing import Any, AsyncIterator, Protocol
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+ACTIONS_CHANNEL = "music_actions"
+# Set on payloads read from a stream; the subscriber hands them back to ack() once handled.
+ENTRY_ID = "_entry_id"
+
+
+class BridgeTransport(Protocol):
+    async def publish(self, payload: dict[str, Any]) -> None:
+        ...
+
+    def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        ...
+
+    async def ack(self, payloads: list[dict[str, Any]]) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class PubSubTransport:
+    # Fire and forget: whatever is published while nobody is subscribed is lost.
+    def __init__(self, redis_url: str, channel: str = ACTIONS_CHANNEL) -> None:
+        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self._channel = channel
+
+    async def publish(self, payload: dict[str, Any]) -> None:
+        await self._redis.publish(self._channel, json.dumps(payload))
+
+    async def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self._channel)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                yield json.loads(message["data"])
+        finally:
+            await pubsub.unsubscribe(self._channel)
+            await pubsub.close()
+
+    async def ack(self, payloads: list[dict[str, Any]]) -> None:
+        # Nothing was kept, so there is nothing to acknowledge.
+        return
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+class StreamTransport:
+    """Actions on a capped Redis stream, read through a consumer group.
+
+    Each payload is acknowledged when the subscriber passes it to ack() after handling it,
+    so whatever a consumer had not finished when it died is delivered again: to itself on
+    restart, or to another consumer of the group once it has been idle for claim_idle_ms.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        stream: str = ACTIONS_CHANNEL,
+        group: str = "premium",
+        consumer: str | None = None,
+        maxlen: int = 10000,
+        batch: int = 64,
+        block_ms: int = 5000,
+        claim_idle_ms: int = 30000,
+    ) -> None:
+        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self._stream = stream
+        self._group = group
+        # Stable across restarts of the same worker, so it picks up its own pending entries.
+        self._consumer = consumer or socket.gethostname()
+        self._maxlen = maxlen
+        self._batch = batch
+        self._block_ms = block_ms
+        self._claim_idle_ms = claim_idle_ms
+        self._group_ready = False
+
+    async def publish(self, payload: dict[str, Any]) -> None:
+        # The group is created by whichever side comes first, so actions sent before the
+        # player ever started are waiting for it rather than skipped.
+        await self._ensure_group()
+        await self._redis.xadd(
+            self._stream, {"data": json.dumps(payload)}, maxlen=self._maxlen, approximate=True
+        )
+
+    async def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        await self._ensure_group()
+        # First the entries this consumer read but never acknowledged before it restarted.
+        # They stay pending until handled, so the cursor moves past each batch read.
+        recovered: str | None = "0"
+        next_claim = 0.0
+        while True:
+            entries = await self._read(recovered) if recovered else []
+            recovered = entries[-1][0] if entries else None
+            if not entries and time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + self._claim_idle_ms / 1000
+                entries = await self._claim()
+            if not entries:
+                entries = await self._read(">")
+            unusable: list[str] = []
+            payloads: list[dict[str, Any]] = []
+            for entry_id, fields in entries:
+                if not fields:
+                    # Trimmed by MAXLEN while it was pending; only the id is left to ack.
+                    unusable.append(entry_id)
+                    continue
+                try:
+                    payload = json.loads(fields["data"])
+                except (KeyError, ValueError):
+                    logging.warning("Dropping malformed bridge entry %s", entry_id)
+                    unusable.append(entry_id)
+                    continue
+                payload[ENTRY_ID] = entry_id
+                payloads.append(payload)
+            if unusable:
+                await self._redis.xack(self._stream, self._group, *unusable)
+            for payload in payloads:
+                yield payload
+
+    async def ack(self, payloads: list[dict[str, Any]]) -> None:
+        entry_ids = [payload[ENTRY_ID] for payload in payloads if ENTRY_ID in payload]
+        if entry_ids:
+            await self._redis.xack(self._stream, self._group, *entry_ids)
+
+    async def drain(self) -> list[dict[str, Any]]:
+        # Everything a consumer that is gone for good never handled, oldest first: its
+        # pending entries, then whatever was never delivered. The stream is removed after.
+        await self._ensure_group()
+        payloads: list[dict[str, Any]] = []
+        for last_id in ("0", ">"):
+            while entries := await self._read(last_id, block=False):
+                payloads += [json.loads(fields["data"]) for _, fields in entries if fields and "data" in fields]
+                await self._redis.xack(self._stream, self._group, *(entry_id for entry_id, _ in entries))
+        await self._redis.delete(self._stream)
+        return payloads
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    async def _ensure_group(self) -> None:
+        if self._group_ready:
+            return
+        try:
+            await self._redis.xgroup_create(self._stream, self._group, id="$", mkstream=True)
+        except ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+        self._group_ready = True
+
+    async def _read(self, last_id: str, block: bool = True) -> list[tuple[str, dict[str, str] | None]]:
+        block_ms = self._block_ms if block and last_id == ">" else None
+        response = await self._redis.xreadgroup(
+            self._group, self._consumer, {self._stream: last_id}, count=self._batch, block=block_ms
+        )
+        if not response:
+            return []
+        _, entries = response[0]
+        return entries
+
+    async def _claim(self) -> list[tuple[str, dict[str, str] | None]]:
+        # Entries left pending by a consumer that died are taken over once idle long enough.
+        # This consumer's own pending entries are still being handled, so they are skipped.
+        entry_ids: list[str] = []
+        start = "-"
+        while len(entry_ids) < self._batch:
+            pending = await self._redis.xpending_range(
+                self._stream, self._group, start, "+", self._batch, idle=self._claim_idle_ms
+            )
+            entry_ids += [entry["message_id"] for entry in pending if entry["consumer"] != self._consumer]
+            if len(pending) < self._batch:
+                break
+            start = f"({pending[-1]['message_id']}"
+        if not entry_ids:
+            return []
+        return await self._redis.xclaim(
+            self._stream, self._group, self._consumer, self._claim_idle_ms, entry_ids[: self._batch]
+        )
+
+
+def create_bridge_transport(
+    transport: str,
+    redis_url: str,
+    channel: str = ACTIONS_CHANNEL,
+    maxlen: int = 10000,
+    batch: int = 64,
+    claim_idle_ms: int = 30000,
+    consumer: str | None = None,
+) -> BridgeTransport:
+    if transport == "streams":
+        return StreamTransport(
+            redis_url,
+            stream=channel,
+            consumer=consumer,
+            maxlen=maxlen,
+            batch=batch,
+            claim_idle_ms=claim_idle_ms,
+        )
+    if transport == "pubsub":
+        return PubSubTransport(redis_url, channel)
+    raise RuntimeError(f"Unknown BRIDGE_TRANSPORT: {transport}")
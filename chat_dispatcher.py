@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Collection
+
+# Receives the actions of one turn: a single action, or a burst collected within the window.
+Handler = Callable[[list[dict[str, Any]]], Awaitable[None]]
+
+
+@dataclass
+class DispatchStats:
+    actors: int = 0
+    queued: int = 0
+    peak_depth: int = 0
+    handled: int = 0
+    coalesced: int = 0
+    dropped: int = 0
+    reaped: int = 0
+
+
+class ChatDispatcher:
+    # One mailbox and one worker task per chat: actions run in order within a chat and
+    # concurrently across chats, so a slow join in one chat never holds up another.
+    def __init__(
+        self,
+        handler: Handler,
+        mailbox_size: int = 32,
+        idle_timeout: float = 60.0,
+        window: float = 0.0,
+        batchable: Collection[str] = (),
+        essential: Collection[str] = (),
+        on_drop: Callable[[dict[str, Any]], None] | None = None,
+    ) -> None:
+        self._handler = handler
+        self._mailbox_size = mailbox_size
+        self._idle_timeout = idle_timeout
+        self._window = window
+        self._batchable = batchable
+        self._essential = essential
+        # Told about every action that is dropped and so will never reach the handler.
+        self._on_drop = on_drop
+        self._mailboxes: dict[int, asyncio.Queue[dict[str, Any]]] = {}
+        self._actors: dict[int, asyncio.Task[None]] = {}
+        self.stats = DispatchStats()
+
+    def dispatch(self, chat_id: int, payload: dict[str, Any]) -> bool:
+        mailbox = self._mailboxes.get(chat_id)
+        if mailbox is None:
+            # Unbounded underneath: the bound is enforced here, and essential actions may exceed it.
+            mailbox = self._mailboxes[chat_id] = asyncio.Queue()
+            self._actors[chat_id] = asyncio.create_task(self._run(chat_id, mailbox))
+            self.stats.actors = len(self._actors)
+        if mailbox.qsize() >= self._mailbox_size and not self._make_room(chat_id, mailbox, payload):
+            # Waiting here would stall every other chat behind this one.
+            self.stats.dropped += 1
+            logging.warning("Mailbox for chat %s is full; dropping %s", chat_id, payload.get("action"))
+            self._dropped(payload)
+            return False
+        mailbox.put_nowait(payload)
+        self.stats.queued += 1
+        self.stats.peak_depth = max(self.stats.peak_depth, mailbox.qsize())
+        return True
+
+    def mailbox_depth(self, chat_id: int) -> int:
+        mailbox = self._mailboxes.get(chat_id)
+        return mailbox.qsize() if mailbox else 0
+
+    def depths(self) -> dict[int, int]:
+        return {chat_id: mailbox.qsize() for chat_id, mailbox in self._mailboxes.items() if mailbox.qsize()}
+
+    async def close(self) -> None:
+        actors = list(self._actors.values())
+        for actor in actors:
+            actor.cancel()
+        await asyncio.gather(*actors, return_exceptions=True)
+        self._actors.clear()
+        self._mailboxes.clear()
+        self.stats.actors = 0
+
+    def _make_room(self, chat_id: int, mailbox: asyncio.Queue[dict[str, Any]], payload: dict[str, Any]) -> bool:
+        # Only an essential action gets in: the oldest non-essential one queued makes way for
+        # it, or, with none left to evict, the mailbox runs over its bound.
+        if payload.get("action") not in self._essential:
+            return False
+        queued = [mailbox.get_nowait() for _ in range(mailbox.qsize())]
+        victim = next((item for item in queued if item.get("action") not in self._essential), None)
+        for item in queued:
+            if item is not victim:
+                mailbox.put_nowait(item)
+        if victim is not None:
+            self.stats.queued -= 1
+            self.stats.dropped += 1
+            logging.warning("Mailbox for chat %s is full; dropping %s", chat_id, victim.get("action"))
+            self._dropped(victim)
+        return True
+
+    def _dropped(self, payload: dict[str, Any]) -> None:
+        if self._on_drop is not None:
+            self._on_drop(payload)
+
+    async def _run(self, chat_id: int, mailbox: asyncio.Queue[dict[str, Any]]) -> None:
+        carry: dict[str, Any] | None = None
+        while True:
+            if carry is not None:
+                payload, carry = carry, None
+            else:
+                try:
+                    payload = await asyncio.wait_for(mailbox.get(), self._idle_timeout)
+                except asyncio.TimeoutError:
+                    if not mailbox.empty():
+                        # An action arrived just as the timeout fired.
+                        continue
+                    # Nothing can be put between this check and the removal: no await in between.
+                    del self._mailboxes[chat_id]
+                    del self._actors[chat_id]
+                    self.stats.actors = len(self._actors)
+                    self.stats.reaped += 1
+                    return
+                self.stats.queued -= 1
+            await self._handle(chat_id, [payload])
+            if self._window > 0 and payload.get("action") in self._batchable:
+                # The first action never waits; only what follows it within the window is folded.
+                batch: list[dict[str, Any]] = []
+                carry = await self._collect(mailbox, batch)
+                if batch:
+                    await self._handle(chat_id, batch)
+
+    async def _handle(self, chat_id: int, batch: list[dict[str, Any]]) -> None:
+        try:
+            await self._handler(batch)
+        except Exception:
+            logging.exception("Actions %s failed in chat %s", [item.get("action") for item in batch], chat_id)
+        self.stats.handled += len(batch)
+        self.stats.coalesced += len(batch) - 1
+
+    async def _collect(self, mailbox: asyncio.Queue[dict[str, Any]], batch: list[dict[str, Any]]) -> dict[str, Any] | None:
+        # Gathers what else the chat sends within the window. The first action that cannot
+        # join the burst ends it and is handed back to run next, so order is kept.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._window
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                payload = await asyncio.wait_for(mailbox.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            self.stats.queued -= 1
+            if payload.get("action") not in self._batchable:
+                return payload
+            batch.append(payload)
+        return None
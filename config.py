@@ -13,7 +13,24 @@ def _env(key: str, default: str | None = None) -> str:
 class BotConfig:
     bot_token: str
     redis_url: str
+    queue_backend: str
     database_url: str
+    database_readers: int
+    queue_group_commit_ms: float
+    queue_group_commit_max_ops: int
+    queue_cache_chats: int
+    resolve_cache_size: int
+    resolve_cache_ttl: float
+    resolve_cache_store: str
+    extract_pool: str
+    extract_workers: int
+    extract_queue_size: int
+    extract_timeout: float
+    prefetch_depth: int
+    bridge_transport: str
+    bridge_stream_maxlen: int
+    sharding: bool
+    shard_heartbeat_ttl: float
     log_level: str
     spotify_client_id: str | None
     spotify_client_secret: str | None
@@ -25,6 +42,24 @@ class PremiumConfig:
     api_hash: str
     session_name: str
     redis_url: str
+    database_url: str
+    resolve_cache_size: int
+    resolve_cache_ttl: float
+    resolve_cache_store: str
+    stream_refresh_margin: float
+    bridge_transport: str
+    bridge_stream_maxlen: int
+    bridge_batch: int
+    bridge_claim_idle_ms: int
+    sharding: bool
+    shard_heartbeat_ttl: float
+    worker_id: str
+    chat_mailbox_size: int
+    chat_idle_timeout: float
+    control_coalesce_ms: float
+    stats_interval: float
+    call_idle_timeout: float
+    crossfade_seconds: float
     log_level: str
 
 
@@ -34,6 +69,10 @@ class BridgeConfig:
     host: str
     port: int
     health_port: int
+    bridge_transport: str
+    bridge_stream_maxlen: int
+    sharding: bool
+    shard_heartbeat_ttl: float
     log_level: str
 
 
@@ -42,7 +81,24 @@ def load_bot_config() -> BotConfig:
     return BotConfig(
         bot_token=_env("BOT_TOKEN"),
         redis_url=_env("REDIS_URL", "redis://localhost:6379/0"),
+        queue_backend=_env("QUEUE_BACKEND", "sqlite").lower(),
         database_url=_env("DATABASE_URL", "queues.db"),
+        database_readers=int(_env("DATABASE_READERS", "4")),
+        queue_group_commit_ms=float(_env("QUEUE_GROUP_COMMIT_MS", "0")),
+        queue_group_commit_max_ops=int(_env("QUEUE_GROUP_COMMIT_MAX_OPS", "64")),
+        queue_cache_chats=int(_env("QUEUE_CACHE_CHATS", "256")),
+        resolve_cache_size=int(_env("RESOLVE_CACHE_SIZE", "1024")),
+        resolve_cache_ttl=float(_env("RESOLVE_CACHE_TTL", "3600")),
+        resolve_cache_store=_env("RESOLVE_CACHE_STORE", "memory").lower(),
+        extract_pool=_env("EXTRACT_POOL", "thread").lower(),
+        extract_workers=int(_env("EXTRACT_WORKERS", "4")),
+        extract_queue_size=int(_env("EXTRACT_QUEUE_SIZE", "32")),
+        extract_timeout=float(_env("EXTRACT_TIMEOUT", "30")),
+        prefetch_depth=int(_env("PREFETCH_DEPTH", "2")),
+        bridge_transport=_env("BRIDGE_TRANSPORT", "pubsub").lower(),
+        bridge_stream_maxlen=int(_env("BRIDGE_STREAM_MAXLEN", "10000")),
+        sharding=_env("SHARDING", "0") == "1",
+        shard_heartbeat_ttl=float(_env("SHARD_HEARTBEAT_TTL", "15")),
         log_level=_env("LOG_LEVEL", "INFO"),
         spotify_client_id=os.getenv("SPOTIFY_CLIENT_ID"),
         spotify_client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
@@ -56,6 +112,24 @@ def load_premium_config() -> PremiumConfig:
         api_hash=_env("API_HASH"),
         session_name=_env("SESSION_NAME", "premium_session"),
         redis_url=_env("REDIS_URL", "redis://localhost:6379/0"),
+        database_url=_env("DATABASE_URL", "queues.db"),
+        resolve_cache_size=int(_env("RESOLVE_CACHE_SIZE", "1024")),
+        resolve_cache_ttl=float(_env("RESOLVE_CACHE_TTL", "3600")),
+        resolve_cache_store=_env("RESOLVE_CACHE_STORE", "memory").lower(),
+        stream_refresh_margin=float(_env("STREAM_REFRESH_MARGIN", "300")),
+        bridge_transport=_env("BRIDGE_TRANSPORT", "pubsub").lower(),
+        bridge_stream_maxlen=int(_env("BRIDGE_STREAM_MAXLEN", "10000")),
+        bridge_batch=int(_env("BRIDGE_BATCH", "64")),
+        bridge_claim_idle_ms=int(_env("BRIDGE_CLAIM_IDLE_MS", "30000")),
+        sharding=_env("SHARDING", "0") == "1",
+        shard_heartbeat_ttl=float(_env("SHARD_HEARTBEAT_TTL", "15")),
+        worker_id=_env("WORKER_ID", _env("SESSION_NAME", "premium_session")),
+        chat_mailbox_size=int(_env("CHAT_MAILBOX_SIZE", "32")),
+        chat_idle_timeout=float(_env("CHAT_IDLE_TIMEOUT", "60")),
+        control_coalesce_ms=float(_env("CONTROL_COALESCE_MS", "200")),
+        stats_interval=float(_env("STATS_INTERVAL", "60")),
+        call_idle_timeout=float(_env("CALL_IDLE_TIMEOUT", "120")),
+        crossfade_seconds=float(_env("CROSSFADE_SECONDS", "0")),
         log_level=_env("LOG_LEVEL", "INFO"),
     )
 
@@ -67,5 +141,9 @@ def load_bridge_config() -> BridgeConfig:
         host=_env("BRIDGE_HOST", "0.0.0.0"),
         port=int(_env("BRIDGE_PORT", "8765")),
         health_port=int(_env("HEALTH_PORT", "8080")),
+        bridge_transport=_env("BRIDGE_TRANSPORT", "pubsub").lower(),
+        bridge_stream_maxlen=int(_env("BRIDGE_STREAM_MAXLEN", "10000")),
+        sharding=_env("SHARDING", "0") == "1",
+        shard_heartbeat_ttl=float(_env("SHARD_HEARTBEAT_TTL", "15")),
         log_level=_env("LOG_LEVEL", "INFO"),
     )
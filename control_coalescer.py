@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+VOLUME_STEPS = {"vol_up": 10, "vol_down": -10}
+# Actions that may be folded together when a chat sends a burst of them. Anything else
+# (rewind, stream ends, shard hand-offs) ends the burst and runs on its own, in order.
+COALESCED_ACTIONS = frozenset({"play", "skip", "stop", "pause", "resume", "preload", *VOLUME_STEPS})
+
+
+@dataclass
+class ControlBurst:
+    # The last play, skip or stop of the burst; pauses before it no longer matter, because
+    # a new track starts playing. Volume belongs to the call, which outlives the track.
+    reset: dict[str, Any] | None = None
+    skips: int = 0
+    volume_delta: int = 0
+    # Only the latest upcoming track is worth resolving ahead of time.
+    preload: dict[str, Any] | None = None
+    # A stop came before the reset: the call must be left first, dropping its volume,
+    # even though a later play or skip is what the burst ends on.
+    left: bool = False
+    forced_playing: bool | None = None
+    toggles: int = 0
+
+    def playing_after(self, playing: bool) -> bool:
+        if self.forced_playing is not None:
+            playing = self.forced_playing
+        return playing != (self.toggles % 2 == 1)
+
+
+def coalesce(payloads: Iterable[dict[str, Any]]) -> ControlBurst:
+    burst = ControlBurst()
+    for payload in payloads:
+        action = payload["action"]
+        if action in {"play", "skip", "stop"}:
+            burst = ControlBurst(
+                reset=payload,
+                skips=burst.skips + (action == "skip"),
+                volume_delta=0 if action == "stop" else burst.volume_delta,
+                preload=None if action == "stop" else burst.preload,
+                left=burst.left or action == "stop",
+            )
+        elif action == "preload":
+            burst.preload = payload
+        elif action == "pause":
+            # "pause" is the ⏯️ toggle.
+            burst.toggles += 1
+        elif action == "resume":
+            burst.forced_playing = True
+            burst.toggles = 0
+        else:
+            burst.volume_delta += VOLUME_STEPS[action]
+    return burst
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Sequence
+
+import aiosqlite
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+WriteOperation = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        database_url: str,
+        readers: int = 4,
+        group_commit_window: float = 0.0,
+        group_commit_max_ops: int = 64,
+    ) -> None:
+        self._database_url = database_url
+        # Every ":memory:" connection is its own database, so readers must share the writer.
+        self._reader_count = 0 if database_url == ":memory:" else max(readers, 0)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._connections: list[aiosqlite.Connection] = []
+        self._group_commit_window = group_commit_window
+        self._group_commit_max_ops = max(group_commit_max_ops, 1)
+        self._pending: list[tuple[WriteOperation, asyncio.Future[Any]]] = []
+        self._batch_full = asyncio.Event()
+        self._flush_task: asyncio.Task[None] | None = None
+        self.commits = 0
+
+    async def open(self) -> None:
+        if self._writer is not None:
+            return
+        self._writer = await self._connect()
+        if self._group_commit_window > 0:
+            # Batches amortise the fsync, so group commit can afford fully durable commits.
+            await self._writer.execute("PRAGMA synchronous = FULL")
+        for _ in range(self._reader_count):
+            reader = await self._connect()
+            await reader.execute("PRAGMA query_only = ON")
+            self._readers.put_nowait(reader)
+
+    async def migrate(self, migrations: Sequence[Sequence[str]]) -> int:
+        # migrations[n] upgrades the schema from user_version n to n + 1.
+        async with self.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute("PRAGMA user_version")
+                (version,) = await cursor.fetchone()
+                for target, statements in enumerate(migrations[version:], start=version + 1):
+                    for statement in statements:
+                        await db.execute(statement)
+                    await db.execute(f"PRAGMA user_version = {target}")
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        return max(version, len(migrations))
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._batch_full.set()
+            await self._flush_task
+        connections, self._connections = self._connections, []
+        self._writer = None
+        self._readers = asyncio.Queue()
+        for connection in reversed(connections):
+            await connection.close()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            yield self._require_writer()
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        if not self._reader_count:
+            async with self.write() as db:
+                yield db
+            return
+        self._require_writer()
+        reader = await self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def run_write(self, operation: WriteOperation) -> Any:
+        if self._group_commit_window <= 0:
+            async with self.write() as db:
+                try:
+                    result = await operation(db)
+                    await db.commit()
+                except BaseException:
+                    await db.rollback()
+                    raise
+                self.commits += 1
+                return result
+
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if len(self._pending) >= self._group_commit_max_ops:
+            self._batch_full.set()
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._group_commit_loop())
+        return await future
+
+    async def _group_commit_loop(self) -> None:
+        while self._pending:
+            if len(self._pending) < self._group_commit_max_ops:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self._group_commit_window)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[: self._group_commit_max_ops]
+            del self._pending[: self._group_commit_max_ops]
+            await self._commit_batch(batch)
+        self._flush_task = None
+
+    async def _commit_batch(self, batch: list[tuple[WriteOperation, asyncio.Future[Any]]]) -> None:
+        outcomes: list[tuple[asyncio.Future[Any], Any, BaseException | None]] = []
+        async with self.write() as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                for operation, future in batch:
+                    if future.cancelled():
+                        continue
+                    # A savepoint per operation keeps one failing caller from rolling back the rest.
+                    await db.execute("SAVEPOINT group_commit_op")
+                    try:
+                        result = await operation(db)
+                    except Exception as exc:
+                        await db.execute("ROLLBACK TO group_commit_op")
+                        outcomes.append((future, None, exc))
+                    else:
+                        outcomes.append((future, result, None))
+                    await db.execute("RELEASE group_commit_op")
+                await db.commit()
+            except Exception as exc:
+                await db.rollback()
+                outcomes = [(future, None, exc) for _, future in batch]
+            else:
+                self.commits += 1
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _connect(self) -> aiosqlite.Connection:
+        connection = await aiosqlite.connect(self._database_url)
+        for pragma in PRAGMAS:
+            await connection.execute(pragma)
+        self._connections.append(connection)
+        return connection
+
+    def _require_writer(self) -> aiosqlite.Connection:
+        if self._writer is None:
+            raise RuntimeError("Connection pool is not open; call setup() first")
+        return self._writer
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
+# Each worker thread or process builds its own YoutubeDL from these options on first use.
+_worker = threading.local()
+
+
+def _init_worker(options: dict[str, Any]) -> None:
+    _worker.options = options
+    _worker.ytdl = None
+
+
+def _run_extract(query: str) -> dict[str, Any]:
+    if _worker.ytdl is None:
+        _worker.ytdl = YoutubeDL(_worker.options)
+    try:
+        info = _worker.ytdl.extract_info(query, download=False)
+    except DownloadError as error:
+        # The original carries a traceback, which cannot cross a process boundary.
+        raise DownloadError(str(error)) from None
+    # sanitize_info drops the callables and generators yt-dlp leaves in the dict so it can be pickled.
+    return YoutubeDL.sanitize_info(info)
+
+
+class ExtractorBusy(RuntimeError):
+    pass
+
+
+@dataclass
+class ExtractionStats:
+    running: int = 0
+    queue_depth: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    rejected: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=512))
+
+    def latency(self, quantile: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class ExtractionPool:
+    def __init__(
+        self,
+        options: dict[str, Any],
+        workers: int = 4,
+        max_pending: int = 32,
+        timeout: float = 30.0,
+        kind: str = "thread",
+    ) -> None:
+        self._options = {"socket_timeout": timeout, **options}
+        self._workers = workers
+        self._max_pending = max_pending
+        self._timeout = timeout
+        self._kind = kind
+        self._executor: Executor | None = None
+        self._slots = asyncio.Semaphore(workers)
+        self.stats = ExtractionStats()
+
+    def _start(self) -> Executor:
+        if self._kind == "process":
+            return ProcessPoolExecutor(self._workers, initializer=_init_worker, initargs=(self._options,))
+        if self._kind == "thread":
+            return ThreadPoolExecutor(
+                self._workers,
+                thread_name_prefix="extract",
+                initializer=_init_worker,
+                initargs=(self._options,),
+            )
+        raise RuntimeError(f"Unknown EXTRACT_POOL: {self._kind}")
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def extract(self, query: str) -> dict[str, Any]:
+        if self._executor is None:
+            self._executor = self._start()
+        if self.stats.queue_depth >= self._max_pending and self._slots.locked():
+            self.stats.rejected += 1
+            raise ExtractorBusy("Extraction queue is full")
+        started = time.perf_counter()
+        self.stats.queue_depth += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.stats.queue_depth -= 1
+        loop = asyncio.get_running_loop()
+        self.stats.running += 1
+        job: Future[dict[str, Any]] = self._executor.submit(_run_extract, query)
+        # The slot is freed when the worker really finishes, not when the caller gives up, so
+        # hung extractions hold their worker and count against admission instead of piling up.
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            info = await asyncio.wait_for(asyncio.wrap_future(job), self._timeout)
+        except asyncio.TimeoutError:
+            self.stats.timed_out += 1
+            raise
+        except Exception:
+            self.stats.failed += 1
+            raise
+        self.stats.completed += 1
+        self.stats.latencies.append(time.perf_counter() - started)
+        return info
+
+    def _release(self) -> None:
+        self.stats.running -= 1
+        self._slots.release()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import replace
+
+from audio_streamer import AudioStreamer
+from extraction_pool import ExtractorBusy
+from queue_manager import QueueBackend, QueueItem
+
+
+async def resolve_item(streamer: AudioStreamer, item: QueueItem) -> QueueItem:
+    source = await streamer.resolve(item.url)
+    return replace(
+        item,
+        url=source.url,
+        metadata={**item.metadata, **source.metadata, "needs_resolve": False, "expires_at": source.expires_at},
+    )
+
+
+class Prefetcher:
+    def __init__(self, queue: QueueBackend, streamer: AudioStreamer, depth: int = 2) -> None:
+        self._queue = queue
+        self._streamer = streamer
+        self._depth = depth
+        self._tasks: dict[int, asyncio.Task[None]] = {}
+        # Chats whose queue changed while a pass was already running; they get one more pass.
+        self._dirty: set[int] = set()
+        self._closed = False
+
+    def notify(self, chat_id: int) -> None:
+        if self._depth <= 0 or self._closed:
+            return
+        if chat_id in self._tasks:
+            self._dirty.add(chat_id)
+            return
+        task = asyncio.create_task(self._run(chat_id))
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda _: self._finished(chat_id))
+
+    async def close(self) -> None:
+        # Cancelling runs the done callbacks, which must not start a pass for a dirty chat.
+        self._closed = True
+        self._dirty.clear()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _finished(self, chat_id: int) -> None:
+        self._tasks.pop(chat_id, None)
+        if chat_id in self._dirty:
+            self._dirty.discard(chat_id)
+            self.notify(chat_id)
+
+    async def _run(self, chat_id: int) -> None:
+        for item in await self._queue.list_queue(chat_id, limit=self._depth):
+            if not item.metadata.get("needs_resolve"):
+                continue
+            try:
+                ready = await resolve_item(self._streamer, item)
+            except ExtractorBusy:
+                # Interactive /play requests come first; the next queue change retries.
+                return
+            except Exception:
+                # Left unresolved, pop_playable retries the entry and skips it if it still fails.
+                logging.warning("Prefetch failed for %s", item.url, exc_info=True)
+                continue
+            await self._queue.update_item(chat_id, item, ready)
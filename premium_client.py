@@ -1,18 +1,29 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
-from dataclasses import dataclass
+import shlex
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field, replace
 from typing import Any
 
-import redis.asyncio as redis
 from pytgcalls import PyTgCalls
 from pytgcalls.types.input_stream import AudioPiped
 from pytgcalls.types.input_stream.quality import HighQualityAudio
 from telethon import TelegramClient
 
+from audio_streamer import AudioStreamer, stream_expiry
+from bridge_transport import BridgeTransport, create_bridge_transport
+from chat_dispatcher import ChatDispatcher
+from control_coalescer import COALESCED_ACTIONS, coalesce
 from config import load_premium_config
+from resolve_cache import ResolveCache, create_resolve_cache
+from sharding import HashRing, ShardedTransport, create_sharded_transport
+
+# Never dropped by a full mailbox: losing one leaves the chat playing the wrong thing. Taps
+# (pause, volume, preload) make way for them instead.
+ESSENTIAL_ACTIONS = frozenset({"play", "skip", "stop", "rewind", "stream_end", "handoff", "idle_leave"})
 
 
 @dataclass
@@ -23,28 +34,181 @@ class PlaybackState:
     is_playing: bool
     position: int = 0
     volume: int = 100
+    webpage_url: str | None = None
+    expires_at: float | None = None
+    started_at: float = field(default_factory=time.monotonic)
+    paused_at: float | None = None
+
+    def elapsed(self) -> float:
+        end = self.paused_at if self.paused_at is not None else time.monotonic()
+        return max(0.0, end - self.started_at)
+
+
+@dataclass
+class TransitionStats:
+    joins: int = 0
+    switches: int = 0
+    idle_leaves: int = 0
+    # Seconds from handling play, rewind or a stream change to the new input being live.
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=512))
+
+    def latency(self, quantile: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
 
 
 class PremiumMusicPlayer:
-    def __init__(self, session_name: str, api_id: int, api_hash: str, redis_url: str) -> None:
+    def __init__(
+        self,
+        session_name: str,
+        api_id: int,
+        api_hash: str,
+        transport: BridgeTransport,
+        resolve_cache: ResolveCache | None = None,
+        refresh_margin: float = 300,
+        mailbox_size: int = 32,
+        idle_timeout: float = 60.0,
+        coalesce_window: float = 0.2,
+        stats_interval: float = 60.0,
+        call_idle_timeout: float = 120.0,
+        crossfade: float = 0.0,
+    ) -> None:
         self.client = TelegramClient(session_name, api_id, api_hash)
         self._calls = PyTgCalls(self.client)
-        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self._transport = transport
         self._state: dict[int, PlaybackState] = {}
+        self._resolve_cache = resolve_cache or ResolveCache(expiry_margin=refresh_margin)
+        self._streamer = AudioStreamer(self._resolve_cache)
+        self._refresh_margin = refresh_margin
+        # The call stays joined between tracks; these track it and its volume per chat.
+        self._joined: set[int] = set()
+        self._silenced: set[int] = set()
+        self._volumes: dict[int, int] = {}
+        self._idle_leaves: dict[int, asyncio.Task[None]] = {}
+        self._preloads: dict[int, tuple[str, asyncio.Task[PlaybackState]]] = {}
+        self._call_idle_timeout = call_idle_timeout
+        self._crossfade = crossfade
+        self.stats = TransitionStats()
+        # Taps on the control buttons arriving within coalesce_window of each other are
+        # folded into at most one RPC of each kind.
+        self._dispatcher = ChatDispatcher(
+            self._handle_actions,
+            mailbox_size,
+            idle_timeout,
+            coalesce_window,
+            COALESCED_ACTIONS,
+            ESSENTIAL_ACTIONS,
+            on_drop=self._dropped,
+        )
+        self._acks: set[asyncio.Task[None]] = set()
+        self._stats_interval = stats_interval
+        self._tasks: list[asyncio.Task[None]] = []
 
     async def start(self) -> None:
+        await self._resolve_cache.open()
         await self.client.start()
+        self._calls.on_stream_end()(self._on_stream_end)
         await self._calls.start()
-        asyncio.create_task(self._listen())
+        self._tasks.append(asyncio.create_task(self._listen()))
+        if isinstance(self._transport, ShardedTransport):
+            self._tasks.append(asyncio.create_task(self._transport.run_membership(self._rebalance)))
+        if self._stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._report_stats()))
+
+    def metrics(self) -> dict[str, Any]:
+        depths = self._dispatcher.depths()
+        transitions = {
+            f"transition_p{round(quantile * 100)}_ms": None if latency is None else round(latency * 1000, 1)
+            for quantile in (0.5, 0.95)
+            for latency in [self.stats.latency(quantile)]
+        }
+        return {
+            **asdict(self._dispatcher.stats),
+            "deepest_mailboxes": dict(sorted(depths.items(), key=lambda item: item[1], reverse=True)[:5]),
+            "joins": self.stats.joins,
+            "switches": self.stats.switches,
+            "idle_leaves": self.stats.idle_leaves,
+            **transitions,
+        }
+
+    async def _report_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self._stats_interval)
+            logging.info("Premium player stats: %s", self.metrics())
+
+    async def _rebalance(self, ring: HashRing) -> None:
+        # A chat that moved to another worker is handed over: this account leaves the call
+        # and the new owner starts the current track again with its own session.
+        for chat_id, state in list(self._state.items()):
+            if ring.owner(chat_id) == self._transport.worker_id:
+                continue
+            logging.info("Handing chat %s over to %s", chat_id, ring.owner(chat_id))
+            # Queued behind the chat's pending actions, so it sees the state they leave.
+            self._dispatcher.dispatch(chat_id, {"action": "handoff", "chat_id": chat_id})
+
+    async def _hand_over(self, chat_id: int) -> None:
+        state = self._state.get(chat_id)
+        if not state:
+            return
+        await self.stop(chat_id)
+        await self._transport.publish(
+            {
+                "action": "play",
+                "chat_id": chat_id,
+                "metadata": {
+                    "url": state.source_url,
+                    "title": state.title,
+                    "webpage_url": state.webpage_url,
+                    "expires_at": state.expires_at,
+                },
+            }
+        )
 
     async def _listen(self) -> None:
-        pubsub = self._redis.pubsub()
-        await pubsub.subscribe("music_actions")
-        async for message in pubsub.listen():
-            if message.get("type") != "message":
+        async for payload in self._transport.subscribe():
+            chat_id = payload.get("chat_id")
+            if not chat_id or not payload.get("action"):
                 continue
-            payload = json.loads(message["data"])
-            await self._handle_action(payload)
+            self._dispatcher.dispatch(chat_id, payload)
+
+    async def _handle_actions(self, payloads: list[dict[str, Any]]) -> None:
+        # Stream entries are acknowledged only once handled, so a restart replays whatever
+        # was still waiting in a mailbox. A failed action is acknowledged too, or it would
+        # fail again on every restart.
+        try:
+            await self._apply_actions(payloads)
+        except Exception:
+            await self._transport.ack(payloads)
+            raise
+        await self._transport.ack(payloads)
+
+    def _dropped(self, payload: dict[str, Any]) -> None:
+        task = asyncio.create_task(self._transport.ack([payload]))
+        # The loop only keeps weak references to tasks.
+        self._acks.add(task)
+        task.add_done_callback(self._acks.discard)
+
+    async def _apply_actions(self, payloads: list[dict[str, Any]]) -> None:
+        if len(payloads) == 1:
+            await self._handle_action(payloads[0])
+            return
+        burst = coalesce(payloads)
+        chat_id = payloads[0]["chat_id"]
+        logging.debug("Coalesced %s actions in chat %s (%s skips)", len(payloads), chat_id, burst.skips)
+        if burst.left and burst.reset["action"] != "stop":
+            await self.stop(chat_id)
+        if burst.reset is not None:
+            await self._handle_action(burst.reset)
+        if burst.preload is not None:
+            await self._handle_action(burst.preload)
+        state = self._state.get(chat_id)
+        if state and burst.playing_after(state.is_playing) != state.is_playing:
+            # pause() toggles, so this is one pause_stream or resume_stream call.
+            await self.pause(chat_id)
+        if burst.volume_delta:
+            await self.adjust_volume(chat_id, burst.volume_delta)
 
     async def _handle_action(self, payload: dict[str, Any]) -> None:
         action = payload.get("action")
@@ -52,7 +216,8 @@ class PremiumMusicPlayer:
         if not chat_id or not action:
             return
         if action == "play":
-            await self.join_and_play(chat_id, payload.get("metadata", {}).get("url", ""))
+            metadata = payload.get("metadata", {})
+            await self.join_and_play(chat_id, metadata.get("url", ""), metadata)
         elif action == "pause":
             await self.pause(chat_id)
         elif action == "resume":
@@ -67,24 +232,178 @@ class PremiumMusicPlayer:
             await self.adjust_volume(chat_id, 10)
         elif action == "vol_down":
             await self.adjust_volume(chat_id, -10)
+        elif action == "preload":
+            self._preload(chat_id, payload.get("metadata", {}))
+        elif action == "stream_end":
+            state = self._state.get(chat_id)
+            # An end reported before the current track started belongs to the one it replaced.
+            if state is None or state.started_at <= payload["ended_at"]:
+                self._go_idle(chat_id)
+        elif action == "handoff":
+            await self._hand_over(chat_id)
+        elif action == "idle_leave":
+            # Only the timer still pending counts; a play since then cancelled or replaced it.
+            if self._idle_leaves.get(chat_id) is not payload["timer"]:
+                return
+            del self._idle_leaves[chat_id]
+            if chat_id in self._state:
+                return
+            logging.info("Leaving idle voice chat %s", chat_id)
+            self.stats.idle_leaves += 1
+            await self._leave(chat_id)
 
-    async def join_and_play(self, chat_id: int, audio_url: str) -> None:
+    async def join_and_play(self, chat_id: int, audio_url: str, metadata: dict[str, Any] | None = None) -> None:
         if not audio_url:
             logging.warning("No audio URL provided for chat %s", chat_id)
             return
-        logging.info("Joining voice chat %s for playback", chat_id)
+        metadata = metadata or {}
         state = PlaybackState(
             chat_id=chat_id,
-            title=audio_url,
+            title=metadata.get("title") or audio_url,
             source_url=audio_url,
             is_playing=True,
+            volume=self._volumes.get(chat_id, 100),
+            webpage_url=metadata.get("webpage_url"),
+            expires_at=metadata.get("expires_at"),
         )
+        preloaded = self._preloads.pop(chat_id, None)
+        if preloaded is not None:
+            url, task = preloaded
+            if url == audio_url:
+                ready = await task
+                state.source_url, state.expires_at = ready.source_url, ready.expires_at
+            else:
+                task.cancel()
+        previous = self._state.get(chat_id)
         self._state[chat_id] = state
-        await self._calls.join_group_call(
-            chat_id,
-            AudioPiped(audio_url, HighQualityAudio()),
+        await self._start(state, previous)
+
+    async def _start(self, state: PlaybackState, previous: PlaybackState | None) -> None:
+        # In a joined call the input is swapped in place: no new handshake and no gap.
+        started = time.perf_counter()
+        chat_id = state.chat_id
+        self._cancel_idle_leave(chat_id)
+        url = await self._fresh_url(state)
+        if chat_id in self._joined:
+            crossfade = self._crossfade_parameters(previous)
+            try:
+                await self._calls.change_stream(chat_id, self._input(url, crossfade))
+            except Exception:
+                if crossfade is None:
+                    raise
+                logging.warning("Crossfade failed in chat %s; switching without it", chat_id, exc_info=True)
+                await self._calls.change_stream(chat_id, self._input(url))
+            if chat_id in self._silenced or (previous is not None and not previous.is_playing):
+                await self._calls.resume_stream(chat_id)
+            self.stats.switches += 1
+        else:
+            logging.info("Joining voice chat %s for playback", chat_id)
+            await self._calls.join_group_call(chat_id, self._input(url))
+            self._joined.add(chat_id)
+            self.stats.joins += 1
+        self._silenced.discard(chat_id)
+        state.started_at = time.monotonic()
+        state.paused_at = None
+        self.stats.latencies.append(time.perf_counter() - started)
+
+    @staticmethod
+    def _input(url: str, ffmpeg_parameters: str | None = None) -> AudioPiped:
+        if not ffmpeg_parameters:
+            return AudioPiped(url, HighQualityAudio())
+        return AudioPiped(url, HighQualityAudio(), additional_ffmpeg_parameters=ffmpeg_parameters)
+
+    def _crossfade_parameters(self, previous: PlaybackState | None) -> str | None:
+        if self._crossfade <= 0 or previous is None or not previous.is_playing:
+            return None
+        fade = self._crossfade
+        expires_at = previous.expires_at or stream_expiry(previous.source_url)
+        if expires_at is not None and expires_at <= time.time() + fade:
+            # The outgoing URL is opened again as a second input; an expired one would fail
+            # the new track along with the fade.
+            return None
+        # The outgoing track, from where it is now, fades out over the start of the new one.
+        outgoing = f"-ss {previous.elapsed():.2f} -t {fade} -i {shlex.quote(previous.source_url)}"
+        return f"{outgoing} -atmid -filter_complex [0:a][1:a]acrossfade=d={fade}"
+
+    def _preload(self, chat_id: int, metadata: dict[str, Any]) -> None:
+        # Refreshes the next queued stream while the current one plays, so the switch to it
+        # does not wait on yt-dlp. Runs off the chat's mailbox; play awaits it if needed.
+        url = metadata.get("url")
+        if not url:
+            return
+        previous = self._preloads.pop(chat_id, None)
+        if previous is not None:
+            previous[1].cancel()
+        upcoming = PlaybackState(
+            chat_id=chat_id,
+            title=metadata.get("title") or url,
+            source_url=url,
+            is_playing=False,
+            webpage_url=metadata.get("webpage_url"),
+            expires_at=metadata.get("expires_at"),
+        )
+
+        async def refresh() -> PlaybackState:
+            await self._fresh_url(upcoming)
+            return upcoming
+
+        self._preloads[chat_id] = (url, asyncio.create_task(refresh()))
+
+    async def _on_stream_end(self, _: PyTgCalls, update: Any) -> None:
+        # Ordered with the chat's other actions, so a play already queued wins.
+        self._dispatcher.dispatch(
+            update.chat_id, {"action": "stream_end", "chat_id": update.chat_id, "ended_at": time.monotonic()}
         )
 
+    def _go_idle(self, chat_id: int) -> None:
+        self._state.pop(chat_id, None)
+        if chat_id in self._joined and chat_id not in self._idle_leaves:
+            self._idle_leaves[chat_id] = asyncio.create_task(self._leave_when_idle(chat_id))
+
+    def _cancel_idle_leave(self, chat_id: int) -> None:
+        task = self._idle_leaves.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _leave_when_idle(self, chat_id: int) -> None:
+        await asyncio.sleep(self._call_idle_timeout)
+        # The leave itself runs in the chat's mailbox, so a play arriving meanwhile waits
+        # for it to finish instead of joining while the call is still being left.
+        self._dispatcher.dispatch(
+            chat_id, {"action": "idle_leave", "chat_id": chat_id, "timer": asyncio.current_task()}
+        )
+
+    async def _leave(self, chat_id: int) -> None:
+        self._cancel_idle_leave(chat_id)
+        self._state.pop(chat_id, None)
+        self._silenced.discard(chat_id)
+        self._volumes.pop(chat_id, None)
+        preloaded = self._preloads.pop(chat_id, None)
+        if preloaded is not None:
+            preloaded[1].cancel()
+        if chat_id in self._joined:
+            self._joined.discard(chat_id)
+            await self._calls.leave_group_call(chat_id)
+
+    async def _fresh_url(self, state: PlaybackState) -> str:
+        # Queued stream URLs are signed and expire; swap in a new one only when it is about to.
+        if not state.webpage_url or not self._expires_soon(state.expires_at or stream_expiry(state.source_url)):
+            return state.source_url
+        try:
+            source = await self._streamer.resolve(state.webpage_url)
+            if self._expires_soon(source.expires_at):
+                # A cache filled with a smaller margin can hand back the URL that is about to die.
+                source = await self._streamer.resolve(state.webpage_url, refresh=True)
+        except Exception:
+            logging.warning("Could not refresh stream URL for %s", state.webpage_url, exc_info=True)
+            return state.source_url
+        state.source_url = source.url
+        state.expires_at = source.expires_at
+        return source.url
+
+    def _expires_soon(self, expires_at: float | None) -> bool:
+        return expires_at is not None and expires_at - time.time() <= self._refresh_margin
+
     async def pause(self, chat_id: int) -> None:
         state = self._state.get(chat_id)
         if not state:
@@ -92,48 +411,97 @@ class PremiumMusicPlayer:
         if state.is_playing:
             await self._calls.pause_stream(chat_id)
             state.is_playing = False
+            state.paused_at = time.monotonic()
         else:
-            await self._calls.resume_stream(chat_id)
-            state.is_playing = True
+            await self._resume(state)
 
     async def resume(self, chat_id: int) -> None:
         state = self._state.get(chat_id)
         if not state:
             return
-        await self._calls.resume_stream(chat_id)
+        await self._resume(state)
+
+    async def _resume(self, state: PlaybackState) -> None:
+        await self._calls.resume_stream(state.chat_id)
         state.is_playing = True
+        if state.paused_at is not None:
+            state.started_at += time.monotonic() - state.paused_at
+            state.paused_at = None
 
     async def skip(self, chat_id: int) -> None:
+        # The call stays joined and silent: the next play swaps its input in, and it is
+        # only left if nothing comes within the idle timeout.
         logging.info("Skipping current track in %s", chat_id)
-        await self.stop(chat_id)
+        state = self._state.get(chat_id)
+        if state is None:
+            return
+        if state.is_playing:
+            await self._calls.pause_stream(chat_id)
+        self._silenced.add(chat_id)
+        self._go_idle(chat_id)
 
     async def stop(self, chat_id: int) -> None:
-        if chat_id in self._state:
-            await self._calls.leave_group_call(chat_id)
-            self._state.pop(chat_id, None)
+        await self._leave(chat_id)
 
     async def rewind(self, chat_id: int) -> None:
         state = self._state.get(chat_id)
         if not state:
             return
-        await self.join_and_play(chat_id, state.source_url)
+        restarted = replace(state, position=0, is_playing=True)
+        self._state[chat_id] = restarted
+        await self._start(restarted, state)
 
     async def adjust_volume(self, chat_id: int, delta: int) -> None:
-        state = self._state.get(chat_id)
-        if not state:
+        if chat_id not in self._joined:
             return
-        state.volume = min(200, max(0, state.volume + delta))
-        await self._calls.change_volume_call(chat_id, state.volume)
+        volume = min(200, max(0, self._volumes.get(chat_id, 100) + delta))
+        self._volumes[chat_id] = volume
+        state = self._state.get(chat_id)
+        if state:
+            state.volume = volume
+        await self._calls.change_volume_call(chat_id, volume)
 
 
 async def main() -> None:
     config = load_premium_config()
     logging.basicConfig(level=config.log_level)
+    options = {
+        "maxlen": config.bridge_stream_maxlen,
+        "batch": config.bridge_batch,
+        "claim_idle_ms": config.bridge_claim_idle_ms,
+    }
+    if config.sharding:
+        transport: BridgeTransport = create_sharded_transport(
+            config.bridge_transport,
+            config.redis_url,
+            heartbeat_ttl=config.shard_heartbeat_ttl,
+            worker_id=config.worker_id,
+            **options,
+        )
+    else:
+        transport = create_bridge_transport(
+            config.bridge_transport, config.redis_url, consumer=config.session_name, **options
+        )
     player = PremiumMusicPlayer(
         session_name=config.session_name,
         api_id=config.api_id,
         api_hash=config.api_hash,
-        redis_url=config.redis_url,
+        transport=transport,
+        resolve_cache=create_resolve_cache(
+            config.resolve_cache_store,
+            max_entries=config.resolve_cache_size,
+            default_ttl=config.resolve_cache_ttl,
+            database_url=config.database_url,
+            redis_url=config.redis_url,
+            expiry_margin=config.stream_refresh_margin,
+        ),
+        refresh_margin=config.stream_refresh_margin,
+        mailbox_size=config.chat_mailbox_size,
+        idle_timeout=config.chat_idle_timeout,
+        coalesce_window=config.control_coalesce_ms / 1000,
+        stats_interval=config.stats_interval,
+        call_idle_timeout=config.call_idle_timeout,
+        crossfade=config.crossfade_seconds,
     )
     await player.start()
     await asyncio.Event().wait()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from typing import Generic, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class QueueCache(Generic[T]):
+    def __init__(self, max_chats: int) -> None:
+        self._max_chats = max_chats
+        self._chats: OrderedDict[int, deque[T]] = OrderedDict()
+        # Chats with a disk load in flight, and those written to while it was running.
+        self._loading: dict[int, int] = {}
+        self._stale: set[int] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_chats > 0
+
+    def get(self, chat_id: int) -> list[T] | None:
+        items = self._chats.get(chat_id)
+        if items is None:
+            return None
+        self._chats.move_to_end(chat_id)
+        return list(items)
+
+    def begin_load(self, chat_id: int) -> None:
+        self._loading[chat_id] = self._loading.get(chat_id, 0) + 1
+
+    def finish_load(self, chat_id: int, items: Iterable[T] | None) -> None:
+        remaining = self._loading.pop(chat_id) - 1
+        if remaining:
+            self._loading[chat_id] = remaining
+        stale = chat_id in self._stale
+        if not remaining:
+            self._stale.discard(chat_id)
+        if items is not None and not stale:
+            self._store(chat_id, deque(items))
+
+    def append(self, chat_id: int, items: Iterable[T]) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is not None:
+            cached.extend(items)
+
+    def prepend(self, chat_id: int, item: T) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is not None:
+            cached.appendleft(item)
+
+    def remove_at(self, chat_id: int, index: int, expected: T) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is None:
+            return
+        if index < len(cached) and cached[index] == expected:
+            del cached[index]
+        else:
+            self.invalidate(chat_id)
+
+    def move(self, chat_id: int, from_index: int, to_index: int, old: T, new: T) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is None:
+            return
+        if from_index < len(cached) and cached[from_index] == old:
+            del cached[from_index]
+            cached.insert(to_index, new)
+        else:
+            self.invalidate(chat_id)
+
+    def update(self, chat_id: int, old: T, new: T) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is None:
+            return
+        try:
+            cached[cached.index(old)] = new
+        except ValueError:
+            self.invalidate(chat_id)
+
+    def pop_left(self, chat_id: int, expected: T | None) -> None:
+        self._touch(chat_id)
+        cached = self._chats.get(chat_id)
+        if cached is None:
+            return
+        if expected is None:
+            cached.clear()
+        elif cached and cached[0] == expected:
+            cached.popleft()
+        else:
+            self.invalidate(chat_id)
+
+    def replace(self, chat_id: int, items: Iterable[T]) -> None:
+        self._touch(chat_id)
+        self._store(chat_id, deque(items))
+
+    def invalidate(self, chat_id: int) -> None:
+        self._touch(chat_id)
+        self._chats.pop(chat_id, None)
+
+    def _touch(self, chat_id: int) -> None:
+        if chat_id in self._loading:
+            self._stale.add(chat_id)
+
+    def _store(self, chat_id: int, items: deque[T]) -> None:
+        if not self.enabled:
+            return
+        self._chats[chat_id] = items
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self._max_chats:
+            self._chats.popitem(last=False)
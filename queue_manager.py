@@ -1,10 +1,16 @@
 from __future__ import annotations
 
 import json
-from dataclasses import asdict, dataclass, field
-from typing import Any
+import random
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Iterable, Protocol
 
 import aiosqlite
+import redis.asyncio as redis
+
+from config import BotConfig
+from database import ConnectionPool, WriteOperation
+from queue_cache import QueueCache
 
 
 @dataclass
@@ -13,68 +19,673 @@ class QueueItem:
     url: str
     requested_by: int
     metadata: dict[str, Any] = field(default_factory=dict)
+    position: int | None = None
+
+
+def _encode_item(item: QueueItem) -> str:
+    payload = asdict(item)
+    payload.pop("position")
+    return json.dumps(payload)
+
+
+def _decode_item(item_json: str, position: int) -> QueueItem:
+    return QueueItem(**json.loads(item_json), position=position)
+
+
+# Positions are sparse so a reorder can drop an item between two neighbours without
+# renumbering the rest of the queue; a chat is only respaced when a gap runs out.
+POSITION_STEP = 1 << 16
+
+MIGRATIONS: tuple[tuple[str, ...], ...] = (
+    (
+        """
+        CREATE TABLE IF NOT EXISTS queues (
+            chat_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            item_json TEXT NOT NULL,
+            PRIMARY KEY (chat_id, position)
+        )
+        """,
+    ),
+    # v2: typed columns instead of a JSON blob. WITHOUT ROWID clusters rows on
+    # (chat_id, position), so the primary key itself is the covering index for every read.
+    (
+        """
+        CREATE TABLE queues_v2 (
+            chat_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            requested_by INTEGER NOT NULL,
+            metadata_json TEXT,
+            PRIMARY KEY (chat_id, position)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO queues_v2 (chat_id, position, title, url, requested_by, metadata_json)
+        SELECT
+            chat_id,
+            position,
+            json_extract(item_json, '$.title'),
+            json_extract(item_json, '$.url'),
+            json_extract(item_json, '$.requested_by'),
+            NULLIF(json_extract(item_json, '$.metadata'), '{}')
+        FROM queues
+        """,
+        "DROP TABLE queues",
+        "ALTER TABLE queues_v2 RENAME TO queues",
+    ),
+    # v3: spread dense positions out to POSITION_STEP apart.
+    (
+        """
+        CREATE TABLE queues_v3 (
+            chat_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            requested_by INTEGER NOT NULL,
+            metadata_json TEXT,
+            PRIMARY KEY (chat_id, position)
+        ) WITHOUT ROWID
+        """,
+        f"""
+        INSERT INTO queues_v3 (chat_id, position, title, url, requested_by, metadata_json)
+        SELECT
+            chat_id,
+            ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY position) * {POSITION_STEP},
+            title,
+            url,
+            requested_by,
+            metadata_json
+        FROM queues
+        """,
+        "DROP TABLE queues",
+        "ALTER TABLE queues_v3 RENAME TO queues",
+    ),
+    # v4: the SQLite resolve cache lives in the same file, so it shares this user_version.
+    # IF NOT EXISTS adopts tables created before the cache was migrated here.
+    (
+        """
+        CREATE TABLE IF NOT EXISTS resolve_cache (
+            cache_key TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ),
+)
+
+
+def _item_row(item: QueueItem) -> tuple[Any, ...]:
+    return (item.title, item.url, item.requested_by, json.dumps(item.metadata) if item.metadata else None)
+
+
+def _item_from_row(position: int, title: str, url: str, requested_by: int, metadata_json: str | None) -> QueueItem:
+    return QueueItem(
+        title=title,
+        url=url,
+        requested_by=requested_by,
+        metadata=json.loads(metadata_json) if metadata_json else {},
+        position=position,
+    )
+
+
+def _position_between(lower: int | None, upper: int | None) -> int | None:
+    if lower is None and upper is None:
+        return POSITION_STEP
+    if lower is None:
+        return upper - POSITION_STEP
+    if upper is None:
+        return lower + POSITION_STEP
+    if upper - lower > 1:
+        return (lower + upper) // 2
+    return None
+
+
+def _page(
+    items: list[QueueItem],
+    after_position: int | None,
+    limit: int | None,
+    before_position: int | None,
+) -> list[QueueItem]:
+    if after_position is not None:
+        items = [item for item in items if item.position > after_position]
+    if before_position is not None:
+        items = [item for item in items if item.position < before_position]
+        return items[-limit:] if limit else items
+    return items[:limit] if limit else items
+
+
+class QueueBackend(Protocol):
+    async def setup(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def enqueue(self, chat_id: int, item: QueueItem) -> None: ...
+
+    async def enqueue_many(self, chat_id: int, items: Iterable[QueueItem]) -> None: ...
+
+    async def pop_next(self, chat_id: int) -> QueueItem | None: ...
+
+    async def list_queue(
+        self,
+        chat_id: int,
+        after_position: int | None = None,
+        limit: int | None = None,
+        before_position: int | None = None,
+    ) -> list[QueueItem]: ...
+
+    async def count(self, chat_id: int) -> int: ...
+
+    async def clear(self, chat_id: int) -> None: ...
+
+    async def play_next(self, chat_id: int, item: QueueItem) -> None: ...
+
+    async def remove_at(self, chat_id: int, index: int) -> QueueItem | None: ...
+
+    async def move(self, chat_id: int, from_index: int, to_index: int) -> QueueItem | None: ...
+
+    async def shuffle(self, chat_id: int) -> None: ...
+
+    async def update_item(self, chat_id: int, old: QueueItem, new: QueueItem) -> bool: ...
 
 
 class QueueManager:
-    def __init__(self, database_url: str) -> None:
-        self._database_url = database_url
+    def __init__(
+        self,
+        database_url: str,
+        readers: int = 4,
+        group_commit_window: float = 0.0,
+        group_commit_max_ops: int = 64,
+        cache_chats: int = 256,
+    ) -> None:
+        self._pool = ConnectionPool(database_url, readers, group_commit_window, group_commit_max_ops)
+        self._cache: QueueCache[QueueItem] = QueueCache(cache_chats)
 
     async def setup(self) -> None:
-        async with aiosqlite.connect(self._database_url) as db:
-            await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS queues (
-                    chat_id INTEGER NOT NULL,
-                    position INTEGER NOT NULL,
-                    item_json TEXT NOT NULL,
-                    PRIMARY KEY (chat_id, position)
-                )
-                """
-            )
-            await db.commit()
+        await self._pool.open()
+        await self._pool.migrate(MIGRATIONS)
+
+    async def close(self) -> None:
+        await self._pool.close()
 
     async def enqueue(self, chat_id: int, item: QueueItem) -> None:
-        async with aiosqlite.connect(self._database_url) as db:
-            cursor = await db.execute(
-                "SELECT COALESCE(MAX(position), -1) + 1 FROM queues WHERE chat_id = ?",
-                (chat_id,),
+        rows = await self._write(
+            chat_id,
+            lambda db: db.execute_fetchall(
+                """
+                INSERT INTO queues (chat_id, position, title, url, requested_by, metadata_json)
+                SELECT ?, COALESCE(MAX(position), 0) + ?, ?, ?, ?, ? FROM queues WHERE chat_id = ?
+                RETURNING position
+                """,
+                (chat_id, POSITION_STEP, *_item_row(item), chat_id),
+            ),
+        )
+        self._cache.append(chat_id, [replace(item, position=rows[0][0])])
+
+    async def enqueue_many(self, chat_id: int, items: Iterable[QueueItem]) -> None:
+        items = list(items)
+        if not items:
+            return
+
+        async def insert(db: aiosqlite.Connection) -> list[int]:
+            await db.executemany(
+                """
+                INSERT INTO queues (chat_id, position, title, url, requested_by, metadata_json)
+                SELECT ?, COALESCE(MAX(position), 0) + ?, ?, ?, ?, ? FROM queues WHERE chat_id = ?
+                """,
+                [(chat_id, POSITION_STEP, *_item_row(item), chat_id) for item in items],
             )
-            row = await cursor.fetchone()
-            position = row[0] if row else 0
-            await db.execute(
-                "INSERT INTO queues (chat_id, position, item_json) VALUES (?, ?, ?)",
-                (chat_id, position, json.dumps(asdict(item))),
+            # Still inside the write transaction, so the tail is exactly what was just inserted.
+            rows = await db.execute_fetchall(
+                "SELECT position FROM queues WHERE chat_id = ? ORDER BY position DESC LIMIT ?",
+                (chat_id, len(items)),
             )
-            await db.commit()
+            return [position for (position,) in reversed(rows)]
+
+        positions = await self._write(chat_id, insert)
+        self._cache.append(
+            chat_id, [replace(item, position=position) for item, position in zip(items, positions)]
+        )
 
     async def pop_next(self, chat_id: int) -> QueueItem | None:
-        async with aiosqlite.connect(self._database_url) as db:
-            cursor = await db.execute(
-                "SELECT position, item_json FROM queues WHERE chat_id = ? ORDER BY position ASC LIMIT 1",
-                (chat_id,),
+        rows = await self._write(
+            chat_id,
+            lambda db: db.execute_fetchall(
+                """
+                DELETE FROM queues
+                WHERE chat_id = ? AND position = (SELECT MIN(position) FROM queues WHERE chat_id = ?)
+                RETURNING position, title, url, requested_by, metadata_json
+                """,
+                (chat_id, chat_id),
+            ),
+        )
+        item = _item_from_row(*rows[0]) if rows else None
+        self._cache.pop_left(chat_id, item)
+        return item
+
+    async def list_queue(
+        self,
+        chat_id: int,
+        after_position: int | None = None,
+        limit: int | None = None,
+        before_position: int | None = None,
+    ) -> list[QueueItem]:
+        cached = self._cache.get(chat_id)
+        if cached is not None:
+            return _page(cached, after_position, limit, before_position)
+        if after_position is not None or before_position is not None or limit is not None:
+            return await self._load_page(chat_id, after_position, limit, before_position)
+        items: list[QueueItem] | None = None
+        self._cache.begin_load(chat_id)
+        try:
+            items = await self._load_page(chat_id, None, None, None)
+        finally:
+            self._cache.finish_load(chat_id, items)
+        return items
+
+    async def count(self, chat_id: int) -> int:
+        cached = self._cache.get(chat_id)
+        if cached is not None:
+            return len(cached)
+        async with self._pool.read() as db:
+            cursor = await db.execute("SELECT COUNT(*) FROM queues WHERE chat_id = ?", (chat_id,))
+            (total,) = await cursor.fetchone()
+        return total
+
+    async def clear(self, chat_id: int) -> None:
+        await self._write(chat_id, lambda db: db.execute("DELETE FROM queues WHERE chat_id = ?", (chat_id,)))
+        self._cache.replace(chat_id, [])
+
+    async def play_next(self, chat_id: int, item: QueueItem) -> None:
+        rows = await self._write(
+            chat_id,
+            lambda db: db.execute_fetchall(
+                """
+                INSERT INTO queues (chat_id, position, title, url, requested_by, metadata_json)
+                SELECT ?, COALESCE(MIN(position) - ?, ?), ?, ?, ?, ? FROM queues WHERE chat_id = ?
+                RETURNING position
+                """,
+                (chat_id, POSITION_STEP, POSITION_STEP, *_item_row(item), chat_id),
+            ),
+        )
+        self._cache.prepend(chat_id, replace(item, position=rows[0][0]))
+
+    async def remove_at(self, chat_id: int, index: int) -> QueueItem | None:
+        if index < 0:
+            return None
+        rows = await self._write(
+            chat_id,
+            lambda db: db.execute_fetchall(
+                """
+                DELETE FROM queues
+                WHERE chat_id = ? AND position = (
+                    SELECT position FROM queues WHERE chat_id = ? ORDER BY position LIMIT 1 OFFSET ?
+                )
+                RETURNING position, title, url, requested_by, metadata_json
+                """,
+                (chat_id, chat_id, index),
+            ),
+        )
+        if not rows:
+            return None
+        item = _item_from_row(*rows[0])
+        self._cache.remove_at(chat_id, index, item)
+        return item
+
+    async def move(self, chat_id: int, from_index: int, to_index: int) -> QueueItem | None:
+        if from_index < 0:
+            return None
+
+        async def reorder(db: aiosqlite.Connection) -> tuple[QueueItem | None, QueueItem | None, int, list[QueueItem] | None]:
+            rows = await db.execute_fetchall(
+                """
+                SELECT position, title, url, requested_by, metadata_json FROM queues
+                WHERE chat_id = ? ORDER BY position LIMIT 1 OFFSET ?
+                """,
+                (chat_id, from_index),
             )
-            row = await cursor.fetchone()
-            if not row:
-                return None
-            position, item_json = row
-            await db.execute(
-                "DELETE FROM queues WHERE chat_id = ? AND position = ?",
-                (chat_id, position),
+            if not rows:
+                return None, None, 0, None
+            old = _item_from_row(*rows[0])
+            ((total,),) = await db.execute_fetchall("SELECT COUNT(*) FROM queues WHERE chat_id = ?", (chat_id,))
+            target = min(max(to_index, 0), total - 1)
+            if target == from_index:
+                return old, old, target, None
+            # Neighbours at the target slot once the moved item is taken out of the ordering.
+            neighbours = await db.execute_fetchall(
+                """
+                SELECT position FROM queues WHERE chat_id = ? AND position != ?
+                ORDER BY position LIMIT 2 OFFSET ?
+                """,
+                (chat_id, old.position, max(target - 1, 0)),
             )
-            await db.commit()
-            payload = json.loads(item_json)
-            return QueueItem(**payload)
-
-    async def list_queue(self, chat_id: int) -> list[QueueItem]:
-        async with aiosqlite.connect(self._database_url) as db:
-            cursor = await db.execute(
-                "SELECT item_json FROM queues WHERE chat_id = ? ORDER BY position ASC",
-                (chat_id,),
+            positions = [position for (position,) in neighbours]
+            if target == 0:
+                lower, upper = None, positions[0]
+            else:
+                lower, upper = positions[0], positions[1] if len(positions) > 1 else None
+            position = _position_between(lower, upper)
+            if position is None:
+                items = await self._fetch_all(db, chat_id)
+                items.insert(target, items.pop(from_index))
+                items = await self._rewrite(db, chat_id, items)
+                return old, items[target], target, items
+            await db.execute(
+                "UPDATE queues SET position = ? WHERE chat_id = ? AND position = ?",
+                (position, chat_id, old.position),
             )
+            return old, replace(old, position=position), target, None
+
+        old, new, target, respaced = await self._write(chat_id, reorder)
+        if respaced is not None:
+            self._cache.replace(chat_id, respaced)
+        elif old is not None and new != old:
+            self._cache.move(chat_id, from_index, target, old, new)
+        return new
+
+    async def shuffle(self, chat_id: int) -> None:
+        async def reshuffle(db: aiosqlite.Connection) -> list[QueueItem]:
+            items = await self._fetch_all(db, chat_id)
+            random.shuffle(items)
+            return await self._rewrite(db, chat_id, items)
+
+        self._cache.replace(chat_id, await self._write(chat_id, reshuffle))
+
+    async def update_item(self, chat_id: int, old: QueueItem, new: QueueItem) -> bool:
+        # Matching on the old url too means a row that was popped and whose position was
+        # reused by a later enqueue is left alone.
+        cursor = await self._write(
+            chat_id,
+            lambda db: db.execute(
+                """
+                UPDATE queues SET title = ?, url = ?, requested_by = ?, metadata_json = ?
+                WHERE chat_id = ? AND position = ? AND url = ?
+                """,
+                (*_item_row(new), chat_id, old.position, old.url),
+            ),
+        )
+        if not cursor.rowcount:
+            return False
+        self._cache.update(chat_id, old, replace(new, position=old.position))
+        return True
+
+    @staticmethod
+    async def _fetch_all(db: aiosqlite.Connection, chat_id: int) -> list[QueueItem]:
+        rows = await db.execute_fetchall(
+            """
+            SELECT position, title, url, requested_by, metadata_json FROM queues
+            WHERE chat_id = ? ORDER BY position
+            """,
+            (chat_id,),
+        )
+        return [_item_from_row(*row) for row in rows]
+
+    @staticmethod
+    async def _rewrite(db: aiosqlite.Connection, chat_id: int, items: list[QueueItem]) -> list[QueueItem]:
+        items = [replace(item, position=(index + 1) * POSITION_STEP) for index, item in enumerate(items)]
+        await db.execute("DELETE FROM queues WHERE chat_id = ?", (chat_id,))
+        await db.executemany(
+            """
+            INSERT INTO queues (chat_id, position, title, url, requested_by, metadata_json)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(chat_id, item.position, *_item_row(item)) for item in items],
+        )
+        return items
+
+    async def _load_page(
+        self,
+        chat_id: int,
+        after_position: int | None,
+        limit: int | None,
+        before_position: int | None,
+    ) -> list[QueueItem]:
+        # Keyset pagination: seek on the (chat_id, position) key instead of scanning with OFFSET.
+        descending = before_position is not None
+        query = "SELECT position, title, url, requested_by, metadata_json FROM queues WHERE chat_id = ?"
+        params: list[Any] = [chat_id]
+        if after_position is not None:
+            query += " AND position > ?"
+            params.append(after_position)
+        if before_position is not None:
+            query += " AND position < ?"
+            params.append(before_position)
+        query += " ORDER BY position DESC" if descending else " ORDER BY position ASC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        async with self._pool.read() as db:
+            cursor = await db.execute(query, params)
             rows = await cursor.fetchall()
-        return [QueueItem(**json.loads(item_json)) for (item_json,) in rows]
+        if descending:
+            rows.reverse()
+        return [_item_from_row(*row) for row in rows]
+
+    async def _write(self, chat_id: int, operation: WriteOperation) -> Any:
+        try:
+            return await self._pool.run_write(operation)
+        except BaseException:
+            # The write may or may not have landed; let the next read reload from disk.
+            self._cache.invalidate(chat_id)
+            raise
+
+
+# Each chat is a sorted set scored by position, plus a counter for member ids. Members are
+# "<id>:<item json>" so identical tracks stay distinct. STEP is substituted with POSITION_STEP.
+_ENQUEUE_SCRIPT = """
+local tail = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')[2]
+local score = tonumber(tail or 0)
+local last = redis.call('INCRBY', KEYS[2], #ARGV)
+local first = last - #ARGV
+local args = {}
+for index, item in ipairs(ARGV) do
+    score = score + STEP
+    args[#args + 1] = score
+    args[#args + 1] = (first + index) .. ':' .. item
+end
+redis.call('ZADD', KEYS[1], unpack(args))
+return last
+"""
+
+_PLAY_NEXT_SCRIPT = """
+local head = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')[2]
+local score = head and tonumber(head) - STEP or STEP
+local id = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], score, id .. ':' .. ARGV[1])
+return id
+"""
+
+_REMOVE_AT_SCRIPT = """
+local found = redis.call('ZRANGE', KEYS[1], ARGV[1], ARGV[1], 'WITHSCORES')
+if not found[1] then
+    return false
+end
+redis.call('ZREM', KEYS[1], found[1])
+return found
+"""
+
+_MOVE_SCRIPT = """
+local from = tonumber(ARGV[1])
+local moved = redis.call('ZRANGE', KEYS[1], from, from, 'WITHSCORES')
+if not moved[1] then
+    return false
+end
+local to = math.max(math.min(tonumber(ARGV[2]), redis.call('ZCARD', KEYS[1]) - 1), 0)
+if to == from then
+    return moved
+end
+redis.call('ZREM', KEYS[1], moved[1])
+local lower, upper
+if to > 0 then
+    lower = tonumber(redis.call('ZRANGE', KEYS[1], to - 1, to - 1, 'WITHSCORES')[2])
+end
+upper = tonumber(redis.call('ZRANGE', KEYS[1], to, to, 'WITHSCORES')[2])
+local score
+if not lower and not upper then
+    score = STEP
+elseif not lower then
+    score = upper - STEP
+elseif not upper then
+    score = lower + STEP
+elseif upper - lower > 1 then
+    score = math.floor((lower + upper) / 2)
+end
+if score then
+    redis.call('ZADD', KEYS[1], score, moved[1])
+else
+    local members = redis.call('ZRANGE', KEYS[1], 0, -1)
+    table.insert(members, to + 1, moved[1])
+    for index, member in ipairs(members) do
+        redis.call('ZADD', KEYS[1], index * STEP, member)
+    end
+    score = (to + 1) * STEP
+end
+return {moved[1], tostring(score)}
+"""
+
+_SHUFFLE_SCRIPT = """
+math.randomseed(tonumber(ARGV[1]))
+local members = redis.call('ZRANGE', KEYS[1], 0, -1)
+for index = #members, 2, -1 do
+    local other = math.random(index)
+    members[index], members[other] = members[other], members[index]
+end
+for index, member in ipairs(members) do
+    redis.call('ZADD', KEYS[1], index * STEP, member)
+end
+return #members
+"""
+
+_UPDATE_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+for _, member in ipairs(members) do
+    local split = string.find(member, ':', 1, true)
+    if string.sub(member, split + 1) == ARGV[2] then
+        redis.call('ZREM', KEYS[1], member)
+        redis.call('ZADD', KEYS[1], ARGV[1], string.sub(member, 1, split) .. ARGV[3])
+        return 1
+    end
+end
+return 0
+"""
+
+
+class RedisQueueManager:
+    # Lua's unpack() is limited to a few thousand values, so bulk enqueues are chunked.
+    _ENQUEUE_CHUNK = 1000
+
+    def __init__(self, redis_url: str, key_prefix: str = "queue") -> None:
+        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self._key_prefix = key_prefix
+        self._enqueue_script = self._register(_ENQUEUE_SCRIPT)
+        self._play_next_script = self._register(_PLAY_NEXT_SCRIPT)
+        self._remove_at_script = self._register(_REMOVE_AT_SCRIPT)
+        self._move_script = self._register(_MOVE_SCRIPT)
+        self._shuffle_script = self._register(_SHUFFLE_SCRIPT)
+        self._update_script = self._register(_UPDATE_SCRIPT)
+
+    async def setup(self) -> None:
+        await self._redis.ping()
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    async def enqueue(self, chat_id: int, item: QueueItem) -> None:
+        await self._enqueue_script(keys=self._keys(chat_id), args=[_encode_item(item)])
+
+    async def enqueue_many(self, chat_id: int, items: Iterable[QueueItem]) -> None:
+        payloads = [_encode_item(item) for item in items]
+        if not payloads:
+            return
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for start in range(0, len(payloads), self._ENQUEUE_CHUNK):
+                await self._enqueue_script(
+                    keys=self._keys(chat_id),
+                    args=payloads[start : start + self._ENQUEUE_CHUNK],
+                    client=pipe,
+                )
+            await pipe.execute()
+
+    async def pop_next(self, chat_id: int) -> QueueItem | None:
+        popped = await self._redis.zpopmin(self._keys(chat_id)[0])
+        if not popped:
+            return None
+        member, score = popped[0]
+        return self._decode(member, score)
+
+    async def list_queue(
+        self,
+        chat_id: int,
+        after_position: int | None = None,
+        limit: int | None = None,
+        before_position: int | None = None,
+    ) -> list[QueueItem]:
+        key = self._keys(chat_id)[0]
+        low = f"({after_position}" if after_position is not None else "-inf"
+        paging = {"start": 0, "num": limit} if limit is not None else {}
+        if before_position is not None:
+            members = await self._redis.zrevrangebyscore(
+                key, f"({before_position}", low, withscores=True, **paging
+            )
+            members.reverse()
+        else:
+            members = await self._redis.zrangebyscore(key, low, "+inf", withscores=True, **paging)
+        return [self._decode(member, score) for member, score in members]
+
+    async def count(self, chat_id: int) -> int:
+        return await self._redis.zcard(self._keys(chat_id)[0])
 
     async def clear(self, chat_id: int) -> None:
-        async with aiosqlite.connect(self._database_url) as db:
-            await db.execute("DELETE FROM queues WHERE chat_id = ?", (chat_id,))
-            await db.commit()
+        await self._redis.delete(*self._keys(chat_id))
+
+    async def play_next(self, chat_id: int, item: QueueItem) -> None:
+        await self._play_next_script(keys=self._keys(chat_id), args=[_encode_item(item)])
+
+    async def remove_at(self, chat_id: int, index: int) -> QueueItem | None:
+        if index < 0:
+            return None
+        found = await self._remove_at_script(keys=self._keys(chat_id), args=[index])
+        return self._decode(found[0], float(found[1])) if found else None
+
+    async def move(self, chat_id: int, from_index: int, to_index: int) -> QueueItem | None:
+        if from_index < 0:
+            return None
+        moved = await self._move_script(keys=self._keys(chat_id), args=[from_index, to_index])
+        return self._decode(moved[0], float(moved[1])) if moved else None
+
+    async def shuffle(self, chat_id: int) -> None:
+        await self._shuffle_script(keys=self._keys(chat_id), args=[random.getrandbits(31)])
+
+    async def update_item(self, chat_id: int, old: QueueItem, new: QueueItem) -> bool:
+        updated = await self._update_script(
+            keys=self._keys(chat_id), args=[old.position, _encode_item(old), _encode_item(new)]
+        )
+        return bool(updated)
+
+    def _register(self, script: str) -> Any:
+        return self._redis.register_script(script.replace("STEP", str(POSITION_STEP)))
+
+    def _keys(self, chat_id: int) -> list[str]:
+        # The hash tag keeps both keys in one cluster slot so the script can touch them together.
+        key = f"{self._key_prefix}:{{{chat_id}}}"
+        return [key, f"{key}:seq"]
+
+    @staticmethod
+    def _decode(member: str, score: float) -> QueueItem:
+        _, item_json = member.split(":", 1)
+        return _decode_item(item_json, int(score))
+
+
+def create_queue_manager(config: BotConfig) -> QueueBackend:
+    if config.queue_backend == "redis":
+        return RedisQueueManager(config.redis_url)
+    if config.queue_backend != "sqlite":
+        raise RuntimeError(f"Unknown QUEUE_BACKEND: {config.queue_backend}")
+    return QueueManager(
+        config.database_url,
+        config.database_readers,
+        group_commit_window=config.queue_group_commit_ms / 1000,
+        group_commit_max_ops=config.queue_group_commit_max_ops,
+        cache_chats=config.queue_cache_chats,
+    )
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Iterable, Protocol
+
+import redis.asyncio as redis
+
+from audio_streamer import AudioSource
+from database import ConnectionPool
+from queue_manager import MIGRATIONS
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    persistent_hits: int = 0
+
+
+class PersistentStore(Protocol):
+    async def open(self) -> None: ...
+
+    async def close(self) -> None: ...
+
+    async def get(self, key: str) -> str | None: ...
+
+    async def set(self, keys: Iterable[str], payload: str, expires_at: float) -> None: ...
+
+
+class SQLiteStore:
+    def __init__(self, database_url: str) -> None:
+        self._pool = ConnectionPool(database_url, readers=1)
+
+    async def open(self) -> None:
+        await self._pool.open()
+        await self._pool.migrate(MIGRATIONS)
+        async with self._pool.write() as db:
+            await db.execute("DELETE FROM resolve_cache WHERE expires_at <= ?", (time.time(),))
+            await db.commit()
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+    async def get(self, key: str) -> str | None:
+        async with self._pool.read() as db:
+            cursor = await db.execute(
+                "SELECT payload FROM resolve_cache WHERE cache_key = ? AND expires_at > ?",
+                (key, time.time()),
+            )
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def set(self, keys: Iterable[str], payload: str, expires_at: float) -> None:
+        rows = [(key, payload, expires_at) for key in keys]
+        await self._pool.run_write(
+            lambda db: db.executemany(
+                "INSERT OR REPLACE INTO resolve_cache (cache_key, payload, expires_at) VALUES (?, ?, ?)",
+                rows,
+            )
+        )
+
+
+class RedisStore:
+    def __init__(self, redis_url: str, key_prefix: str = "resolve") -> None:
+        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self._key_prefix = key_prefix
+
+    async def open(self) -> None:
+        await self._redis.ping()
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    async def get(self, key: str) -> str | None:
+        return await self._redis.get(f"{self._key_prefix}:{key}")
+
+    async def set(self, keys: Iterable[str], payload: str, expires_at: float) -> None:
+        ttl = int(expires_at - time.time())
+        if ttl <= 0:
+            return
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(f"{self._key_prefix}:{key}", payload, ex=ttl)
+            await pipe.execute()
+
+
+class ResolveCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        default_ttl: float = 3600,
+        expiry_margin: float = 300,
+        store: PersistentStore | None = None,
+    ) -> None:
+        self._max_entries = max_entries
+        self._default_ttl = default_ttl
+        self._expiry_margin = expiry_margin
+        self._store = store
+        self._entries: OrderedDict[str, tuple[float, AudioSource]] = OrderedDict()
+        self.stats = CacheStats()
+
+    async def open(self) -> None:
+        if self._store is not None:
+            await self._store.open()
+
+    async def close(self) -> None:
+        if self._store is not None:
+            await self._store.close()
+
+    async def get(self, keys: Iterable[str]) -> AudioSource | None:
+        keys = list(keys)
+        now = time.time()
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            expires_at, source = entry
+            if expires_at <= now:
+                del self._entries[key]
+                continue
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return source
+        if self._store is not None:
+            for key in keys:
+                payload = await self._store.get(key)
+                if payload is None:
+                    continue
+                data = json.loads(payload)
+                source = AudioSource(**data["source"])
+                # The writer may have used a smaller margin than this reader needs.
+                expires_at = min(data["expires_at"], self.expires_at(source))
+                if expires_at <= now:
+                    continue
+                self._remember(keys, source, expires_at)
+                self.stats.hits += 1
+                self.stats.persistent_hits += 1
+                return source
+        self.stats.misses += 1
+        return None
+
+    async def put(self, keys: Iterable[str], source: AudioSource) -> None:
+        keys = list(dict.fromkeys(keys))
+        expires_at = self.expires_at(source)
+        if expires_at <= time.time():
+            return
+        self._remember(keys, source, expires_at)
+        if self._store is not None:
+            await self._store.set(keys, json.dumps({"source": asdict(source), "expires_at": expires_at}), expires_at)
+
+    def expires_at(self, source: AudioSource) -> float:
+        # Entries expire a margin before the stream URL does, so callers never get a URL about to die.
+        expiry = source.expires_at if source.expires_at is not None else time.time() + self._default_ttl
+        return expiry - self._expiry_margin
+
+    def _remember(self, keys: list[str], source: AudioSource, expires_at: float) -> None:
+        if self._max_entries <= 0:
+            return
+        for key in keys:
+            self._entries[key] = (expires_at, source)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+
+def create_resolve_cache(
+    store: str,
+    max_entries: int,
+    default_ttl: float,
+    database_url: str,
+    redis_url: str,
+    expiry_margin: float = 300,
+) -> ResolveCache:
+    persistent: PersistentStore | None
+    if store == "sqlite":
+        persistent = SQLiteStore(database_url)
+    elif store == "redis":
+        persistent = RedisStore(redis_url)
+    elif store == "memory":
+        persistent = None
+    else:
+        raise RuntimeError(f"Unknown RESOLVE_CACHE_STORE: {store}")
+    return ResolveCache(max_entries=max_entries, default_ttl=default_ttl, expiry_margin=expiry_margin, store=persistent)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable
+
+import redis.asyncio as redis
+
+from bridge_transport import ACTIONS_CHANNEL, BridgeTransport, StreamTransport, create_bridge_transport
+
+WORKERS_KEY = "premium_workers"
+RING_REPLICAS = 64
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    # Each worker owns RING_REPLICAS points, so adding or removing one moves only about
+    # 1/N of the chats and spreads them over the others.
+    def __init__(self, workers: Iterable[str], replicas: int = RING_REPLICAS) -> None:
+        self.workers = frozenset(workers)
+        points = sorted((_hash(f"{worker}#{n}"), worker) for worker in self.workers for n in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def owner(self, chat_id: int) -> str | None:
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._hashes, _hash(str(chat_id))) % len(self._hashes)
+        return self._owners[index]
+
+
+class WorkerRegistry:
+    # Live workers are members of a sorted set scored by their last heartbeat.
+    def __init__(self, redis_url: str, ttl: float = 15.0) -> None:
+        self._redis = redis.from_url(redis_url, decode_responses=True)
+        self.ttl = ttl
+
+    async def heartbeat(self, worker_id: str) -> None:
+        await self._redis.zadd(WORKERS_KEY, {worker_id: time.time()})
+
+    async def leave(self, worker_id: str) -> None:
+        await self._redis.zrem(WORKERS_KEY, worker_id)
+
+    async def live_workers(self) -> list[str]:
+        return await self._redis.zrangebyscore(WORKERS_KEY, time.time() - self.ttl, "+inf")
+
+    async def reap(self) -> list[str]:
+        # Publishers stop routing to a worker one ttl after its last heartbeat; waiting a
+        # second ttl before adopting its backlog means nothing lands there afterwards.
+        # ZREM answers 1 to exactly one caller, so each dead worker is adopted once.
+        dead = await self._redis.zrangebyscore(WORKERS_KEY, "-inf", time.time() - 2 * self.ttl)
+        return [worker for worker in dead if await self._redis.zrem(WORKERS_KEY, worker)]
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+class ShardedTransport:
+    """Routes each action to the worker that owns its chat on the hash ring.
+
+    Every worker reads only its own channel, ``music_actions:<worker id>``. Publishers
+    refresh the ring from the registry at most every ``refresh`` seconds.
+    """
+
+    def __init__(
+        self,
+        registry: WorkerRegistry,
+        transport_for: Callable[[str], BridgeTransport],
+        worker_id: str | None = None,
+        refresh: float = 2.0,
+    ) -> None:
+        self._registry = registry
+        self._transport_for = transport_for
+        self.worker_id = worker_id
+        self._refresh = refresh
+        self._ring = HashRing(())
+        self._ring_at = 0.0
+        self._transports: dict[str, BridgeTransport] = {}
+
+    async def publish(self, payload: dict[str, Any]) -> None:
+        ring = await self.ring()
+        owner = ring.owner(int(payload.get("chat_id") or 0))
+        if owner is None:
+            logging.warning("No premium worker is alive; dropping %s", payload.get("action"))
+            return
+        await self._transport(owner).publish(payload)
+
+    def subscribe(self) -> AsyncIterator[dict[str, Any]]:
+        if self.worker_id is None:
+            raise RuntimeError("Only a premium worker subscribes to a shard")
+        return self._transport(self.worker_id).subscribe()
+
+    async def ack(self, payloads: list[dict[str, Any]]) -> None:
+        await self._transport(self.worker_id).ack(payloads)
+
+    async def ring(self, fresh: bool = False) -> HashRing:
+        if fresh or time.monotonic() - self._ring_at >= self._refresh:
+            workers = await self._registry.live_workers()
+            # With every worker briefly missing, keep routing to the last known ring.
+            if workers or not self._ring.workers:
+                self._ring = HashRing(workers)
+            self._ring_at = time.monotonic()
+        return self._ring
+
+    async def run_membership(self, on_change: Callable[[HashRing], Awaitable[None]]) -> None:
+        # Heartbeats keep this worker on the ring; the same loop adopts dead workers'
+        # backlogs and tells the player when ownership moved.
+        workers: frozenset[str] = frozenset()
+        try:
+            while True:
+                await self._registry.heartbeat(self.worker_id)
+                for dead in await self._registry.reap():
+                    await self._adopt(dead)
+                ring = await self.ring(fresh=True)
+                if ring.workers != workers:
+                    logging.info("Premium workers now %s", sorted(ring.workers))
+                    workers = ring.workers
+                    await on_change(ring)
+                await asyncio.sleep(self._registry.ttl / 3)
+        finally:
+            await self._registry.leave(self.worker_id)
+
+    async def close(self) -> None:
+        for transport in self._transports.values():
+            await transport.close()
+        await self._registry.close()
+
+    async def _adopt(self, dead: str) -> None:
+        transport = self._transports.pop(dead, None) or self._transport_for(dead)
+        if not isinstance(transport, StreamTransport):
+            # Pub/sub never kept anything for the dead worker to hand over.
+            await transport.close()
+            return
+        payloads = await transport.drain()
+        await transport.close()
+        await self.ring(fresh=True)
+        for payload in payloads:
+            await self.publish(payload)
+        logging.info("Rerouted %s actions left by dead worker %s", len(payloads), dead)
+
+    def _transport(self, worker_id: str) -> BridgeTransport:
+        transport = self._transports.get(worker_id)
+        if transport is None:
+            transport = self._transports[worker_id] = self._transport_for(worker_id)
+        return transport
+
+
+def create_sharded_transport(
+    transport: str,
+    redis_url: str,
+    heartbeat_ttl: float = 15.0,
+    worker_id: str | None = None,
+    **options: Any,
+) -> ShardedTransport:
+    def transport_for(worker: str) -> BridgeTransport:
+        return create_bridge_transport(
+            transport, redis_url, channel=f"{ACTIONS_CHANNEL}:{worker}", consumer=worker, **options
+        )
+
+    return ShardedTransport(WorkerRegistry(redis_url, heartbeat_ttl), transport_for, worker_id)
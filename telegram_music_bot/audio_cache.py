@@ -0,0 +1,201 @@
+"""Size-bounded, content-addressed store for downloaded audio."""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from telegram_music_bot.database import ConnectionPool
+
+MIGRATIONS = (
+    (
+        """
+        CREATE TABLE audio_cache (
+            cache_key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            title TEXT NOT NULL,
+            duration INTEGER,
+            size_bytes INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX audio_cache_last_access ON audio_cache (last_access)",
+    ),
+    # v2: static playback gain from loudness analysis; NULL until the track has been measured.
+    ("ALTER TABLE audio_cache ADD COLUMN gain_db REAL",),
+    # v3: optional raw PCM copy in the voice stack's input format. NULL means not yet
+    # transcoded, '' means the transcode failed and is not retried.
+    (
+        "ALTER TABLE audio_cache ADD COLUMN pcm_path TEXT",
+        "ALTER TABLE audio_cache ADD COLUMN pcm_bytes INTEGER NOT NULL DEFAULT 0",
+    ),
+    # v4: plays served from the cache, so only popular tracks earn a PCM copy.
+    ("ALTER TABLE audio_cache ADD COLUMN hits INTEGER NOT NULL DEFAULT 0",),
+)
+
+
+@dataclass
+class CachedAudio:
+    cache_key: str
+    path: Path
+    title: str
+    duration: int | None
+    size_bytes: int
+    gain_db: float | None = None
+    pcm_path: Path | None = None
+
+
+class AudioCache:
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self._root = Path(root)
+        self._staging = self._root / ".partial"
+        self._max_bytes = max_bytes
+        self._pool = ConnectionPool(str(self._root / "index.db"), readers=1)
+
+    async def open(self) -> None:
+        self._root.mkdir(parents=True, exist_ok=True)
+        # Anything still staged is a download that died half way; it was never indexed.
+        shutil.rmtree(self._staging, ignore_errors=True)
+        self._staging.mkdir()
+        await self._pool.open()
+        await self._pool.migrate(MIGRATIONS)
+        async with self._pool.read() as db:
+            cursor = await db.execute("SELECT cache_key, path FROM audio_cache")
+            rows = await cursor.fetchall()
+        missing = [(key,) for key, path in rows if not Path(path).is_file()]
+        if missing:
+            await self._pool.run_write(lambda db: db.executemany("DELETE FROM audio_cache WHERE cache_key = ?", missing))
+        await self._evict()
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+    def staging_dir(self) -> Path:
+        return Path(tempfile.mkdtemp(dir=self._staging))
+
+    async def get(self, cache_key: str) -> CachedAudio | None:
+        async with self._pool.read() as db:
+            cursor = await db.execute(
+                "SELECT path, title, duration, size_bytes, gain_db, pcm_path FROM audio_cache WHERE cache_key = ?",
+                (cache_key,),
+            )
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        pcm_path = Path(row[5]) if row[5] and Path(row[5]).is_file() else None
+        entry = CachedAudio(cache_key, Path(row[0]), row[1], row[2], row[3], row[4], pcm_path)
+        if not entry.path.is_file():
+            if pcm_path is not None:
+                pcm_path.unlink(missing_ok=True)
+            await self._pool.run_write(lambda db: db.execute("DELETE FROM audio_cache WHERE cache_key = ?", (cache_key,)))
+            return None
+        await self._pool.run_write(
+            lambda db: db.execute(
+                "UPDATE audio_cache SET last_access = ?, hits = hits + 1 WHERE cache_key = ?", (time.time(), cache_key)
+            )
+        )
+        return entry
+
+    async def store(self, cache_key: str, staged: Path, title: str, duration: int | None) -> CachedAudio:
+        # The rename is atomic, so the final name only ever refers to a complete file.
+        target = self._root / f"{_file_stem(cache_key)}{staged.suffix}"
+        os.replace(staged, target)
+        shutil.rmtree(staged.parent, ignore_errors=True)
+        entry = CachedAudio(cache_key, target, title, duration, target.stat().st_size)
+        await self._pool.run_write(
+            lambda db: db.execute(
+                "INSERT OR REPLACE INTO audio_cache (cache_key, path, title, duration, size_bytes, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, str(target), title, duration, entry.size_bytes, time.time()),
+            )
+        )
+        await self._evict(keep=cache_key)
+        return entry
+
+    async def store_pcm(self, cache_key: str, staged: Path) -> None:
+        target = self._root / f"{_file_stem(cache_key)}.pcm"
+        os.replace(staged, target)
+        shutil.rmtree(staged.parent, ignore_errors=True)
+        size = target.stat().st_size
+        cursor = await self._pool.run_write(
+            lambda db: db.execute(
+                "UPDATE audio_cache SET pcm_path = ?, pcm_bytes = ? WHERE cache_key = ?", (str(target), size, cache_key)
+            )
+        )
+        if not cursor.rowcount:
+            # The source was evicted while it was being transcoded.
+            target.unlink(missing_ok=True)
+            return
+        await self._evict(keep=cache_key)
+
+    async def mark_pcm_failed(self, cache_key: str) -> None:
+        await self._pool.run_write(
+            lambda db: db.execute("UPDATE audio_cache SET pcm_path = '' WHERE cache_key = ?", (cache_key,))
+        )
+
+    async def pending_transcode(self, min_hits: int = 0, limit: int = 32) -> list[tuple[str, Path]]:
+        # A PCM copy is several times the size of its source and shares the byte budget, so
+        # it is only worth it for tracks that keep getting played.
+        async with self._pool.read() as db:
+            cursor = await db.execute(
+                "SELECT cache_key, path FROM audio_cache WHERE pcm_path IS NULL AND hits >= ? "
+                "ORDER BY hits DESC, last_access DESC LIMIT ?",
+                (min_hits, limit),
+            )
+            rows = await cursor.fetchall()
+        return [(cache_key, Path(path)) for cache_key, path in rows]
+
+    async def set_gain(self, cache_key: str, gain_db: float) -> None:
+        await self._pool.run_write(
+            lambda db: db.execute("UPDATE audio_cache SET gain_db = ? WHERE cache_key = ?", (gain_db, cache_key))
+        )
+
+    async def pending_analysis(self, limit: int = 32) -> list[tuple[str, Path]]:
+        async with self._pool.read() as db:
+            cursor = await db.execute(
+                "SELECT cache_key, path FROM audio_cache WHERE gain_db IS NULL ORDER BY last_access DESC LIMIT ?",
+                (limit,),
+            )
+            rows = await cursor.fetchall()
+        return [(cache_key, Path(path)) for cache_key, path in rows]
+
+    def discard(self, staged_dir: Path) -> None:
+        shutil.rmtree(staged_dir, ignore_errors=True)
+
+    async def total_bytes(self) -> int:
+        async with self._pool.read() as db:
+            cursor = await db.execute("SELECT COALESCE(SUM(size_bytes + pcm_bytes), 0) FROM audio_cache")
+            (total,) = await cursor.fetchone()
+        return total
+
+    async def _evict(self, keep: str | None = None) -> None:
+        total = await self.total_bytes()
+        if total <= self._max_bytes:
+            return
+        async with self._pool.read() as db:
+            cursor = await db.execute(
+                "SELECT cache_key, path, pcm_path, size_bytes + pcm_bytes FROM audio_cache ORDER BY last_access ASC"
+            )
+            rows = await cursor.fetchall()
+        evicted: list[tuple[str]] = []
+        for cache_key, path, pcm_path, size_bytes in rows:
+            if total <= self._max_bytes:
+                break
+            if cache_key == keep:
+                continue
+            # Players that already opened the file keep reading it after the unlink.
+            Path(path).unlink(missing_ok=True)
+            if pcm_path:
+                Path(pcm_path).unlink(missing_ok=True)
+            evicted.append((cache_key,))
+            total -= size_bytes
+        if evicted:
+            await self._pool.run_write(lambda db: db.executemany("DELETE FROM audio_cache WHERE cache_key = ?", evicted))
+
+
+def _file_stem(cache_key: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]", "_", cache_key)
@@ -1,12 +1,23 @@
 """Audio processing and extraction helpers."""
 from __future__ import annotations
 
+import asyncio
+import errno
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, BinaryIO, Callable
+from urllib.parse import parse_qs, urlparse
 
+import httpx
 from yt_dlp import YoutubeDL
 
+from telegram_music_bot.audio_cache import AudioCache, CachedAudio
+
 
 @dataclass
 class AudioSource:
@@ -14,26 +25,271 @@ class AudioSource:
     url: str
     local_path: Path
     duration: int | None
+    gain_db: float | None = None
+    pcm_path: Path | None = None
+
+
+@dataclass
+class DownloadProgress:
+    url: str
+    downloaded_bytes: int
+    total_bytes: int | None
+    finished: bool = False
+
+    @property
+    def fraction(self) -> float | None:
+        if self.finished:
+            return 1.0
+        if not self.total_bytes:
+            return None
+        return min(1.0, self.downloaded_bytes / self.total_bytes)
+
+
+ProgressCallback = Callable[[DownloadProgress], None]
+
+CHUNK_BYTES = 64 * 1024
+PIPE_OPEN_TIMEOUT = 30.0
+
+
+# YouTube URLs carry their video id, so cache hits for them skip yt-dlp entirely.
+def video_key(url: str) -> str | None:
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.").removeprefix("music.")
+    video_id = ""
+    if host == "youtu.be":
+        video_id = parsed.path.strip("/")
+    elif host == "youtube.com" and parsed.path == "/watch":
+        video_id = parse_qs(parsed.query).get("v", [""])[0]
+    elif host == "youtube.com":
+        for prefix in ("/shorts/", "/live/", "/embed/"):
+            if parsed.path.startswith(prefix):
+                video_id = parsed.path[len(prefix) :].strip("/")
+    return f"youtube:{video_id}" if video_id else None
+
+
+class _GrowingFile:
+    def __init__(self) -> None:
+        self.grew = threading.Event()
+        self.finished = False
+
+
+def _feed_pipe(reader: BinaryIO, pipe: Path, growing: _GrowingFile) -> None:
+    # Tails the download into the FIFO the player reads, until the download ends or the
+    # player goes away. Runs on its own thread because FIFO writes block on the reader.
+    try:
+        deadline = time.monotonic() + PIPE_OPEN_TIMEOUT
+        while True:
+            try:
+                fd = os.open(pipe, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as error:
+                if error.errno != errno.ENXIO or time.monotonic() > deadline:
+                    return
+                time.sleep(0.05)
+        os.set_blocking(fd, True)
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                finished = growing.finished
+                chunk = reader.read(CHUNK_BYTES)
+                if chunk:
+                    out.write(chunk)
+                    continue
+                if finished:
+                    return
+                growing.grew.wait(0.5)
+                growing.grew.clear()
+    except BrokenPipeError:
+        return
+    finally:
+        reader.close()
+        shutil.rmtree(pipe.parent, ignore_errors=True)
 
 
 class AudioStreamer:
-    def __init__(self, cache_path: str) -> None:
-        self._cache_path = Path(cache_path)
-        self._cache_path.mkdir(parents=True, exist_ok=True)
+    def __init__(self, cache: AudioCache, max_downloads: int = 2) -> None:
+        self._cache = cache
+        # Downloads get their own threads so a slow one never holds up the default executor.
+        self._executor = ThreadPoolExecutor(max_downloads, thread_name_prefix="download")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def prepare(self, url: str, on_progress: ProgressCallback | None = None) -> AudioSource:
+        key, info, cached = await self._lookup(url)
+        if cached is None:
+            cached = await self._download_to_cache(key, info, self._progress_hooks(url, on_progress))
+        return self._cached_source(url, cached)
+
+    async def stream(
+        self, url: str, buffer_bytes: int, on_progress: ProgressCallback | None = None
+    ) -> tuple[AudioSource, asyncio.Future[AudioSource]]:
+        # Returns a source to play once buffer_bytes have arrived, and a future for the finished,
+        # cached copy. A partly downloaded track plays through a FIFO fed as the download grows.
+        loop = asyncio.get_running_loop()
+        key, info, cached = await self._lookup(url)
+        hooks = self._progress_hooks(url, on_progress)
+        if cached is None and info.get("protocol") not in {"http", "https"}:
+            # Segmented (HLS/DASH) formats need yt-dlp's own downloader, so they play once complete.
+            cached = await self._download_to_cache(key, info, hooks)
+        if cached is not None:
+            source = self._cached_source(url, cached)
+            done: asyncio.Future[AudioSource] = loop.create_future()
+            done.set_result(source)
+            return source, done
+
+        title = info.get("title", "Unknown")
+        staging = self._cache.staging_dir()
+        part = staging / f"{info['id']}.{info.get('ext') or 'audio'}"
+        growing = _GrowingFile()
+        buffered = asyncio.Event()
+        fetch = loop.run_in_executor(
+            self._executor,
+            self._fetch,
+            info,
+            part,
+            growing,
+            buffer_bytes,
+            lambda: loop.call_soon_threadsafe(buffered.set),
+            hooks,
+        )
+
+        async def complete() -> AudioSource:
+            try:
+                await fetch
+            except BaseException:
+                self._cache.discard(staging)
+                raise
+            entry = await self._cache.store(key, part, title, info.get("duration"))
+            return AudioSource(title=title, url=url, local_path=entry.path, duration=entry.duration)
+
+        completed = asyncio.ensure_future(complete())
+        waiter = asyncio.ensure_future(buffered.wait())
+        try:
+            await asyncio.wait({completed, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            completed.cancel()
+            raise
+        finally:
+            waiter.cancel()
+        if completed.done():
+            return await completed, completed
+
+        # Open the growing file before yielding to the loop: the rename into the cache keeps
+        # this handle valid, but a handle opened after it would find nothing at this path.
+        reader = part.open("rb")
+        pipe_dir = self._cache.staging_dir()
+        pipe = pipe_dir / "playback.fifo"
+        os.mkfifo(pipe)
+        threading.Thread(
+            target=_feed_pipe, args=(reader, pipe, growing), name="progressive-feed", daemon=True
+        ).start()
+        return AudioSource(title=title, url=url, local_path=pipe, duration=info.get("duration")), completed
+
+    @staticmethod
+    def _cached_source(url: str, cached: CachedAudio) -> AudioSource:
+        return AudioSource(
+            title=cached.title,
+            url=url,
+            local_path=cached.path,
+            duration=cached.duration,
+            gain_db=cached.gain_db,
+            pcm_path=cached.pcm_path,
+        )
+
+    async def _lookup(self, url: str) -> tuple[str, dict[str, Any], CachedAudio | None]:
+        key = video_key(url)
+        if key:
+            cached = await self._cache.get(key)
+            if cached is not None:
+                return key, {}, cached
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(self._executor, self._extract, url)
+        key = f"{info['extractor_key'].lower()}:{info['id']}"
+        return key, info, await self._cache.get(key)
+
+    async def _download_to_cache(
+        self, key: str, info: dict[str, Any], hooks: list[Callable[[dict[str, Any]], None]]
+    ) -> CachedAudio:
+        loop = asyncio.get_running_loop()
+        staging = self._cache.staging_dir()
+        try:
+            path = await loop.run_in_executor(self._executor, self._download, info, staging, hooks)
+        except BaseException:
+            self._cache.discard(staging)
+            raise
+        return await self._cache.store(key, path, info.get("title", "Unknown"), info.get("duration"))
 
-    def prepare(self, url: str) -> AudioSource:
+    @staticmethod
+    def _progress_hooks(url: str, on_progress: ProgressCallback | None) -> list[Callable[[dict[str, Any]], None]]:
+        if on_progress is None:
+            return []
+        loop = asyncio.get_running_loop()
+
+        def report(status: dict[str, Any]) -> None:
+            # yt-dlp calls hooks on the download thread; hand each update back to the loop.
+            progress = DownloadProgress(
+                url=url,
+                downloaded_bytes=status.get("downloaded_bytes") or 0,
+                total_bytes=status.get("total_bytes") or status.get("total_bytes_estimate"),
+                finished=status.get("status") == "finished",
+            )
+            loop.call_soon_threadsafe(on_progress, progress)
+
+        return [report]
+
+    def _extract(self, url: str) -> dict[str, Any]:
+        options: dict[str, Any] = {"format": "bestaudio/best", "quiet": True, "noplaylist": True}
+        with YoutubeDL(options) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if "entries" in info:
+            info = info["entries"][0]
+        return info
+
+    def _download(
+        self, info: dict[str, Any], staging: Path, progress_hooks: list[Callable[[dict[str, Any]], None]]
+    ) -> Path:
         options: dict[str, Any] = {
             "format": "bestaudio/best",
-            "outtmpl": str(self._cache_path / "%(id)s.%(ext)s"),
+            "outtmpl": str(staging / "%(id)s.%(ext)s"),
             "quiet": True,
+            "noprogress": True,
             "noplaylist": True,
+            "progress_hooks": progress_hooks,
         }
         with YoutubeDL(options) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-        return AudioSource(
-            title=info.get("title", "Unknown"),
-            url=url,
-            local_path=Path(filename),
-            duration=info.get("duration"),
-        )
+            info = ydl.process_ie_result(info, download=True)
+            downloads = info.get("requested_downloads") or [{}]
+            return Path(downloads[0].get("filepath") or ydl.prepare_filename(info))
+
+    def _fetch(
+        self,
+        info: dict[str, Any],
+        part: Path,
+        growing: _GrowingFile,
+        buffer_bytes: int,
+        on_buffered: Callable[[], None],
+        progress_hooks: list[Callable[[dict[str, Any]], None]],
+    ) -> None:
+        downloaded = 0
+        buffered = False
+        try:
+            with httpx.stream(
+                "GET", info["url"], headers=info.get("http_headers") or {}, follow_redirects=True, timeout=30
+            ) as response, part.open("wb") as out:
+                response.raise_for_status()
+                total = int(response.headers["content-length"]) if "content-length" in response.headers else None
+                for chunk in response.iter_bytes(CHUNK_BYTES):
+                    out.write(chunk)
+                    out.flush()
+                    downloaded += len(chunk)
+                    growing.grew.set()
+                    for hook in progress_hooks:
+                        hook({"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": total})
+                    if not buffered and downloaded >= buffer_bytes:
+                        buffered = True
+                        on_buffered()
+            for hook in progress_hooks:
+                hook({"status": "finished", "downloaded_bytes": downloaded, "total_bytes": downloaded})
+        finally:
+            growing.finished = True
+            growing.grew.set()
@@ -2,11 +2,13 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 from datetime import datetime
 from typing import Any
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.constants import ChatAction
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -24,7 +26,15 @@ class BotClient:
     def __init__(self, config: Config) -> None:
         self._config = config
         self._bridge = RedisBridge(config)
-        self._queues = QueueManager(config.database_path)
+        self._queues = QueueManager(
+            config.database_path,
+            config.database_readers,
+            group_commit_window=config.queue_group_commit_ms / 1000,
+            group_commit_max_ops=config.queue_group_commit_max_ops,
+            cache_chats=config.queue_cache_chats,
+        )
+        # The latest /play reply in each chat, edited as the player reports download progress.
+        self._download_messages: dict[int, Message] = {}
 
     async def start(self) -> None:
         await self._queues.initialize()
@@ -35,10 +45,15 @@ class BotClient:
         application.add_handler(CommandHandler("queue", self.queue))
         application.add_handler(CallbackQueryHandler(self.callbacks))
 
-        await application.initialize()
-        await application.start()
-        await application.updater.start_polling()
-        await application.updater.wait()
+        progress = asyncio.create_task(self._render_progress())
+        try:
+            await application.initialize()
+            await application.start()
+            await application.updater.start_polling()
+            await application.updater.wait()
+        finally:
+            progress.cancel()
+            await self._queues.close()
 
     async def play(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not update.effective_chat or not update.effective_user:
@@ -64,7 +79,7 @@ class BotClient:
                 payload={"query": query},
             )
         )
-        await update.message.reply_text(
+        self._download_messages[item.chat_id] = await update.message.reply_text(
             f"Queued: {query}",
             reply_markup=UIComponents.playback_controls(is_playing=True),
         )
@@ -122,6 +137,24 @@ class BotClient:
             reply_markup=UIComponents.playback_controls(status.is_playing),
         )
 
+    async def _render_progress(self) -> None:
+        async for message in self._bridge.subscribe_progress():
+            if message.action != "download_progress":
+                continue
+            reply = self._download_messages.get(message.chat_id)
+            if reply is None:
+                continue
+            percent = int(message.payload.get("percent", 0))
+            if percent >= 100:
+                self._download_messages.pop(message.chat_id, None)
+            try:
+                await reply.edit_text(
+                    UIComponents.download_message(message.payload.get("query", ""), percent),
+                    reply_markup=UIComponents.playback_controls(is_playing=True),
+                )
+            except TelegramError:
+                logging.warning("Could not show download progress in chat %s", message.chat_id, exc_info=True)
+
     async def _simple_action(self, update: Update, action: str) -> None:
         if not update.effective_chat or not update.effective_user:
             return
@@ -3,13 +3,17 @@ from __future__ import annotations
 
 import asyncio
 import json
+import time
 from dataclasses import dataclass
 from typing import Any, AsyncIterator
 
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 
 from telegram_music_bot.config import Config
 
+STREAM_GROUP = "premium"
+
 
 @dataclass
 class BridgeMessage:
@@ -17,6 +21,8 @@ class BridgeMessage:
     chat_id: int
     user_id: int
     payload: dict[str, Any]
+    # Set on messages read from the actions stream; handed back to RedisBridge.ack once handled.
+    entry_id: str | None = None
 
     def to_json(self) -> str:
         return json.dumps(
@@ -43,13 +49,47 @@ class RedisBridge:
     def __init__(self, config: Config) -> None:
         self._config = config
         self._redis = redis.from_url(config.redis_url, decode_responses=True)
+        self._streams = config.bridge_transport == "streams"
+        self._group_ready = False
 
     async def publish(self, message: BridgeMessage) -> None:
-        await self._redis.publish(self._config.bridge_channel, message.to_json())
+        if not self._streams:
+            await self._redis.publish(self._config.bridge_channel, message.to_json())
+            return
+        await self._ensure_group()
+        await self._redis.xadd(
+            self._config.bridge_channel,
+            {"data": message.to_json()},
+            maxlen=self._config.bridge_stream_maxlen,
+            approximate=True,
+        )
 
     async def subscribe(self) -> AsyncIterator[BridgeMessage]:
+        if self._streams:
+            async for message in self._consume_stream():
+                yield message
+            return
+        async for message in self._listen(self._config.bridge_channel):
+            yield message
+
+    async def publish_progress(self, message: BridgeMessage) -> None:
+        # Player-to-bot updates on their own channel. They only matter live, so they go over
+        # pub/sub and never into the actions stream the player consumes.
+        await self._redis.publish(self._config.progress_channel, message.to_json())
+
+    def subscribe_progress(self) -> AsyncIterator[BridgeMessage]:
+        return self._listen(self._config.progress_channel)
+
+    async def ack(self, message: BridgeMessage) -> None:
+        if message.entry_id is not None:
+            await self._redis.xack(self._config.bridge_channel, STREAM_GROUP, message.entry_id)
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+    async def _listen(self, channel: str) -> AsyncIterator[BridgeMessage]:
         pubsub = self._redis.pubsub()
-        await pubsub.subscribe(self._config.bridge_channel)
+        await pubsub.subscribe(channel)
         try:
             async for raw in pubsub.listen():
                 if raw.get("type") != "message":
@@ -59,11 +99,71 @@ class RedisBridge:
                     continue
                 yield BridgeMessage.from_json(data)
         finally:
-            await pubsub.unsubscribe(self._config.bridge_channel)
+            await pubsub.unsubscribe(channel)
             await pubsub.close()
 
-    async def close(self) -> None:
-        await self._redis.close()
+    async def _ensure_group(self) -> None:
+        if self._group_ready:
+            return
+        try:
+            await self._redis.xgroup_create(self._config.bridge_channel, STREAM_GROUP, id="$", mkstream=True)
+        except ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+        self._group_ready = True
+
+    async def _consume_stream(self) -> AsyncIterator[BridgeMessage]:
+        # Each message is acknowledged through ack() once handled, so a restart replays what
+        # was in flight and entries left by a dead consumer are claimed after BRIDGE_CLAIM_IDLE_MS.
+        await self._ensure_group()
+        stream = self._config.bridge_channel
+        consumer = self._config.bridge_consumer
+        # Pending entries stay pending until handled, so the cursor moves past each batch read.
+        recovered: str | None = "0"
+        next_claim = 0.0
+        while True:
+            entries = []
+            if recovered:
+                response = await self._redis.xreadgroup(
+                    STREAM_GROUP, consumer, {stream: recovered}, count=self._config.bridge_batch
+                )
+                entries = response[0][1] if response else []
+                recovered = entries[-1][0] if entries else None
+            if not entries and time.monotonic() >= next_claim:
+                next_claim = time.monotonic() + self._config.bridge_claim_idle_ms / 1000
+                entries = await self._claim()
+            if not entries:
+                response = await self._redis.xreadgroup(
+                    STREAM_GROUP, consumer, {stream: ">"}, count=self._config.bridge_batch, block=5000
+                )
+                entries = response[0][1] if response else []
+            # Entries trimmed while pending come back without fields; they are only acked.
+            trimmed = [entry_id for entry_id, fields in entries if not fields or not fields.get("data")]
+            if trimmed:
+                await self._redis.xack(stream, STREAM_GROUP, *trimmed)
+            for entry_id, fields in entries:
+                if entry_id not in trimmed:
+                    message = BridgeMessage.from_json(fields["data"])
+                    message.entry_id = entry_id
+                    yield message
+
+    async def _claim(self) -> list[tuple[str, dict[str, str] | None]]:
+        # Only other consumers' entries are taken over: this one's own are still being handled.
+        stream = self._config.bridge_channel
+        consumer = self._config.bridge_consumer
+        batch = self._config.bridge_batch
+        idle_ms = self._config.bridge_claim_idle_ms
+        entry_ids: list[str] = []
+        start = "-"
+        while len(entry_ids) < batch:
+            pending = await self._redis.xpending_range(stream, STREAM_GROUP, start, "+", batch, idle=idle_ms)
+            entry_ids += [entry["message_id"] for entry in pending if entry["consumer"] != consumer]
+            if len(pending) < batch:
+                break
+            start = f"({pending[-1]['message_id']}"
+        if not entry_ids:
+            return []
+        return await self._redis.xclaim(stream, STREAM_GROUP, consumer, idle_ms, entry_ids[:batch])
 
 
 async def run_healthcheck_server(host: str = "0.0.0.0", port: int = 8080) -> None:
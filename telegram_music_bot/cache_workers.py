@@ -0,0 +1,78 @@
+"""Background worker pools that post-process tracks in the audio cache."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+
+async def run_ffmpeg(*args: str) -> bytes:
+    # Cache work is never urgent, so ffmpeg runs below playback's priority.
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=lambda: os.nice(10),
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr[-500:].decode(errors='replace')}")
+    return stderr
+
+
+class CacheWorkerPool(ABC):
+    def __init__(self, workers: int) -> None:
+        self._workers = workers
+        self._jobs: asyncio.Queue[tuple[str, Path]] = asyncio.Queue()
+        self._queued: set[str] = set()
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    # Cached tracks that still need this pool's work.
+    @abstractmethod
+    async def pending(self) -> list[tuple[str, Path]]: ...
+
+    # Does the work for one track and records its result in the cache.
+    @abstractmethod
+    async def process(self, cache_key: str, path: Path) -> None: ...
+
+    def start(self) -> None:
+        if self._workers <= 0 or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._scan())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self._workers)]
+        self._wake.set()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _scan(self) -> None:
+        # Anything still pending is picked up, including tracks cached before a restart.
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            for cache_key, path in await self.pending():
+                if cache_key not in self._queued:
+                    self._queued.add(cache_key)
+                    self._jobs.put_nowait((cache_key, path))
+
+    async def _work(self) -> None:
+        while True:
+            cache_key, path = await self._jobs.get()
+            try:
+                await self.process(cache_key, path)
+            except Exception:
+                logging.exception("%s failed for %s", type(self).__name__, cache_key)
+            finally:
+                self._queued.discard(cache_key)
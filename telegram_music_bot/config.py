@@ -12,8 +12,26 @@ class Config:
     api_hash: str
     redis_url: str
     database_path: str
+    database_readers: int
+    queue_group_commit_ms: float
+    queue_group_commit_max_ops: int
+    queue_cache_chats: int
     audio_cache_path: str
+    audio_cache_max_mb: int
+    download_concurrency: int
+    progressive_buffer_kb: int
+    loudness_workers: int
+    loudness_target_lufs: float
+    transcode_workers: int
+    transcode_min_hits: int
+    shared_decode: bool
     bridge_channel: str
+    progress_channel: str
+    bridge_transport: str
+    bridge_stream_maxlen: int
+    bridge_batch: int
+    bridge_claim_idle_ms: int
+    bridge_consumer: str
     admin_user_ids: tuple[int, ...]
 
 
@@ -24,8 +42,28 @@ class Config:
         api_hash = os.getenv("API_HASH", "")
         redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
         database_path = os.getenv("DATABASE_PATH", "data/music_bot.db")
+        database_readers = int(os.getenv("DATABASE_READERS", "4"))
+        queue_group_commit_ms = float(os.getenv("QUEUE_GROUP_COMMIT_MS", "0"))
+        queue_group_commit_max_ops = int(os.getenv("QUEUE_GROUP_COMMIT_MAX_OPS", "64"))
+        queue_cache_chats = int(os.getenv("QUEUE_CACHE_CHATS", "256"))
         audio_cache_path = os.getenv("AUDIO_CACHE_PATH", "data/cache")
+        audio_cache_max_mb = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+        download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", "2"))
+        progressive_buffer_kb = int(os.getenv("PROGRESSIVE_BUFFER_KB", "512"))
+        loudness_workers = int(os.getenv("LOUDNESS_WORKERS", "1"))
+        loudness_target_lufs = float(os.getenv("LOUDNESS_TARGET_LUFS", "-14"))
+        transcode_workers = int(os.getenv("TRANSCODE_WORKERS", "0"))
+        transcode_min_hits = int(os.getenv("TRANSCODE_MIN_HITS", "3"))
+        shared_decode = os.getenv("SHARED_DECODE", "1").lower() in {"1", "true", "yes"}
         bridge_channel = os.getenv("BRIDGE_CHANNEL", "music_bot_events")
+        progress_channel = os.getenv("PROGRESS_CHANNEL", "music_bot_progress")
+        bridge_transport = os.getenv("BRIDGE_TRANSPORT", "pubsub").lower()
+        bridge_stream_maxlen = int(os.getenv("BRIDGE_STREAM_MAXLEN", "10000"))
+        bridge_batch = int(os.getenv("BRIDGE_BATCH", "64"))
+        bridge_claim_idle_ms = int(os.getenv("BRIDGE_CLAIM_IDLE_MS", "30000"))
+        # Must stay the same across restarts (unlike a container hostname) for the player to
+        # get back the actions it had read but not finished.
+        bridge_consumer = os.getenv("BRIDGE_CONSUMER", "premium_session")
         admin_user_ids = tuple(
             int(value)
             for value in os.getenv("ADMIN_USER_IDS", "").split(",")
@@ -43,7 +81,25 @@ class Config:
             api_hash=api_hash,
             redis_url=redis_url,
             database_path=database_path,
+            database_readers=database_readers,
+            queue_group_commit_ms=queue_group_commit_ms,
+            queue_group_commit_max_ops=queue_group_commit_max_ops,
+            queue_cache_chats=queue_cache_chats,
             audio_cache_path=audio_cache_path,
+            audio_cache_max_mb=audio_cache_max_mb,
+            download_concurrency=download_concurrency,
+            progressive_buffer_kb=progressive_buffer_kb,
+            loudness_workers=loudness_workers,
+            loudness_target_lufs=loudness_target_lufs,
+            transcode_workers=transcode_workers,
+            transcode_min_hits=transcode_min_hits,
+            shared_decode=shared_decode,
             bridge_channel=bridge_channel,
+            progress_channel=progress_channel,
+            bridge_transport=bridge_transport,
+            bridge_stream_maxlen=bridge_stream_maxlen,
+            bridge_batch=bridge_batch,
+            bridge_claim_idle_ms=bridge_claim_idle_ms,
+            bridge_consumer=bridge_consumer,
             admin_user_ids=admin_user_ids,
         )
@@ -0,0 +1,50 @@
+"""Background loudness analysis for cached tracks."""
+from __future__ import annotations
+
+import logging
+import re
+from pathlib import Path
+
+from telegram_music_bot.audio_cache import AudioCache
+from telegram_music_bot.cache_workers import CacheWorkerPool, run_ffmpeg
+
+# pytgcalls call volume tops out at 200%, i.e. about +6 dB.
+MAX_BOOST_DB = 6.0
+MAX_CUT_DB = -30.0
+
+_INTEGRATED = re.compile(rb"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+async def measure_loudness(path: Path) -> float:
+    # EBU R128 integrated loudness; ebur128 prints its summary to stderr.
+    stderr = await run_ffmpeg("-i", str(path), "-vn", "-af", "ebur128=framelog=quiet", "-f", "null", "-")
+    found = _INTEGRATED.findall(stderr)
+    if not found:
+        raise RuntimeError(f"No loudness measurement for {path}")
+    return float(found[-1])
+
+
+def gain_for(loudness: float, target: float) -> float:
+    return round(min(MAX_BOOST_DB, max(MAX_CUT_DB, target - loudness)), 2)
+
+
+def volume_percent(gain_db: float) -> int:
+    return max(1, min(200, round(100 * 10 ** (gain_db / 20))))
+
+
+class LoudnessAnalyzer(CacheWorkerPool):
+    def __init__(self, cache: AudioCache, target_lufs: float = -14.0, workers: int = 1) -> None:
+        super().__init__(workers)
+        self._cache = cache
+        self._target = target_lufs
+
+    async def pending(self) -> list[tuple[str, Path]]:
+        return await self._cache.pending_analysis()
+
+    async def process(self, cache_key: str, path: Path) -> None:
+        try:
+            gain = gain_for(await measure_loudness(path), self._target)
+        except Exception:
+            logging.warning("Loudness analysis failed for %s; playing it at unity gain", cache_key, exc_info=True)
+            gain = 0.0
+        await self._cache.set_gain(cache_key, gain)
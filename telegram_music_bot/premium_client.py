@@ -2,16 +2,23 @@
 from __future__ import annotations
 
 import asyncio
+import logging
+import os
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
 from pytgcalls import PyTgCalls
-from pytgcalls.types.input_stream import AudioPiped
+from pytgcalls.types.input_stream import AudioPiped, InputAudioStream, InputStream
+from pytgcalls.types.input_stream.quality import HighQualityAudio
 from telethon import TelegramClient
 
-from telegram_music_bot.audio_streamer import AudioStreamer
+from telegram_music_bot.audio_cache import AudioCache
+from telegram_music_bot.audio_streamer import AudioStreamer, DownloadProgress
 from telegram_music_bot.bridge_server import BridgeMessage, RedisBridge
 from telegram_music_bot.config import Config
+from telegram_music_bot.loudness import LoudnessAnalyzer, volume_percent
+from telegram_music_bot.shared_decoder import DecoderHub, Subscription
+from telegram_music_bot.transcoder import PcmTranscoder
 
 
 @dataclass
@@ -29,38 +36,149 @@ class PremiumMusicPlayer:
         self._client = TelegramClient("premium_session", config.api_id, config.api_hash)
         self._calls = PyTgCalls(self._client)
         self._bridge = RedisBridge(config)
-        self._streamer = AudioStreamer(config.audio_cache_path)
+        self._cache = AudioCache(config.audio_cache_path, config.audio_cache_max_mb * 1024 * 1024)
+        self._streamer = AudioStreamer(self._cache, config.download_concurrency)
+        self._loudness = LoudnessAnalyzer(self._cache, config.loudness_target_lufs, config.loudness_workers)
+        self._transcoder = PcmTranscoder(self._cache, config.transcode_workers, config.transcode_min_hits)
         self._states: dict[int, PlaybackState] = {}
+        # The play message each loading task came from, acknowledged once the play is done.
+        self._loading: dict[int, tuple[BridgeMessage, asyncio.Task[None]]] = {}
+        self._progress_tasks: set[asyncio.Task[None]] = set()
+        self._decoders = DecoderHub(os.path.join(config.audio_cache_path, ".feeds"))
+        self._feeds: dict[int, Subscription] = {}
 
     async def start(self) -> None:
+        await self._cache.open()
+        self._decoders.open()
+        self._loudness.start()
+        self._transcoder.start()
         await self._client.start()
         await self._calls.start()
-        await self._listen_bridge()
+        try:
+            await self._listen_bridge()
+        finally:
+            for chat_id in list(self._feeds):
+                await self._close_feed(chat_id)
+            await self._decoders.close()
 
     async def _listen_bridge(self) -> None:
         async for message in self._bridge.subscribe():
-            await self._handle_message(message)
-
-    async def _handle_message(self, message: BridgeMessage) -> None:
+            try:
+                if await self._handle_message(message):
+                    continue
+            except Exception:
+                # Acknowledged anyway, or the action would fail again on every restart.
+                logging.exception("Bridge action %s failed in chat %s", message.action, message.chat_id)
+            await self._bridge.ack(message)
+
+    async def _handle_message(self, message: BridgeMessage) -> bool:
+        # True when the action goes on in the background and is acknowledged once it ends.
         if message.action == "play":
             query = message.payload.get("query", "")
             if not query:
-                return
-            await self._play(message.chat_id, query)
-        elif message.action in {"pause", "toggle"}:
+                return False
+            # Downloads run in the background so other chats' actions keep flowing meanwhile.
+            self._cancel_loading(message.chat_id)
+            task = asyncio.create_task(self._play(message.chat_id, message.user_id, query))
+            self._loading[message.chat_id] = (message, task)
+            task.add_done_callback(lambda done: self._loading_done(message, done))
+            return True
+        if message.action in {"pause", "toggle"}:
             await self._pause(message.chat_id)
         elif message.action == "skip":
             await self._skip(message.chat_id)
         elif message.action == "stop":
             await self._stop(message.chat_id)
+        return False
+
+    def _cancel_loading(self, chat_id: int) -> None:
+        loading = self._loading.pop(chat_id, None)
+        if loading is not None:
+            message, task = loading
+            task.cancel()
+            # Superseded by a later action, so it is done with. A play cut short by a
+            # shutdown is left pending instead and replayed on restart.
+            self._acknowledge(message)
+
+    def _loading_done(self, message: BridgeMessage, task: asyncio.Task[None]) -> None:
+        if self._loading.get(message.chat_id, (None, None))[1] is task:
+            del self._loading[message.chat_id]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logging.error("Playback failed in chat %s", message.chat_id, exc_info=task.exception())
+        self._acknowledge(message)
+
+    def _acknowledge(self, message: BridgeMessage) -> None:
+        task = asyncio.create_task(self._bridge.ack(message))
+        # The loop only keeps weak references to tasks.
+        self._progress_tasks.add(task)
+        task.add_done_callback(self._progress_tasks.discard)
+
+    def _download_done(self, url: str, download: asyncio.Future[Any]) -> None:
+        if download.cancelled():
+            return
+        if download.exception() is not None:
+            logging.error("Background download of %s failed", url, exc_info=download.exception())
+            return
+        self._cache_updated()
 
-    async def _play(self, chat_id: int, url: str) -> None:
-        source = self._streamer.prepare(url)
-        await self._calls.join_group_call(
-            chat_id,
-            AudioPiped(str(source.local_path)),
-            stream_type=None,
-        )
+    def _cache_updated(self) -> None:
+        self._loudness.wake()
+        self._transcoder.wake()
+
+    def _progress_reporter(self, chat_id: int, user_id: int, query: str) -> Callable[[DownloadProgress], None]:
+        reported = -1
+
+        def report(progress: DownloadProgress) -> None:
+            nonlocal reported
+            fraction = progress.fraction
+            if fraction is None:
+                return
+            percent = int(fraction * 100) // 10 * 10
+            if percent <= reported:
+                return
+            reported = percent
+            task = asyncio.create_task(
+                self._bridge.publish_progress(
+                    BridgeMessage(
+                        action="download_progress",
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        payload={"query": query, "url": progress.url, "percent": percent},
+                    )
+                )
+            )
+            # The loop only keeps weak references to tasks.
+            self._progress_tasks.add(task)
+            task.add_done_callback(self._progress_tasks.discard)
+
+        return report
+
+    async def _play(self, chat_id: int, user_id: int, url: str) -> None:
+        reporter = self._progress_reporter(chat_id, user_id, url)
+        if self._config.progressive_buffer_kb > 0:
+            # Playback starts on the first buffer; the rest of the download finishes into the cache.
+            source, completed = await self._streamer.stream(url, self._config.progressive_buffer_kb * 1024, reporter)
+            completed.add_done_callback(lambda done: self._download_done(url, done))
+        else:
+            source = await self._streamer.prepare(url, reporter)
+            self._cache_updated()
+        await self._close_feed(chat_id)
+        if source.pcm_path is not None:
+            # Already in the voice stack's input format, so no ffmpeg runs for this play.
+            stream = InputStream(InputAudioStream(str(source.pcm_path), HighQualityAudio()))
+        elif self._config.shared_decode and source.local_path.is_file():
+            # Chats starting the same cached track together share one ffmpeg decode.
+            feed = self._decoders.subscribe(source.local_path)
+            self._feeds[chat_id] = feed
+            stream = InputStream(InputAudioStream(str(feed.path), HighQualityAudio()))
+        else:
+            stream = AudioPiped(str(source.local_path))
+        await self._calls.join_group_call(chat_id, stream, stream_type=None)
+        if source.gain_db is not None and self._config.loudness_workers > 0:
+            # Normalisation is a gain measured once per cached track, so playback costs no extra CPU.
+            await self._calls.change_volume_call(chat_id, volume_percent(source.gain_db))
         self._states[chat_id] = PlaybackState(
             chat_id=chat_id,
             title=source.title,
@@ -78,13 +196,23 @@ class PremiumMusicPlayer:
         state.is_playing = False
 
     async def _skip(self, chat_id: int) -> None:
+        self._cancel_loading(chat_id)
         await self._calls.leave_group_call(chat_id)
+        await self._close_feed(chat_id)
         self._states.pop(chat_id, None)
 
     async def _stop(self, chat_id: int) -> None:
+        self._cancel_loading(chat_id)
         await self._calls.leave_group_call(chat_id)
+        await self._close_feed(chat_id)
         self._states.pop(chat_id, None)
 
+    async def _close_feed(self, chat_id: int) -> None:
+        # The shared decoder stops once its last chat has gone.
+        feed = self._feeds.pop(chat_id, None)
+        if feed is not None:
+            await feed.close()
+
     async def _progress_loop(self, chat_id: int) -> None:
         while True:
             state = self._states.get(chat_id)
@@ -3,10 +3,13 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable
+from typing import Any, Iterable
 
 import aiosqlite
 
+from telegram_music_bot.database import ConnectionPool, WriteOperation
+from telegram_music_bot.queue_cache import QueueCache
+
 
 @dataclass
 class QueueItem:
@@ -17,29 +20,47 @@ class QueueItem:
     requested_at: datetime
 
 
+MIGRATIONS: tuple[tuple[str, ...], ...] = (
+    (
+        """
+        CREATE TABLE IF NOT EXISTS queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            requested_at TEXT NOT NULL
+        )
+        """,
+    ),
+    # Every query filters on chat_id and orders by id; the index also covers MIN(id) and COUNT(*).
+    ("CREATE INDEX IF NOT EXISTS queue_chat_id_id ON queue (chat_id, id)",),
+)
+
+
 class QueueManager:
-    def __init__(self, database_path: str) -> None:
-        self._database_path = database_path
+    def __init__(
+        self,
+        database_path: str,
+        readers: int = 4,
+        group_commit_window: float = 0.0,
+        group_commit_max_ops: int = 64,
+        cache_chats: int = 256,
+    ) -> None:
+        self._pool = ConnectionPool(database_path, readers, group_commit_window, group_commit_max_ops)
+        self._cache: QueueCache[QueueItem] = QueueCache(cache_chats)
 
     async def initialize(self) -> None:
-        async with aiosqlite.connect(self._database_path) as db:
-            await db.execute(
-                """
-                CREATE TABLE IF NOT EXISTS queue (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    url TEXT NOT NULL,
-                    requested_at TEXT NOT NULL
-                )
-                """
-            )
-            await db.commit()
+        await self._pool.open()
+        await self._pool.migrate(MIGRATIONS)
+
+    async def close(self) -> None:
+        await self._pool.close()
 
     async def add(self, item: QueueItem) -> None:
-        async with aiosqlite.connect(self._database_path) as db:
-            await db.execute(
+        await self._write(
+            item.chat_id,
+            lambda db: db.execute(
                 """
                 INSERT INTO queue (chat_id, user_id, title, url, requested_at)
                 VALUES (?, ?, ?, ?, ?)
@@ -51,65 +72,75 @@ class QueueManager:
                     item.url,
                     item.requested_at.isoformat(),
                 ),
-            )
-            await db.commit()
+            ),
+        )
+        self._cache.append(item.chat_id, [item])
 
     async def list(self, chat_id: int) -> list[QueueItem]:
-        async with aiosqlite.connect(self._database_path) as db:
-            cursor = await db.execute(
+        cached = self._cache.get(chat_id)
+        if cached is not None:
+            return cached
+        items: list[QueueItem] | None = None
+        self._cache.begin_load(chat_id)
+        try:
+            async with self._pool.read() as db:
+                cursor = await db.execute(
+                    """
+                    SELECT chat_id, user_id, title, url, requested_at
+                    FROM queue
+                    WHERE chat_id = ?
+                    ORDER BY id ASC
+                    """,
+                    (chat_id,),
+                )
+                rows = await cursor.fetchall()
+            items = [
+                QueueItem(
+                    chat_id=row[0],
+                    user_id=row[1],
+                    title=row[2],
+                    url=row[3],
+                    requested_at=datetime.fromisoformat(row[4]),
+                )
+                for row in rows
+            ]
+        finally:
+            self._cache.finish_load(chat_id, items)
+        return items
+
+    async def pop_next(self, chat_id: int) -> QueueItem | None:
+        rows = await self._write(
+            chat_id,
+            lambda db: db.execute_fetchall(
                 """
-                SELECT chat_id, user_id, title, url, requested_at
-                FROM queue
-                WHERE chat_id = ?
-                ORDER BY id ASC
+                DELETE FROM queue
+                WHERE id = (SELECT MIN(id) FROM queue WHERE chat_id = ?)
+                RETURNING chat_id, user_id, title, url, requested_at
                 """,
                 (chat_id,),
-            )
-            rows = await cursor.fetchall()
-        return [
-            QueueItem(
+            ),
+        )
+        item = None
+        if rows:
+            row = rows[0]
+            item = QueueItem(
                 chat_id=row[0],
                 user_id=row[1],
                 title=row[2],
                 url=row[3],
                 requested_at=datetime.fromisoformat(row[4]),
             )
-            for row in rows
-        ]
-
-    async def pop_next(self, chat_id: int) -> QueueItem | None:
-        async with aiosqlite.connect(self._database_path) as db:
-            cursor = await db.execute(
-                """
-                SELECT id, chat_id, user_id, title, url, requested_at
-                FROM queue
-                WHERE chat_id = ?
-                ORDER BY id ASC
-                LIMIT 1
-                """,
-                (chat_id,),
-            )
-            row = await cursor.fetchone()
-            if not row:
-                return None
-            await db.execute("DELETE FROM queue WHERE id = ?", (row[0],))
-            await db.commit()
-
-        return QueueItem(
-            chat_id=row[1],
-            user_id=row[2],
-            title=row[3],
-            url=row[4],
-            requested_at=datetime.fromisoformat(row[5]),
-        )
+        self._cache.pop_left(chat_id, item)
+        return item
 
     async def clear(self, chat_id: int) -> None:
-        async with aiosqlite.connect(self._database_path) as db:
-            await db.execute("DELETE FROM queue WHERE chat_id = ?", (chat_id,))
-            await db.commit()
+        await self._write(chat_id, lambda db: db.execute("DELETE FROM queue WHERE chat_id = ?", (chat_id,)))
+        self._cache.replace(chat_id, [])
 
     async def seed(self, chat_id: int, items: Iterable[QueueItem]) -> None:
-        async with aiosqlite.connect(self._database_path) as db:
+        items = list(items)
+
+        async def replace(db: aiosqlite.Connection) -> None:
             await db.execute("DELETE FROM queue WHERE chat_id = ?", (chat_id,))
             await db.executemany(
                 """
@@ -127,4 +158,13 @@ class QueueManager:
                     for item in items
                 ],
             )
-            await db.commit()
+
+        await self._write(chat_id, replace)
+        self._cache.replace(chat_id, items)
+
+    async def _write(self, chat_id: int, operation: WriteOperation) -> Any:
+        try:
+            return await self._pool.run_write(operation)
+        except BaseException:
+            self._cache.invalidate(chat_id)
+            raise
@@ -0,0 +1,229 @@
+"""One decoder per track and start offset, fanned out to every call playing it."""
+from __future__ import annotations
+
+import asyncio
+import errno
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Sequence
+
+from telegram_music_bot.transcoder import PCM_CHANNELS, PCM_SAMPLE_RATE
+
+BYTES_PER_SECOND = PCM_SAMPLE_RATE * PCM_CHANNELS * 2
+READ_BYTES = BYTES_PER_SECOND // 10
+# Calls that subscribe while the decoder is still inside this window get the start replayed
+# and share it; anyone later would join mid-track, so they get a decoder of their own.
+JOIN_WINDOW_BYTES = BYTES_PER_SECOND * 2
+# The decoder only reads ahead while every listening subscriber is within this much of it,
+# so the slowest listener paces decoding instead of frames piling up in memory.
+HIGH_WATER_BYTES = BYTES_PER_SECOND
+PIPE_OPEN_TIMEOUT = 30.0
+
+DecodeCommand = Callable[[Path, float], Sequence[str]]
+
+
+def ffmpeg_command(source: Path, start: float) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-loglevel",
+        "error",
+        "-ss",
+        str(start),
+        "-i",
+        str(source),
+        "-vn",
+        "-f",
+        "s16le",
+        "-ac",
+        str(PCM_CHANNELS),
+        "-ar",
+        str(PCM_SAMPLE_RATE),
+        "-",
+    ]
+
+
+class _PipeProtocol(asyncio.Protocol):
+    def __init__(self, subscription: Subscription) -> None:
+        self._subscription = subscription
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        # The call closed its end: it stopped, skipped or left.
+        self._subscription.closed = True
+
+
+class Subscription:
+    def __init__(self, decoder: SharedDecoder, path: Path) -> None:
+        self.path = path
+        self.closed = False
+        self._decoder = decoder
+        self._pending = bytearray()
+        self._transport: asyncio.WriteTransport | None = None
+        self._connect_task = asyncio.create_task(self._connect())
+
+    @property
+    def connected(self) -> bool:
+        return self._transport is not None
+
+    def backlog(self) -> int:
+        if self._transport is not None:
+            return self._transport.get_write_buffer_size()
+        return len(self._pending)
+
+    def write(self, data: bytes) -> None:
+        if self.closed:
+            return
+        if self._transport is None:
+            self._pending += data
+        else:
+            self._transport.write(data)
+
+    def finish(self) -> None:
+        # Flushes whatever is buffered, then closes, which the reader sees as end of stream.
+        # A subscriber that is still connecting closes as soon as it has flushed.
+        if self._transport is not None:
+            self._transport.close()
+
+    async def close(self) -> None:
+        self.closed = True
+        self._connect_task.cancel()
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.abort()
+        shutil.rmtree(self.path.parent, ignore_errors=True)
+        self._decoder.unsubscribed()
+
+    async def _connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PIPE_OPEN_TIMEOUT
+        while True:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as error:
+                if error.errno != errno.ENXIO or loop.time() > deadline:
+                    logging.warning("Nobody opened %s; dropping the subscriber", self.path)
+                    self.closed = True
+                    self._decoder.unsubscribed()
+                    return
+                await asyncio.sleep(0.05)
+        self._transport, _ = await loop.connect_write_pipe(lambda: _PipeProtocol(self), os.fdopen(fd, "wb", 0))
+        if self._pending:
+            self._transport.write(bytes(self._pending))
+            self._pending.clear()
+        if self._decoder.finished:
+            self._transport.close()
+
+
+class SharedDecoder:
+    def __init__(self, hub: DecoderHub, source: Path, start: float) -> None:
+        self.key = (str(source), start)
+        self.finished = False
+        self._hub = hub
+        self._source = source
+        self._start = start
+        self._prefix = bytearray()
+        self._emitted = 0
+        self._subscribers: list[Subscription] = []
+        self._process: asyncio.subprocess.Process | None = None
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def joinable(self) -> bool:
+        return not self.finished and self._emitted < JOIN_WINDOW_BYTES
+
+    def subscribe(self) -> Subscription:
+        pipe_dir = Path(tempfile.mkdtemp(dir=self._hub.workdir))
+        path = pipe_dir / "pcm.fifo"
+        os.mkfifo(path)
+        subscription = Subscription(self, path)
+        subscription.write(bytes(self._prefix))
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribed(self) -> None:
+        if not self._live() and not self.finished:
+            self.cancel()
+
+    def cancel(self) -> None:
+        self._task.cancel()
+
+    async def wait(self) -> None:
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self._hub.decode_command(self._source, self._start),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            self._hub.decoders_started += 1
+            while self._subscribers:
+                while self._behind():
+                    await asyncio.sleep(0.02)
+                chunk = await self._process.stdout.read(READ_BYTES)
+                if not chunk:
+                    break
+                if self._emitted < JOIN_WINDOW_BYTES:
+                    self._prefix += chunk
+                else:
+                    self._prefix = bytearray()
+                self._emitted += len(chunk)
+                for subscriber in self._live():
+                    subscriber.write(chunk)
+        finally:
+            self.finished = True
+            self._hub.forget(self)
+            for subscriber in self._live():
+                subscriber.finish()
+            if self._process is not None:
+                if self._process.returncode is None:
+                    self._process.kill()
+                await self._process.wait()
+
+    def _behind(self) -> bool:
+        # Calls that have opened their feed set the pace. One that has not yet only buffers,
+        # bounded by PIPE_OPEN_TIMEOUT, unless nobody is listening at all.
+        live = self._live()
+        connected = [subscriber for subscriber in live if subscriber.connected] or live
+        return any(subscriber.backlog() > HIGH_WATER_BYTES for subscriber in connected)
+
+    def _live(self) -> list[Subscription]:
+        self._subscribers = [subscriber for subscriber in self._subscribers if not subscriber.closed]
+        return self._subscribers
+
+
+class DecoderHub:
+    def __init__(self, workdir: str, decode_command: DecodeCommand = ffmpeg_command) -> None:
+        self.workdir = Path(workdir)
+        self.decode_command = decode_command
+        self.decoders_started = 0
+        self._decoders: dict[tuple[str, float], SharedDecoder] = {}
+
+    def open(self) -> None:
+        # FIFOs left behind by a crash have no decoder or reader any more.
+        shutil.rmtree(self.workdir, ignore_errors=True)
+        self.workdir.mkdir(parents=True, exist_ok=True)
+
+    def subscribe(self, source: Path, start: float = 0.0) -> Subscription:
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        key = (str(source), start)
+        decoder = self._decoders.get(key)
+        if decoder is None or not decoder.joinable:
+            decoder = SharedDecoder(self, source, start)
+            self._decoders[key] = decoder
+        return decoder.subscribe()
+
+    def forget(self, decoder: SharedDecoder) -> None:
+        if self._decoders.get(decoder.key) is decoder:
+            del self._decoders[decoder.key]
+
+    async def close(self) -> None:
+        decoders = list(self._decoders.values())
+        for decoder in decoders:
+            decoder.cancel()
+        await asyncio.gather(*(decoder.wait() for decoder in decoders), return_exceptions=True)
@@ -0,0 +1,48 @@
+"""Background transcoding of cached tracks into the voice stack's raw input format."""
+from __future__ import annotations
+
+from pathlib import Path
+
+from telegram_music_bot.audio_cache import AudioCache
+from telegram_music_bot.cache_workers import CacheWorkerPool, run_ffmpeg
+
+# pytgcalls' InputAudioStream reads signed 16-bit little-endian mono PCM at the bitrate
+# of its AudioParameters; HighQualityAudio is 48 kHz.
+PCM_SAMPLE_RATE = 48000
+PCM_CHANNELS = 1
+
+
+async def transcode_to_pcm(source: Path, target: Path) -> None:
+    await run_ffmpeg(
+        "-y",
+        "-i",
+        str(source),
+        "-vn",
+        "-f",
+        "s16le",
+        "-ac",
+        str(PCM_CHANNELS),
+        "-ar",
+        str(PCM_SAMPLE_RATE),
+        str(target),
+    )
+
+
+class PcmTranscoder(CacheWorkerPool):
+    def __init__(self, cache: AudioCache, workers: int = 1, min_hits: int = 3) -> None:
+        super().__init__(workers)
+        self._cache = cache
+        self._min_hits = min_hits
+
+    async def pending(self) -> list[tuple[str, Path]]:
+        return await self._cache.pending_transcode(self._min_hits)
+
+    async def process(self, cache_key: str, path: Path) -> None:
+        staged = self._cache.staging_dir() / "audio.pcm"
+        try:
+            await transcode_to_pcm(path, staged)
+        except Exception:
+            self._cache.discard(staged.parent)
+            await self._cache.mark_pcm_failed(cache_key)
+            raise
+        await self._cache.store_pcm(cache_key, staged)
@@ -47,6 +47,11 @@ class UIComponents:
         ]
         return InlineKeyboardMarkup(keyboard)
 
+    @staticmethod
+    def download_message(title: str, percent: int) -> str:
+        bar = PlaybackStatus(title, percent, 100, False).progress_bar()
+        return f"Downloading: {title}\n{bar} {percent}%"
+
     @staticmethod
     def status_message(status: PlaybackStatus) -> str:
         state = "Playing" if status.is_playing else "Paused"
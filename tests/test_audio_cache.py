@@ -0,0 +1,139 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from telegram_music_bot.audio_cache import AudioCache  # noqa: E402
+from telegram_music_bot import loudness, transcoder  # noqa: E402
+from telegram_music_bot.audio_streamer import video_key  # noqa: E402
+
+
+async def _stage(cache: AudioCache, name: str, size: int) -> Path:
+    staged = cache.staging_dir() / name
+    staged.write_bytes(b"x" * size)
+    return staged
+
+
+@pytest.mark.asyncio
+async def test_audio_cache_serves_hits_and_evicts_least_recently_used(tmp_path):
+    cache = AudioCache(str(tmp_path / "audio"), max_bytes=250)
+    await cache.open()
+    try:
+        first = await cache.store("youtube:a", await _stage(cache, "a.webm", 100), "A", 10)
+        await cache.store("youtube:b", await _stage(cache, "b.webm", 100), "B", 20)
+        assert first.path.read_bytes() == b"x" * 100
+        assert (await cache.get("youtube:a")).title == "A"
+
+        # "b" is now the least recently used entry, so it makes room for "c".
+        await cache.store("youtube:c", await _stage(cache, "c.webm", 100), "C", 30)
+        assert await cache.get("youtube:b") is None
+        assert await cache.get("youtube:a") is not None
+        assert await cache.total_bytes() == 200
+        assert sorted(path.name for path in (tmp_path / "audio").glob("*.webm")) == [
+            "youtube_a.webm",
+            "youtube_c.webm",
+        ]
+    finally:
+        await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_audio_cache_drops_partial_downloads_on_open(tmp_path):
+    cache = AudioCache(str(tmp_path / "audio"), max_bytes=1000)
+    await cache.open()
+    partial = await _stage(cache, "d.webm.part", 50)
+    await cache.close()
+
+    reopened = AudioCache(str(tmp_path / "audio"), max_bytes=1000)
+    await reopened.open()
+    try:
+        assert not partial.exists()
+        assert await reopened.get("youtube:d") is None
+    finally:
+        await reopened.close()
+
+
+def test_video_key_is_known_without_extraction():
+    assert video_key("https://youtu.be/dQw4w9WgXcQ") == "youtube:dQw4w9WgXcQ"
+    assert video_key("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=5") == "youtube:dQw4w9WgXcQ"
+    # Every URL form of a video shares one cache entry.
+    for url in (
+        "https://m.youtube.com/shorts/dQw4w9WgXcQ",
+        "https://www.youtube.com/live/dQw4w9WgXcQ?feature=share",
+        "https://www.youtube.com/embed/dQw4w9WgXcQ",
+    ):
+        assert video_key(url) == "youtube:dQw4w9WgXcQ"
+    assert video_key("https://www.youtube.com/playlist?list=PL1") is None
+    assert video_key("never gonna give you up") is None
+
+
+@pytest.mark.asyncio
+async def test_loudness_analyzer_stores_gain_once_per_track(tmp_path, monkeypatch):
+    measured = []
+
+    async def fake_measure(path):
+        measured.append(path.name)
+        return -20.0 if path.name.startswith("youtube_quiet") else -6.0
+
+    monkeypatch.setattr(loudness, "measure_loudness", fake_measure)
+    cache = AudioCache(str(tmp_path / "audio"), max_bytes=1000)
+    await cache.open()
+    analyzer = loudness.LoudnessAnalyzer(cache, target_lufs=-14.0, workers=2)
+    try:
+        await cache.store("youtube:quiet", await _stage(cache, "q.webm", 10), "Quiet", 1)
+        await cache.store("youtube:loud", await _stage(cache, "l.webm", 10), "Loud", 1)
+        analyzer.start()
+        for _ in range(100):
+            if not await cache.pending_analysis():
+                break
+            await asyncio.sleep(0.01)
+        analyzer.wake()
+        await asyncio.sleep(0.05)
+
+        assert (await cache.get("youtube:quiet")).gain_db == 6.0
+        assert (await cache.get("youtube:loud")).gain_db == -8.0
+        assert sorted(measured) == ["youtube_loud.webm", "youtube_quiet.webm"]
+        assert loudness.volume_percent(6.0) == 200 and loudness.volume_percent(0.0) == 100
+    finally:
+        await analyzer.close()
+        await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_transcoder_stores_pcm_copy_within_budget(tmp_path, monkeypatch):
+    async def fake_transcode(source, target):
+        target.write_bytes(b"\0" * 40)
+
+    monkeypatch.setattr(transcoder, "transcode_to_pcm", fake_transcode)
+    cache = AudioCache(str(tmp_path / "audio"), max_bytes=150)
+    await cache.open()
+    pool = transcoder.PcmTranscoder(cache, workers=1, min_hits=2)
+    try:
+        await cache.store("youtube:a", await _stage(cache, "a.webm", 50), "A", 1)
+        await cache.store("youtube:c", await _stage(cache, "c.webm", 10), "C", 1)
+        # Only a track played from the cache often enough is worth a PCM copy.
+        await cache.get("youtube:a")
+        await cache.get("youtube:c")
+        assert await cache.pending_transcode(min_hits=2) == []
+        await cache.get("youtube:a")
+        pool.start()
+        for _ in range(100):
+            if (await cache.get("youtube:a")).pcm_path is not None:
+                break
+            await asyncio.sleep(0.01)
+        entry = await cache.get("youtube:a")
+        assert entry.pcm_path.read_bytes() == b"\0" * 40
+        assert (await cache.get("youtube:c")).pcm_path is None
+        assert await cache.total_bytes() == 100
+
+        # Source and PCM copy are budgeted and evicted together.
+        await cache.store("youtube:b", await _stage(cache, "b.webm", 80), "B", 1)
+        assert await cache.get("youtube:a") is None
+        assert not entry.pcm_path.exists()
+    finally:
+        await pool.close()
+        await cache.close()
@@ -0,0 +1,91 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+import extraction_pool  # noqa: E402
+from audio_streamer import AudioStreamer  # noqa: E402
+from extraction_pool import ExtractionPool, ExtractorBusy  # noqa: E402
+
+
+class CountingExtractor:
+    def __init__(self, delay: float = 0.2) -> None:
+        self.calls = 0
+        self._delay = delay
+
+    async def extract(self, query):
+        self.calls += 1
+        await asyncio.sleep(self._delay)
+        return {"url": "https://example.com/audio", "title": query, "duration": 10, "id": "abc"}
+
+    async def close(self):
+        return None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_resolves_share_one_extraction():
+    extractor = CountingExtractor()
+    streamer = AudioStreamer(extractor=extractor)
+
+    sources = await asyncio.gather(*(streamer.resolve("Trending  Song") for _ in range(100)))
+
+    assert extractor.calls == 1
+    assert all(source is sources[0] for source in sources)
+
+
+def test_is_playlist_only_for_playlist_links():
+    assert AudioStreamer.is_playlist("https://www.youtube.com/playlist?list=PL123")
+    assert AudioStreamer.is_playlist("https://music.youtube.com/browse?list=OLAK5uy")
+    assert not AudioStreamer.is_playlist("https://www.youtube.com/watch?v=abc&list=RDabc&start_radio=1")
+    assert not AudioStreamer.is_playlist("https://youtu.be/abc?list=PL123")
+    assert not AudioStreamer.is_playlist("lofi list")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_shared_resolve():
+    extractor = CountingExtractor()
+    streamer = AudioStreamer(extractor=extractor)
+
+    first = asyncio.ensure_future(streamer.resolve("song"))
+    second = asyncio.ensure_future(streamer.resolve("song"))
+    await asyncio.sleep(0.05)
+    first.cancel()
+
+    assert (await second).title == "song"
+    assert first.cancelled()
+    assert extractor.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_extraction_pool_rejects_when_full_and_times_out(monkeypatch):
+    release = threading.Event()
+
+    def blocking_extract(query):
+        release.wait(5)
+        return {"title": query}
+
+    monkeypatch.setattr(extraction_pool, "_run_extract", blocking_extract)
+    pool = ExtractionPool({}, workers=1, max_pending=1, timeout=0.2)
+    try:
+        running = asyncio.ensure_future(pool.extract("a"))
+        queued = asyncio.ensure_future(pool.extract("b"))
+        await asyncio.sleep(0.05)
+        assert (pool.stats.running, pool.stats.queue_depth) == (1, 1)
+        with pytest.raises(ExtractorBusy):
+            await pool.extract("c")
+
+        with pytest.raises(asyncio.TimeoutError):
+            await running
+        # The hung job still holds its worker, so the queued one has not started yet.
+        assert pool.stats.queue_depth == 1
+        release.set()
+        assert await queued == {"title": "b"}
+        assert (pool.stats.timed_out, pool.stats.rejected, pool.stats.completed) == (1, 1, 1)
+    finally:
+        release.set()
+        await pool.close()
@@ -0,0 +1,154 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from bridge_transport import StreamTransport  # noqa: E402
+from telegram_music_bot import bridge_server  # noqa: E402
+from telegram_music_bot.bridge_server import BridgeMessage, RedisBridge  # noqa: E402
+from telegram_music_bot.config import Config  # noqa: E402
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    monkeypatch.setattr(bridge_server.redis, "from_url", from_url)
+    return from_url
+
+
+@pytest.fixture
+def package_config(monkeypatch):
+    def load(**env):
+        monkeypatch.setenv("BOT_TOKEN", "token")
+        monkeypatch.setenv("API_ID", "1")
+        monkeypatch.setenv("API_HASH", "hash")
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        return Config.from_env()
+
+    return load
+
+
+@pytest.mark.asyncio
+async def test_download_progress_skips_the_actions_stream(fake_redis, package_config):
+    config = package_config(BRIDGE_TRANSPORT="streams")
+    player, bot = RedisBridge(config), RedisBridge(config)
+    progress = bot.subscribe_progress()
+    received = asyncio.ensure_future(progress.__anext__())
+    await asyncio.sleep(0.05)
+
+    update = BridgeMessage("download_progress", 7, 1, {"query": "song", "percent": 40})
+    await player.publish_progress(update)
+
+    assert await asyncio.wait_for(received, 1) == update
+    assert not await fake_redis("redis://fake", decode_responses=True).exists(config.bridge_channel)
+    await progress.aclose()
+    await player.close()
+    await bot.close()
+
+
+async def _take(stream, count: int) -> list:
+    return [await asyncio.wait_for(stream.__anext__(), 1) for _ in range(count)]
+
+
+def _stream_transport(consumer: str, **options) -> StreamTransport:
+    return StreamTransport("redis://fake", stream="actions", consumer=consumer, batch=2, block_ms=50, **options)
+
+
+@pytest.mark.asyncio
+async def test_stream_transport_replays_its_own_unfinished_batch(fake_redis):
+    publisher = _stream_transport("bot")
+    # The publisher creates the group, so actions sent before the player starts wait for it.
+    for n in range(5):
+        await publisher.publish({"n": n})
+    redis = fake_redis("redis://fake", decode_responses=True)
+
+    player = _stream_transport("w1")
+    stream = player.subscribe()
+    taken = await _take(stream, 3)
+    assert [payload["n"] for payload in taken] == [0, 1, 2]
+    # Only what was handled is acked; the rest of the second batch is still in flight.
+    await player.ack(taken[:2])
+    assert (await redis.xpending("actions", "premium"))["pending"] == 2
+    await stream.aclose()
+    await player.close()
+
+    # Entry 2 is trimmed while pending: it comes back without fields and is only acked.
+    pending = await redis.xpending_range("actions", "premium", "-", "+", 10)
+    await redis.xdel("actions", pending[0]["message_id"])
+    restarted = _stream_transport("w1")
+    stream = restarted.subscribe()
+    taken = await _take(stream, 2)
+    assert [payload["n"] for payload in taken] == [3, 4]
+    await restarted.ack(taken)
+    assert (await redis.xpending("actions", "premium"))["pending"] == 0
+    await stream.aclose()
+    await restarted.close()
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_transport_claims_what_a_dead_consumer_left(fake_redis):
+    publisher = _stream_transport("bot")
+    for n in range(3):
+        await publisher.publish({"n": n})
+    redis = fake_redis("redis://fake", decode_responses=True)
+
+    dead = _stream_transport("dead")
+    stream = dead.subscribe()
+    await _take(stream, 1)
+    await stream.aclose()
+    await dead.close()
+
+    survivor = _stream_transport("w2", claim_idle_ms=0)
+    stream = survivor.subscribe()
+    assert [payload["n"] for payload in await _take(stream, 3)] == [0, 1, 2]
+    pending = await redis.xpending("actions", "premium")
+    assert all(consumer["name"] != "dead" or not consumer["pending"] for consumer in pending["consumers"])
+    # What the survivor is still handling is never claimed back by the survivor itself.
+    await asyncio.sleep(0.01)
+    assert (await redis.xpending("actions", "premium"))["pending"] == 3
+    assert await survivor._claim() == []
+    await stream.aclose()
+    await survivor.close()
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_package_bridge_replays_pending_entries_for_a_stable_consumer(fake_redis, package_config):
+    config = package_config(BRIDGE_TRANSPORT="streams", BRIDGE_BATCH="2", BRIDGE_CONSUMER="player-1")
+    bot = RedisBridge(config)
+    for n in range(3):
+        await bot.publish(BridgeMessage("play", n, 1, {"query": str(n)}))
+
+    player = RedisBridge(config)
+    stream = player.subscribe()
+    assert [message.chat_id for message in await _take(stream, 1)] == [0]
+    await stream.aclose()
+    await player.close()
+    redis = fake_redis("redis://fake", decode_responses=True)
+    pending = await redis.xpending(config.bridge_channel, bridge_server.STREAM_GROUP)
+    assert [consumer["name"] for consumer in pending["consumers"]] == ["player-1"]
+
+    # Restarted under the same name, the player gets its unfinished batch back first.
+    restarted = RedisBridge(config)
+    stream = restarted.subscribe()
+    messages = await _take(stream, 3)
+    assert [message.chat_id for message in messages] == [0, 1, 2]
+    # Each entry stays pending until the player reports its action done.
+    assert (await redis.xpending(config.bridge_channel, bridge_server.STREAM_GROUP))["pending"] == 3
+    for message in messages:
+        await restarted.ack(message)
+    assert (await redis.xpending(config.bridge_channel, bridge_server.STREAM_GROUP))["pending"] == 0
+    await stream.aclose()
+    await restarted.close()
+    await bot.close()
@@ -0,0 +1,167 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from chat_dispatcher import ChatDispatcher  # noqa: E402
+from control_coalescer import COALESCED_ACTIONS, coalesce  # noqa: E402
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_orders_actions_per_chat_and_runs_chats_concurrently():
+    handled: list[tuple[int, int]] = []
+    release_slow_chat = asyncio.Event()
+
+    async def handle(payloads):
+        (payload,) = payloads
+        if payload["chat_id"] == 1 and payload["n"] == 0:
+            # A join that hangs in chat 1 must not hold up chat 2.
+            await release_slow_chat.wait()
+        handled.append((payload["chat_id"], payload["n"]))
+
+    dispatcher = ChatDispatcher(handle, mailbox_size=8, idle_timeout=60)
+    for n in range(3):
+        dispatcher.dispatch(1, {"chat_id": 1, "n": n})
+        dispatcher.dispatch(2, {"chat_id": 2, "n": n})
+    await asyncio.sleep(0.01)
+    assert handled == [(2, 0), (2, 1), (2, 2)]
+    assert dispatcher.mailbox_depth(1) == 2
+    assert dispatcher.depths() == {1: 2}
+
+    release_slow_chat.set()
+    await asyncio.sleep(0.01)
+    assert [n for chat_id, n in handled if chat_id == 1] == [0, 1, 2]
+    assert dispatcher.stats.handled == 6
+    assert dispatcher.stats.queued == 0
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_bounds_mailboxes_and_reaps_idle_actors():
+    blocked = asyncio.Event()
+
+    async def handle(payloads):
+        await blocked.wait()
+
+    dispatcher = ChatDispatcher(handle, mailbox_size=2, idle_timeout=0.05)
+    try:
+        assert dispatcher.dispatch(7, {"chat_id": 7, "action": "vol_up"})
+        await asyncio.sleep(0.01)
+        # One action is being handled and two wait; the fourth finds the mailbox full.
+        results = [dispatcher.dispatch(7, {"chat_id": 7, "action": "vol_up"}) for _ in range(3)]
+        assert results == [True, True, False]
+        assert dispatcher.stats.dropped == 1
+        assert dispatcher.stats.peak_depth == 2
+
+        blocked.set()
+        await asyncio.sleep(0.2)
+        assert dispatcher.stats.actors == 0
+        assert dispatcher.stats.reaped == 1
+    finally:
+        blocked.set()
+        await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_full_mailbox_evicts_taps_but_never_drops_essential_actions():
+    blocked = asyncio.Event()
+    handled: list[str] = []
+    dropped: list[str] = []
+
+    async def handle(payloads):
+        await blocked.wait()
+        handled.extend(payload["action"] for payload in payloads)
+
+    dispatcher = ChatDispatcher(
+        handle,
+        mailbox_size=2,
+        idle_timeout=60,
+        essential={"skip", "stop"},
+        on_drop=lambda payload: dropped.append(payload["action"]),
+    )
+    try:
+        dispatcher.dispatch(7, {"chat_id": 7, "action": "vol_up"})
+        await asyncio.sleep(0.01)
+        dispatcher.dispatch(7, {"chat_id": 7, "action": "pause"})
+        dispatcher.dispatch(7, {"chat_id": 7, "action": "vol_down"})
+        # The oldest tap makes way for the skip; with no taps left the stop exceeds the bound.
+        assert dispatcher.dispatch(7, {"chat_id": 7, "action": "skip"})
+        assert dispatcher.dispatch(7, {"chat_id": 7, "action": "vol_up"}) is False
+        assert dispatcher.dispatch(7, {"chat_id": 7, "action": "skip"})
+        assert dispatcher.dispatch(7, {"chat_id": 7, "action": "stop"})
+        assert dispatcher.mailbox_depth(7) == 3
+        assert dispatcher.stats.dropped == 3
+        # Told about each drop, so a stream entry behind it can still be acknowledged.
+        assert dropped == ["pause", "vol_up", "vol_down"]
+
+        blocked.set()
+        await asyncio.sleep(0.01)
+        assert handled == ["vol_up", "skip", "skip", "stop"]
+        assert dispatcher.stats.queued == 0
+    finally:
+        blocked.set()
+        await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_coalesces_control_bursts_in_order():
+    turns: list[list[str]] = []
+
+    async def handle(payloads):
+        turns.append([payload["action"] for payload in payloads])
+
+    dispatcher = ChatDispatcher(handle, idle_timeout=60, window=0.05, batchable=COALESCED_ACTIONS)
+    try:
+        for action in ["vol_up", "vol_up", "pause", "vol_down", "rewind", "pause", "pause"]:
+            dispatcher.dispatch(3, {"chat_id": 3, "action": action})
+        await asyncio.sleep(0.2)
+        # The first tap runs at once and only what follows within the window is folded;
+        # rewind cannot be folded, so it ends the burst and runs on its own, in order.
+        assert turns == [["vol_up"], ["vol_up", "pause", "vol_down"], ["rewind"], ["pause"], ["pause"]]
+        assert dispatcher.stats.handled == 7
+        assert dispatcher.stats.coalesced == 2
+
+        # A lone tap does not wait out the window.
+        turns.clear()
+        dispatcher.dispatch(4, {"chat_id": 4, "action": "play"})
+        await asyncio.sleep(0.01)
+        assert turns == [["play"]]
+    finally:
+        await dispatcher.close()
+
+
+def _burst(*actions):
+    return coalesce({"chat_id": 3, "action": action} for action in actions)
+
+
+def test_coalesce_sums_volume_and_folds_pause_toggles():
+    burst = _burst("vol_up", "vol_up", "vol_down", "pause", "pause", "pause")
+    assert burst.reset is None
+    assert burst.volume_delta == 10
+    assert burst.playing_after(True) is False
+    assert burst.playing_after(False) is True
+
+    assert _burst("pause", "pause").playing_after(True) is True
+    # An explicit resume fixes the state; only toggles after it count.
+    assert _burst("pause", "resume").playing_after(False) is True
+    assert _burst("resume", "pause").playing_after(False) is False
+
+
+def test_coalesce_keeps_only_what_follows_the_last_play_or_skip():
+    burst = _burst("pause", "vol_up", "skip", "play", "preload", "skip", "skip", "play", "vol_up")
+    assert burst.reset["action"] == "play"
+    assert burst.skips == 3
+    assert burst.forced_playing is None and burst.toggles == 0
+    # Volume and the upcoming track belong to the call, which stays joined across tracks.
+    assert burst.volume_delta == 20
+    assert burst.preload["action"] == "preload"
+
+    burst = _burst("vol_up", "preload", "stop")
+    assert burst.volume_delta == 0 and burst.preload is None
+    # A stop folded into a later play still leaves the call first.
+    assert _burst("stop", "vol_up", "play").left
+    assert not _burst("skip", "play").left
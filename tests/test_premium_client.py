@@ -0,0 +1,310 @@
+import asyncio
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+
+class FakeAudioPiped:
+    def __init__(self, path, audio_parameters=None, additional_ffmpeg_parameters=""):
+        self.path = path
+        self.additional_ffmpeg_parameters = additional_ffmpeg_parameters
+
+
+try:
+    import pytgcalls  # noqa: F401
+except ImportError:
+    # The voice stack is not installed here; the player only needs its names to import.
+    input_stream = types.ModuleType("pytgcalls.types.input_stream")
+    input_stream.AudioPiped = FakeAudioPiped
+    quality = types.ModuleType("pytgcalls.types.input_stream.quality")
+    quality.HighQualityAudio = object
+    stub = types.ModuleType("pytgcalls")
+    stub.PyTgCalls = object
+    sys.modules.update(
+        {
+            "pytgcalls": stub,
+            "pytgcalls.types": types.ModuleType("pytgcalls.types"),
+            "pytgcalls.types.input_stream": input_stream,
+            "pytgcalls.types.input_stream.quality": quality,
+        }
+    )
+
+import bridge_transport  # noqa: E402
+import premium_client  # noqa: E402
+from bridge_transport import StreamTransport  # noqa: E402
+
+
+class FakeCalls:
+    def __init__(self, client):
+        self.calls: list[tuple] = []
+        self.fail_crossfade = False
+        self.leaving: asyncio.Event | None = None
+
+    def names(self):
+        return [call[0] for call in self.calls]
+
+    def on_stream_end(self):
+        return lambda handler: handler
+
+    async def join_group_call(self, chat_id, stream):
+        self.calls.append(("join", chat_id, stream))
+
+    async def change_stream(self, chat_id, stream):
+        if self.fail_crossfade and stream.additional_ffmpeg_parameters:
+            raise RuntimeError("ffmpeg could not open the outgoing input")
+        self.calls.append(("change", chat_id, stream))
+
+    async def pause_stream(self, chat_id):
+        self.calls.append(("pause", chat_id))
+
+    async def resume_stream(self, chat_id):
+        self.calls.append(("resume", chat_id))
+
+    async def leave_group_call(self, chat_id):
+        self.calls.append(("leave", chat_id))
+        if self.leaving is not None:
+            await self.leaving.wait()
+
+    async def change_volume_call(self, chat_id, volume):
+        self.calls.append(("volume", chat_id, volume))
+
+
+class NullTransport:
+    async def ack(self, payloads):
+        return
+
+
+@pytest.fixture
+def make_player(monkeypatch):
+    monkeypatch.setattr(premium_client, "TelegramClient", lambda *args, **kwargs: None)
+    monkeypatch.setattr(premium_client, "PyTgCalls", FakeCalls)
+    monkeypatch.setattr(premium_client, "AudioPiped", FakeAudioPiped)
+
+    def make(transport=None, **options):
+        return premium_client.PremiumMusicPlayer("test", 1, "hash", transport=transport or NullTransport(), **options)
+
+    return make
+
+
+async def _close(player):
+    for task in list(player._idle_leaves.values()):
+        task.cancel()
+    await player._dispatcher.close()
+
+
+class FakeStreamer:
+    def __init__(self, *expiries):
+        self.expiries = list(expiries)
+        self.refreshes: list[bool] = []
+
+    async def resolve(self, query, refresh=False):
+        self.refreshes.append(refresh)
+        expires_at = time.time() + self.expiries.pop(0)
+        return types.SimpleNamespace(url=f"{query}/{len(self.refreshes)}", expires_at=expires_at)
+
+
+def _play(url, **metadata):
+    return {"action": "play", "chat_id": 5, "metadata": {"url": url, **metadata}}
+
+
+@pytest.mark.asyncio
+async def test_tracks_switch_in_the_joined_call_and_keep_its_volume(make_player):
+    player = make_player()
+    try:
+        calls = player._calls
+        await player._handle_action(_play("https://cdn/a"))
+        await player._handle_action({"action": "vol_up", "chat_id": 5})
+        await player._handle_action(_play("https://cdn/b"))
+
+        # Only the first track joins; the next one swaps the input of the call in place.
+        assert calls.names() == ["join", "volume", "change"]
+        assert calls.calls[2][2].path == "https://cdn/b"
+        assert player._state[5].volume == 110
+
+        await player.adjust_volume(5, 10)
+        assert calls.calls[-1] == ("volume", 5, 120)
+        metrics = player.metrics()
+        assert (metrics["joins"], metrics["switches"], metrics["idle_leaves"]) == (1, 1, 0)
+        assert metrics["transition_p50_ms"] is not None and metrics["transition_p95_ms"] is not None
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_play_after_a_skip_resumes_the_silenced_call(make_player):
+    player = make_player()
+    try:
+        calls = player._calls
+        await player._handle_action(_play("https://cdn/a"))
+        await player.skip(5)
+        assert calls.names() == ["join", "pause"]
+        assert 5 in player._joined and 5 not in player._state
+
+        await player._handle_action(_play("https://cdn/b"))
+        assert calls.names() == ["join", "pause", "change", "resume"]
+        assert 5 not in player._silenced
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_idle_call_is_left_only_when_nothing_comes(make_player):
+    player = make_player(call_idle_timeout=0.05)
+    try:
+        calls = player._calls
+        await player._handle_action(_play("https://cdn/a"))
+        await player.adjust_volume(5, 20)
+        await player.skip(5)
+        await asyncio.sleep(0.01)
+        # A play inside the timeout cancels the pending leave.
+        await player._handle_action(_play("https://cdn/b"))
+        await asyncio.sleep(0.1)
+        assert "leave" not in calls.names()
+        assert player.stats.idle_leaves == 0
+
+        await player.skip(5)
+        await asyncio.sleep(0.1)
+        assert calls.names()[-1] == "leave"
+        assert player.stats.idle_leaves == 1
+        assert not player._joined and not player._volumes
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_play_during_an_idle_leave_waits_for_it_to_finish(make_player):
+    player = make_player(call_idle_timeout=0.02)
+    try:
+        calls = player._calls
+        calls.leaving = asyncio.Event()
+        await player._handle_action(_play("https://cdn/a"))
+        await player.skip(5)
+        await asyncio.sleep(0.05)
+        assert calls.names()[-1] == "leave"
+
+        # The play is queued behind the leave still in flight rather than joining alongside it.
+        player._dispatcher.dispatch(5, _play("https://cdn/b"))
+        await asyncio.sleep(0.02)
+        assert "join" not in calls.names()[1:]
+        calls.leaving.set()
+        await asyncio.sleep(0.02)
+        assert calls.names() == ["join", "pause", "leave", "join"]
+        assert 5 in player._joined and player.stats.idle_leaves == 1
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_stream_end_of_a_replaced_track_is_ignored(make_player):
+    player = make_player()
+    try:
+        await player._handle_action(_play("https://cdn/a"))
+        ended_at = time.monotonic()
+        await player._handle_action(_play("https://cdn/b"))
+
+        # The end of "a" was reported before "b" started, so "b" keeps playing.
+        await player._handle_action({"action": "stream_end", "chat_id": 5, "ended_at": ended_at})
+        assert player._state[5].source_url == "https://cdn/b"
+        assert not player._idle_leaves
+
+        await player._handle_action({"action": "stream_end", "chat_id": 5, "ended_at": time.monotonic()})
+        assert 5 not in player._state
+        assert 5 in player._idle_leaves
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_crossfade_skips_an_expired_outgoing_url_and_falls_back_on_error(make_player):
+    player = make_player(crossfade=2.0)
+    try:
+        calls = player._calls
+        await player._handle_action(_play("https://cdn/a", expires_at=time.time() + 3600))
+        await player._handle_action(_play("https://cdn/b", expires_at=time.time() - 60))
+        assert "acrossfade=d=2.0" in calls.calls[-1][2].additional_ffmpeg_parameters
+        assert "-i https://cdn/a" in calls.calls[-1][2].additional_ffmpeg_parameters
+
+        # "b" has expired, so it cannot be opened again to fade it out.
+        await player._handle_action(_play("https://cdn/c", expires_at=time.time() + 3600))
+        assert not calls.calls[-1][2].additional_ffmpeg_parameters
+
+        calls.fail_crossfade = True
+        await player._handle_action(_play("https://cdn/d"))
+        assert calls.calls[-1][2].path == "https://cdn/d"
+        assert not calls.calls[-1][2].additional_ffmpeg_parameters
+        assert player.stats.switches == 3
+    finally:
+        await _close(player)
+
+
+@pytest.mark.asyncio
+async def test_refresh_bypasses_a_cached_url_inside_the_margin(make_player):
+    player = make_player(refresh_margin=600)
+    # The cache still holds a URL with 400 s left; only a fresh extraction clears the margin.
+    player._streamer = FakeStreamer(400, 3600)
+    try:
+        await player._handle_action(
+            _play("https://cdn/a", webpage_url="https://youtu.be/a", expires_at=time.time() + 100)
+        )
+        assert player._streamer.refreshes == [False, True]
+        assert player._calls.calls[-1][2].path == "https://youtu.be/a/2"
+    finally:
+        await _close(player)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    monkeypatch.setattr(bridge_transport.redis, "from_url", from_url)
+    return from_url
+
+
+def _stream_transport(consumer):
+    return StreamTransport("redis://fake", stream="actions", consumer=consumer, block_ms=50)
+
+
+@pytest.mark.asyncio
+async def test_stream_entry_is_acked_only_once_its_action_has_run(make_player, fake_redis):
+    publisher = _stream_transport("bot")
+    await publisher.publish(_play("https://cdn/a"))
+    redis = fake_redis("redis://fake", decode_responses=True)
+
+    transport = _stream_transport("player")
+    player = make_player(transport=transport)
+    stream = transport.subscribe()
+    payload = await asyncio.wait_for(stream.__anext__(), 1)
+    player._dispatcher.dispatch(5, payload)
+    # The player dies with the play still in the chat's mailbox.
+    await _close(player)
+    await stream.aclose()
+    await transport.close()
+    assert (await redis.xpending("actions", "premium"))["pending"] == 1
+
+    transport = _stream_transport("player")
+    restarted = make_player(transport=transport)
+    stream = transport.subscribe()
+    try:
+        payload = await asyncio.wait_for(stream.__anext__(), 1)
+        restarted._dispatcher.dispatch(5, payload)
+        for _ in range(100):
+            if not (await redis.xpending("actions", "premium"))["pending"]:
+                break
+            await asyncio.sleep(0.01)
+        assert restarted._calls.names() == ["join"]
+        assert (await redis.xpending("actions", "premium"))["pending"] == 0
+    finally:
+        await _close(restarted)
+        await stream.aclose()
+        await transport.close()
+        await publisher.close()
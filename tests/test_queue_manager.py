@@ -1,12 +1,21 @@
+import asyncio
+import json
+import sqlite3
 import sys
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(PROJECT_ROOT))
 
-from queue_manager import QueueItem, QueueManager  # noqa: E402
+import bot_client  # noqa: E402
+import queue_manager  # noqa: E402
+from audio_streamer import AudioSource  # noqa: E402
+from extraction_pool import ExtractorBusy  # noqa: E402
+from prefetcher import Prefetcher  # noqa: E402
+from queue_manager import MIGRATIONS, POSITION_STEP, QueueItem, QueueManager, RedisQueueManager  # noqa: E402
 
 
 @pytest.mark.asyncio
@@ -26,3 +35,341 @@ async def test_enqueue_and_pop(tmp_path):
     assert next_item is not None
     assert next_item.title == "Song"
     assert await manager.list_queue(123) == []
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_setup_opens_wal_pool(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"), readers=2)
+    await manager.setup()
+
+    async with manager._pool.read() as db:
+        cursor = await db.execute("PRAGMA journal_mode")
+        assert (await cursor.fetchone())[0] == "wal"
+
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_enqueue_across_managers(tmp_path):
+    db_path = str(tmp_path / "queues.db")
+    first, second = QueueManager(db_path), QueueManager(db_path)
+    await first.setup()
+    await second.setup()
+
+    await asyncio.gather(
+        *(
+            (first if index % 2 else second).enqueue(7, QueueItem(title=str(index), url="u", requested_by=1))
+            for index in range(20)
+        )
+    )
+
+    assert sorted(int(item.title) for item in await first.list_queue(7)) == list(range(20))
+    popped = await asyncio.gather(first.pop_next(7), second.pop_next(7))
+    assert popped[0].title != popped[1].title
+    assert len(await second.list_queue(7)) == 18
+
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_group_commit_shares_transactions(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"), group_commit_window=0.05, group_commit_max_ops=8)
+    await manager.setup()
+    commits_before = manager._pool.commits
+
+    await asyncio.gather(
+        *(manager.enqueue(1, QueueItem(title=str(index), url="u", requested_by=1)) for index in range(16))
+    )
+
+    assert manager._pool.commits - commits_before == 2
+    assert [item.title for item in await manager.list_queue(1)] == [str(index) for index in range(16)]
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_serves_reads_and_evicts_lru(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"), cache_chats=1)
+    await manager.setup()
+    await manager.enqueue(1, QueueItem(title="A", url="u", requested_by=1))
+    assert [item.title for item in await manager.list_queue(1)] == ["A"]
+
+    async with manager._pool.write() as db:
+        await db.execute("DELETE FROM queues")
+        await db.commit()
+    await manager.enqueue(1, QueueItem(title="B", url="u", requested_by=1))
+    assert [item.title for item in await manager.list_queue(1)] == ["A", "B"]
+
+    await manager.list_queue(2)
+    assert [item.title for item in await manager.list_queue(1)] == ["B"]
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_enqueue_many_appends_in_order(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"), cache_chats=0)
+    await manager.setup()
+    await manager.enqueue(1, QueueItem(title="first", url="u", requested_by=1))
+    await manager.enqueue_many(1, [QueueItem(title=str(index), url="u", requested_by=1) for index in range(3)])
+
+    assert await manager.count(1) == 4
+    assert [item.title for item in await manager.list_queue(1)] == ["first", "0", "1", "2"]
+    await manager.close()
+
+
+@pytest.mark.parametrize("cache_chats", [0, 16])
+@pytest.mark.asyncio
+async def test_list_queue_keyset_pages(tmp_path, cache_chats):
+    manager = QueueManager(str(tmp_path / "queues.db"), cache_chats=cache_chats)
+    await manager.setup()
+    await manager.enqueue_many(1, [QueueItem(title=str(index), url="u", requested_by=1) for index in range(25)])
+    await manager.list_queue(1)
+
+    first = await manager.list_queue(1, limit=10)
+    second = await manager.list_queue(1, after_position=first[-1].position, limit=10)
+    back = await manager.list_queue(1, before_position=second[0].position, limit=10)
+
+    assert [item.title for item in second] == [str(index) for index in range(10, 20)]
+    assert back == first
+    assert await manager.count(1) == 25
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_setup_migrates_json_blob_queue(tmp_path):
+    db_path = tmp_path / "queues.db"
+    legacy = sqlite3.connect(db_path)
+    legacy.execute(
+        "CREATE TABLE queues (chat_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+        "item_json TEXT NOT NULL, PRIMARY KEY (chat_id, position))"
+    )
+    legacy.executemany(
+        "INSERT INTO queues VALUES (?, ?, ?)",
+        [
+            (5, 0, json.dumps({"title": "Old", "url": "u", "requested_by": 2, "metadata": {}})),
+            (5, 1, json.dumps({"title": "Tagged", "url": "v", "requested_by": 3, "metadata": {"k": 1}})),
+        ],
+    )
+    legacy.commit()
+    legacy.close()
+
+    manager = QueueManager(str(db_path))
+    await manager.setup()
+
+    items = await manager.list_queue(5)
+    assert [(item.title, item.requested_by, item.metadata) for item in items] == [
+        ("Old", 2, {}),
+        ("Tagged", 3, {"k": 1}),
+    ]
+    async with manager._pool.read() as db:
+        cursor = await db.execute("PRAGMA user_version")
+        assert (await cursor.fetchone())[0] == len(MIGRATIONS)
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_reorder_operations(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"))
+    await manager.setup()
+    await manager.enqueue_many(1, [QueueItem(title=title, url="u", requested_by=1) for title in "abcde"])
+
+    async def titles() -> str:
+        on_disk = "".join(item.title for item in await manager._load_page(1, None, None, None))
+        assert "".join(item.title for item in await manager.list_queue(1)) == on_disk
+        return on_disk
+
+    await manager.list_queue(1)
+    assert (await manager.move(1, 0, 3)).title == "a"
+    assert await titles() == "bcdae"
+    await manager.play_next(1, QueueItem(title="z", url="u", requested_by=1))
+    assert await titles() == "zbcdae"
+    assert (await manager.remove_at(1, 2)).title == "c"
+    assert await manager.remove_at(1, 9) is None
+    assert await titles() == "zbdae"
+
+    for _ in range(40):
+        await manager.move(1, 4, 1)
+    assert len(await titles()) == 5
+
+    await manager.shuffle(1)
+    assert sorted(await titles()) == sorted("zbdae")
+    await manager.close()
+
+
+@pytest.fixture
+def redis_manager(monkeypatch):
+    # fakeredis runs the queue's Lua scripts through lupa.
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        queue_manager.redis, "from_url", lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+    )
+    return RedisQueueManager("redis://fake")
+
+
+@pytest.mark.asyncio
+async def test_redis_enqueue_pop_and_pages(redis_manager):
+    manager = redis_manager
+    await manager.setup()
+    await manager.enqueue(1, QueueItem(title="first", url="u", requested_by=1))
+    await manager.enqueue_many(1, [QueueItem(title=str(index), url="u", requested_by=1) for index in range(24)])
+    # Identical items stay distinct members.
+    await manager.enqueue_many(2, [QueueItem(title="same", url="u", requested_by=1)] * 2)
+
+    assert await manager.count(1) == 25
+    assert await manager.count(2) == 2
+    first = await manager.list_queue(1, limit=10)
+    second = await manager.list_queue(1, after_position=first[-1].position, limit=10)
+    back = await manager.list_queue(1, before_position=second[0].position, limit=10)
+    assert [item.title for item in first] == ["first", *map(str, range(9))]
+    assert [item.position for item in first[:2]] == [POSITION_STEP, 2 * POSITION_STEP]
+    assert [item.title for item in second] == [str(index) for index in range(9, 19)]
+    assert back == first
+
+    assert (await manager.pop_next(1)).title == "first"
+    assert await manager.count(1) == 24
+    await manager.clear(1)
+    assert await manager.pop_next(1) is None
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_reorder_operations(redis_manager):
+    manager = redis_manager
+    await manager.enqueue_many(1, [QueueItem(title=title, url="u", requested_by=1) for title in "abcde"])
+
+    async def titles() -> str:
+        return "".join(item.title for item in await manager.list_queue(1))
+
+    assert (await manager.move(1, 0, 3)).title == "a"
+    assert await titles() == "bcdae"
+    assert (await manager.move(1, 4, 99)).title == "e"
+    assert await manager.move(1, 9, 0) is None
+    await manager.play_next(1, QueueItem(title="z", url="u", requested_by=1))
+    assert await titles() == "zbcdae"
+    assert (await manager.remove_at(1, 2)).title == "c"
+    assert await manager.remove_at(1, 9) is None
+    assert await titles() == "zbdae"
+
+    # Repeated moves into the same gap exhaust it and force a respace.
+    for _ in range(40):
+        await manager.move(1, 4, 1)
+    assert sorted(await titles()) == sorted("zbdae")
+    positions = [item.position for item in await manager.list_queue(1)]
+    assert positions == sorted(set(positions))
+
+    await manager.shuffle(1)
+    assert sorted(await titles()) == sorted("zbdae")
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_redis_update_item_replaces_only_a_queued_entry(redis_manager):
+    manager = redis_manager
+    await manager.enqueue_many(1, [QueueItem(title=title, url="u", requested_by=1) for title in "ab"])
+    queued = await manager.list_queue(1)
+    ready = QueueItem(title="a", url="u/stream", requested_by=1, metadata={"needs_resolve": False})
+
+    assert await manager.update_item(1, queued[0], ready)
+    assert [(item.url, item.position) for item in await manager.list_queue(1)][0] == ("u/stream", queued[0].position)
+    # The old entry is gone, so a second update (or one for a popped item) finds nothing.
+    assert not await manager.update_item(1, queued[0], ready)
+    popped = await manager.pop_next(1)
+    assert not await manager.update_item(1, popped, queued[0])
+    await manager.close()
+
+
+class _FakeStreamer:
+    def __init__(self) -> None:
+        self.resolved: list[str] = []
+
+    async def resolve(self, query):
+        self.resolved.append(query)
+        return AudioSource(url=f"{query}/stream", title=query, duration=1, metadata={"id": query})
+
+
+@pytest.mark.parametrize("cache_chats", [0, 16])
+@pytest.mark.asyncio
+async def test_prefetcher_resolves_upcoming_items_in_place(tmp_path, cache_chats):
+    manager = QueueManager(str(tmp_path / "queues.db"), cache_chats=cache_chats)
+    await manager.setup()
+    await manager.enqueue_many(
+        1,
+        [
+            QueueItem(title=f"Track {n}", url=f"https://example.com/{n}", requested_by=1, metadata={"needs_resolve": True})
+            for n in range(4)
+        ],
+    )
+    streamer = _FakeStreamer()
+    prefetcher = Prefetcher(manager, streamer, depth=2)
+
+    prefetcher.notify(1)
+    await asyncio.gather(*prefetcher._tasks.values())
+
+    assert streamer.resolved == ["https://example.com/0", "https://example.com/1"]
+    items = await manager.list_queue(1)
+    assert [item.url for item in items[:2]] == ["https://example.com/0/stream", "https://example.com/1/stream"]
+    assert [item.metadata["needs_resolve"] for item in items] == [False, False, True, True]
+    # An entry that was popped in the meantime is not resurrected.
+    popped = await manager.pop_next(1)
+    assert not await manager.update_item(1, popped, QueueItem(title="x", url="y", requested_by=1))
+    await prefetcher.close()
+    await manager.close()
+
+
+class _StuckStreamer:
+    async def resolve(self, query):
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_prefetcher_close_does_not_restart_a_dirty_chat(tmp_path):
+    manager = QueueManager(str(tmp_path / "queues.db"))
+    await manager.setup()
+    await manager.enqueue(1, QueueItem(title="t", url="https://example.com/t", requested_by=1, metadata={"needs_resolve": True}))
+    prefetcher = Prefetcher(manager, _StuckStreamer(), depth=1)
+
+    prefetcher.notify(1)
+    await asyncio.sleep(0.01)
+    # The queue changed mid-pass, so the chat is due another one when this pass ends.
+    prefetcher.notify(1)
+    await prefetcher.close()
+    await asyncio.sleep(0.01)
+
+    assert prefetcher._tasks == {}
+    prefetcher.notify(1)
+    assert prefetcher._tasks == {}
+    await manager.close()
+
+
+class _BusyStreamer:
+    def __init__(self) -> None:
+        self.attempts = 0
+
+    async def resolve(self, query):
+        self.attempts += 1
+        raise ExtractorBusy("full")
+
+
+@pytest.mark.asyncio
+async def test_pop_playable_gives_up_on_a_sustained_overload(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot_client, "BUSY_RETRY_SECONDS", 0)
+    manager = QueueManager(str(tmp_path / "queues.db"))
+    await manager.setup()
+    await manager.enqueue(1, QueueItem(title="t", url="https://example.com/t", requested_by=1, metadata={"needs_resolve": True}))
+    streamer = _BusyStreamer()
+    prefetcher = Prefetcher(manager, streamer, depth=1)
+    context = SimpleNamespace(
+        application=SimpleNamespace(bot_data={"queue": manager, "streamer": streamer, "prefetcher": prefetcher})
+    )
+
+    with pytest.raises(ExtractorBusy):
+        await bot_client.pop_playable(context, 1)
+    await prefetcher.close()
+
+    # The entry is kept at the front for the next attempt.
+    assert [item.title for item in await manager.list_queue(1)] == ["t"]
+    assert streamer.attempts >= bot_client.BUSY_RETRIES
+    await manager.close()
@@ -0,0 +1,79 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from audio_streamer import AudioSource, cache_keys, stream_expiry  # noqa: E402
+from queue_manager import MIGRATIONS, QueueManager  # noqa: E402
+from resolve_cache import ResolveCache, SQLiteStore  # noqa: E402
+
+
+def _source(expire: float) -> AudioSource:
+    url = f"https://rr1.googlevideo.com/videoplayback?expire={int(expire)}&id=abc"
+    return AudioSource(url=url, title="Song", duration=200, metadata={}, expires_at=stream_expiry(url))
+
+
+def test_cache_keys_share_youtube_video_id():
+    assert cache_keys("https://youtu.be/dQw4w9WgXcQ")[0] == cache_keys(
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1"
+    )[0]
+    assert cache_keys("  Never  Gonna ") == ["q:never gonna"]
+
+
+@pytest.mark.asyncio
+async def test_cache_respects_stream_expiry_and_persists(tmp_path):
+    store_path = str(tmp_path / "cache.db")
+    cache = ResolveCache(expiry_margin=60, store=SQLiteStore(store_path))
+    await cache.open()
+    await cache.put(["q:song", "id:youtube:abc"], _source(time.time() + 3600))
+    await cache.put(["q:stale"], _source(time.time() + 30))
+
+    assert (await cache.get(["id:youtube:abc"])).title == "Song"
+    assert await cache.get(["q:stale"]) is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    await cache.close()
+
+    restarted = ResolveCache(store=SQLiteStore(store_path))
+    await restarted.open()
+    assert (await restarted.get(["q:song"])).duration == 200
+    assert restarted.stats.persistent_hits == 1
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_shared_entries_honour_the_readers_margin(tmp_path):
+    store_path = str(tmp_path / "cache.db")
+    writer = ResolveCache(expiry_margin=60, store=SQLiteStore(store_path))
+    await writer.open()
+    await writer.put(["q:song"], _source(time.time() + 400))
+    await writer.close()
+
+    # The player refreshes 600 s ahead, so a URL with 400 s left is already stale for it.
+    reader = ResolveCache(expiry_margin=600, store=SQLiteStore(store_path))
+    await reader.open()
+    assert await reader.get(["q:song"]) is None
+    assert reader.stats.misses == 1
+    await reader.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_shares_the_queue_database_migrations(tmp_path):
+    db_path = str(tmp_path / "queues.db")
+    store = SQLiteStore(db_path)
+    await store.open()
+    await store.set(["q:song"], "{}", time.time() + 60)
+    await store.close()
+
+    # The queue's migrations already ran with the store's, so the queue opens on the same file.
+    manager = QueueManager(db_path)
+    await manager.setup()
+    async with manager._pool.read() as db:
+        cursor = await db.execute("PRAGMA user_version")
+        assert (await cursor.fetchone())[0] == len(MIGRATIONS)
+        cursor = await db.execute("SELECT cache_key FROM resolve_cache")
+        assert await cursor.fetchall() == [("q:song",)]
+    await manager.close()
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+import sharding  # noqa: E402
+from bridge_transport import ACTIONS_CHANNEL, create_bridge_transport  # noqa: E402
+from sharding import HashRing, WorkerRegistry, create_sharded_transport  # noqa: E402
+
+CHATS = range(-1001000000000, -1001000000000 + 20000)
+
+
+def test_hash_ring_spreads_chats_evenly():
+    ring = HashRing(["w1", "w2", "w3", "w4"])
+    load = Counter(ring.owner(chat_id) for chat_id in CHATS)
+    assert set(load) == {"w1", "w2", "w3", "w4"}
+    assert max(load.values()) < 1.5 * len(CHATS) / 4
+    assert HashRing([]).owner(1) is None
+
+
+def test_hash_ring_moves_only_the_chats_of_a_worker_that_joins_or_leaves():
+    before = HashRing(["w1", "w2", "w3"])
+    after = HashRing(["w1", "w2", "w3", "w4"])
+    moved = [chat_id for chat_id in CHATS if before.owner(chat_id) != after.owner(chat_id)]
+    # Only chats that w4 now owns change hands, about a quarter of them.
+    assert all(after.owner(chat_id) == "w4" for chat_id in moved)
+    assert 0.15 < len(moved) / len(CHATS) < 0.35
+
+    shrunk = HashRing(["w1", "w3"])
+    moved = [chat_id for chat_id in CHATS if before.owner(chat_id) != shrunk.owner(chat_id)]
+    assert all(before.owner(chat_id) == "w2" for chat_id in moved)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+
+    def from_url(url, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, **kwargs)
+
+    monkeypatch.setattr(sharding.redis, "from_url", from_url)
+    return from_url("redis://fake", decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_publish_routes_each_chat_to_its_owner_stream(fake_redis):
+    registry = WorkerRegistry("redis://fake")
+    for worker in ("w1", "w2"):
+        await registry.heartbeat(worker)
+    publisher = create_sharded_transport("streams", "redis://fake")
+
+    for chat_id in range(40):
+        await publisher.publish({"action": "skip", "chat_id": chat_id})
+
+    ring = HashRing(["w1", "w2"])
+    for worker in ("w1", "w2"):
+        entries = await fake_redis.xrange(f"{ACTIONS_CHANNEL}:{worker}")
+        routed = [json.loads(fields["data"])["chat_id"] for _, fields in entries]
+        assert routed and all(ring.owner(chat_id) == worker for chat_id in routed)
+    assert await fake_redis.xlen(f"{ACTIONS_CHANNEL}:w1") + await fake_redis.xlen(f"{ACTIONS_CHANNEL}:w2") == 40
+    await publisher.close()
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_a_dead_worker_is_reaped_exactly_once(fake_redis):
+    first, second = WorkerRegistry("redis://fake", ttl=1), WorkerRegistry("redis://fake", ttl=1)
+    await first.heartbeat("live")
+    await fake_redis.zadd("premium_workers", {"dead": time.time() - 10})
+
+    reaped = await asyncio.gather(first.reap(), second.reap())
+
+    assert sorted(reaped) == [[], ["dead"]]
+    assert await first.live_workers() == ["live"]
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_membership_adopts_and_reroutes_a_dead_workers_backlog(fake_redis):
+    # The dead worker read one action without finishing it and never got to the others.
+    dead = create_bridge_transport("streams", "redis://fake", channel=f"{ACTIONS_CHANNEL}:dead", consumer="dead")
+    for chat_id in (1, 2, 3):
+        await dead.publish({"action": "play", "chat_id": chat_id})
+    await fake_redis.xreadgroup("premium", "dead", {f"{ACTIONS_CHANNEL}:dead": ">"}, count=1)
+    await dead.close()
+    await fake_redis.zadd("premium_workers", {"dead": time.time() - 10})
+
+    worker = create_sharded_transport("streams", "redis://fake", heartbeat_ttl=0.3, worker_id="w1")
+    rings = []
+
+    async def on_change(ring):
+        rings.append(ring)
+
+    membership = asyncio.create_task(worker.run_membership(on_change))
+    try:
+        for _ in range(100):
+            if rings and not await fake_redis.exists(f"{ACTIONS_CHANNEL}:dead"):
+                break
+            await asyncio.sleep(0.01)
+        entries = await fake_redis.xrange(f"{ACTIONS_CHANNEL}:w1")
+        assert [json.loads(fields["data"])["chat_id"] for _, fields in entries] == [1, 2, 3]
+        assert rings[-1].workers == {"w1"}
+        assert await fake_redis.zrange("premium_workers", 0, -1) == ["w1"]
+    finally:
+        membership.cancel()
+        await asyncio.gather(membership, return_exceptions=True)
+    # A worker that shuts down leaves the ring at once.
+    assert await fake_redis.zrange("premium_workers", 0, -1) == []
+    await worker.close()
@@ -0,0 +1,48 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from telegram_music_bot import shared_decoder  # noqa: E402
+
+
+def _read_fifo(path: Path) -> bytes:
+    with path.open("rb") as feed:
+        return feed.read()
+
+
+@pytest.mark.asyncio
+async def test_shared_decoder_fans_one_decode_out_to_every_chat(tmp_path):
+    # cat stands in for ffmpeg: the "decoded" PCM is the file itself.
+    track = tmp_path / "track.pcm"
+    track.write_bytes(bytes(range(256)) * 4096)
+    hub = shared_decoder.DecoderHub(str(tmp_path / "feeds"), decode_command=lambda source, start: ["cat", str(source)])
+
+    feeds = [hub.subscribe(track) for _ in range(3)]
+    received = await asyncio.gather(*(asyncio.to_thread(_read_fifo, feed.path) for feed in feeds))
+    assert received == [track.read_bytes()] * 3
+    assert hub.decoders_started == 1
+
+    # Once the decoder is past the start, a new chat gets a decoder of its own.
+    late = hub.subscribe(track)
+    assert await asyncio.to_thread(_read_fifo, late.path) == track.read_bytes()
+    assert hub.decoders_started == 2
+
+    for feed in [*feeds, late]:
+        await feed.close()
+    await hub.close()
+    assert not any((tmp_path / "feeds").iterdir())
+
+
+def test_hub_open_clears_fifos_left_by_a_crash(tmp_path):
+    workdir = tmp_path / "feeds"
+    (workdir / "stale").mkdir(parents=True)
+    (workdir / "stale" / "feed").write_bytes(b"")
+
+    shared_decoder.DecoderHub(str(workdir)).open()
+
+    assert workdir.is_dir() and not any(workdir.iterdir())
@@ -41,6 +41,29 @@ def render_progress_bar(status: PlaybackStatus, width: int = 20) -> str:
     return "▰" * filled + "▱" * (width - filled)
 
 
-def queue_list(items: Iterable[str]) -> str:
-    lines = [f"{idx}. {item}" for idx, item in enumerate(items, start=1)]
-    return "\n".join(lines) if lines else "Queue is empty."
+def queue_list(items: Iterable[str], start: int = 1, total: int | None = None, title_width: int = 64) -> str:
+    lines = [
+        f"{idx}. {item if len(item) <= title_width else item[: title_width - 1] + '…'}"
+        for idx, item in enumerate(items, start=start)
+    ]
+    if not lines:
+        return "Queue is empty."
+    if total is not None:
+        lines.append(f"\nShowing {start}–{start + len(lines) - 1} of {total}")
+    return "\n".join(lines)
+
+
+def queue_page_controls(
+    first_position: int, last_position: int, start: int, page_size: int, total: int
+) -> InlineKeyboardMarkup | None:
+    # Callback data carries the keyset cursor plus the index of the target page's first row.
+    buttons = []
+    if start > 1:
+        buttons.append(
+            InlineKeyboardButton("◀️ Prev", callback_data=f"queue:prev:{first_position}:{max(start - page_size, 1)}")
+        )
+    if start + page_size <= total:
+        buttons.append(
+            InlineKeyboardButton("Next ▶️", callback_data=f"queue:next:{last_position}:{start + page_size}")
+        )
+    return InlineKeyboardMarkup([buttons]) if buttons else None